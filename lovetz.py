@@ -1,4 +1,4 @@
-from xml.etree.ElementTree import parse
+from xml.etree.ElementTree import parse, fromstring
 import json
 import csv
 import re
@@ -7,6 +7,25 @@ import sys
 import urllib.parse
 import os.path
 import base64
+import importlib
+import importlib.util
+import functools
+import socketserver
+import tempfile
+import heapq
+import itertools
+import hashlib
+import mmap
+import stat
+import time
+import random
+import shlex
+import subprocess
+import concurrent.futures
+import array
+import collections
+import codecs
+import multiprocessing
 
 
 LOG_ERROR = 2
@@ -23,6 +42,56 @@ LOG_RAW = "raw"
 LOG_JSON = "json"
 LOG_CSV = "csv"
 
+# default cap on how much of a response body is handed
+# to plugins; see LovetzBodyBudget below.
+BODY_MAX = 1024 * 1024
+
+# default memory budget for findings before they spill to disk;
+# see LovetzEventStore below.
+EVENT_MEMORY = 256 * 1024 * 1024
+
+# content classes, as decided by classify_content at ingest.
+# only CONTENT_TEXT bodies are handed to plugins by default.
+
+CONTENT_EMPTY = "empty"
+CONTENT_TEXT = "text"
+CONTENT_BINARY = "binary"
+
+# what a plugin wants its response_body as (LovetzPlugin.body_type):
+# decoded text, the raw bytes (a bytes-like object, such as a
+# memoryview; re's bytes patterns work on it as is), or nothing at all.
+BODY_TEXT = "text"
+BODY_BYTES = "bytes"
+
+CHARSET_RE = re.compile(r";\s*charset\s*=\s*[\"']?([^\s;\"']+)", re.I)
+
+TEXT_TYPES = re.compile(r"^(text/|application/([a-z0-9.+-]+\+)?(json|xml)$|"
+                        r"application/(x-)?(javascript|ecmascript)$|"
+                        r"application/x-www-form-urlencoded$|"
+                        r"image/svg\+xml$)")
+
+BINARY_TYPES = re.compile(r"^(image|audio|video|font)/|"
+                          r"^application/(octet-stream|pdf|zip|gzip|wasm|"
+                          r"x-font|font-|vnd\.ms-fontobject|"
+                          r"x-shockwave-flash|protobuf|x-protobuf)")
+
+MAGIC_BYTES = (b"\x89PNG", b"GIF87a", b"GIF89a", b"\xff\xd8\xff", b"%PDF",
+               b"PK\x03\x04", b"\x1f\x8b", b"wOFF", b"wOF2", b"OTTO",
+               b"\x00\x01\x00\x00", b"\x00\x00\x01\x00", b"RIFF",
+               b"OggS", b"ID3", b"\x1aE\xdf\xa3", b"\x00asm", b"FWS",
+               b"CWS", b"ZWS")
+
+HTML_TYPES = frozenset(["text/html", "application/xhtml+xml"])
+
+# header rule conditions (see LovetzHeaderRule); any can be negated
+# with a leading "!", and severities can be given by name in rule files.
+RULE_CONDITIONS = frozenset(["present", "missing", "equals", "contains",
+                             "matches"])
+RULE_SEVERITIES = {"info": LOG_INFO, "warn": LOG_WARN, "error": LOG_ERROR}
+
+# control bytes that don't show up in text; \t, \n, \f, \r & ESC are fine
+BINARY_CONTROL = bytes(c for c in range(32) if c not in (9, 10, 12, 13, 27))
+
 
 class HeaderDict(object):
 
@@ -60,35 +129,583 @@ class HeaderDict(object):
         return list(self._storage.keys())
 
 
+def classify_content(content_type, body):
+    """ Decide whether a body is text, binary or empty, from the magic
+        bytes at its start, then the (lower-cased, parameter-free)
+        content type, then a cheap look at its first few hundred bytes.
+        Only ever looks at a prefix of the body.
+    """
+
+    if body is None or len(body) == 0:
+        return CONTENT_EMPTY
+
+    if isinstance(body, str):
+        sample = body[:512]
+
+        if "\x00" in sample:
+            return CONTENT_BINARY
+        elif content_type and BINARY_TYPES.search(content_type):
+            return CONTENT_BINARY
+        return CONTENT_TEXT
+
+    sample = bytes(body[:512])
+
+    if sample.startswith(MAGIC_BYTES) or sample[4:8] == b"ftyp":
+        return CONTENT_BINARY
+
+    if content_type:
+        if TEXT_TYPES.search(content_type):
+            return CONTENT_TEXT
+        elif BINARY_TYPES.search(content_type):
+            return CONTENT_BINARY
+
+    if b"\x00" in sample:
+        return CONTENT_BINARY
+
+    # more than ~10% odd control characters isn't text
+    if len(sample) - len(sample.translate(None, BINARY_CONTROL)) > len(sample) // 10:
+        return CONTENT_BINARY
+
+    return CONTENT_TEXT
+
+
+def mime_type(content_type):
+    """ Strip parameters from a Content-Type value: "text/html; charset=x"
+        becomes "text/html".
+    """
+
+    if not content_type:
+        return None
+
+    if isinstance(content_type, list):
+        content_type = content_type[-1]
+
+    return content_type.split(";", 1)[0].strip().lower() or None
+
+
+def content_charset(content_type):
+    """ The charset parameter of a Content-Type value, if any. """
+
+    if not content_type:
+        return None
+
+    if isinstance(content_type, list):
+        content_type = content_type[-1]
+
+    m = CHARSET_RE.search(content_type)
+    return m.group(1).lower() if m else None
+
+
+def decode_body(body, charset=None):
+    """ Text of a body that may still be bytes, decoded with charset
+        (UTF-8 when it's missing or not one Python knows).
+    """
+
+    if isinstance(body, str):
+        return body
+
+    try:
+        codecs.lookup(charset or "utf8")
+    except LookupError:
+        charset = None
+
+    return str(body, encoding=charset or "utf8", errors="replace")
+
+
+def body_bytes(body):
+    """ Bytes of a body that may have been decoded already. """
+
+    if isinstance(body, str):
+        return body.encode("utf8")
+    return body
+
+
+def url_origin(url):
+    """ scheme://host[:port] for a URL, lower-cased.
+    """
+
+    parts = urllib.parse.urlsplit(url)
+    return "{0}://{1}".format(parts.scheme.lower(), parts.netloc.lower())
+
+
+# path segments that are really identifiers: numbers, UUIDs and
+# long hex/base64-ish tokens (hashes, session ids &c.)
+SEGMENT_RES = [(re.compile(r"^\d+$"), "{int}"),
+               (re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-"
+                           r"[0-9a-f]{4}-[0-9a-f]{12}$", re.I), "{uuid}"),
+               (re.compile(r"^[0-9a-f]{16,}$", re.I), "{hex}"),
+               (re.compile(r"^(?=.*\d)[A-Za-z0-9_-]{24,}={0,2}$"), "{token}")]
+
+
+def segment_template(segment):
+    for regex, placeholder in SEGMENT_RES:
+        if regex.match(segment):
+            return placeholder
+    return segment
+
+
+def path_template(path):
+    """ /user/123/orders/9f86d081884c7d65 becomes
+        /user/{int}/orders/{hex}; see SEGMENT_RES.
+    """
+
+    return "/".join(segment_template(seg) for seg in (path or "/").split("/"))
+
+
+class LovetzTag(object):
+    """ One tag from a LovetzHTMLDocument. Attributes are only parsed
+        when asked for; text holds the contents of script & style
+        elements.
+    """
+    __slots__ = ['name', 'closing', 'raw', 'text', '_attrs']
+
+    attr_re = re.compile(r"""([^\s=/>"']+)(?:\s*=\s*"""
+                         r"""(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+
+    def __init__(self, name, closing=False, raw="", text=None):
+        self.name = name
+        self.closing = closing
+        self.raw = raw
+        self.text = text
+        self._attrs = None
+
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            self._attrs = {}
+            for m in self.attr_re.finditer(self.raw):
+                key = m.group(1).lower()
+                if key not in self._attrs:
+                    self._attrs[key] = m.group(2) or m.group(3) or \
+                        m.group(4) or ""
+        return self._attrs
+
+    def get(self, key, value=None):
+        return self.attrs.get(key, value)
+
+
+class LovetzHTMLDocument(object):
+    """ Lazily tokenized HTML response body, shared by every plugin
+        that sets html_aware: the body is only split into LovetzTags
+        (in one regex pass, skipping comments and the insides of
+        script & style) the first time a plugin asks for tags.
+    """
+    __slots__ = ['body', '_tags']
+
+    token_re = re.compile(r"<!--.*?-->|"
+                          r"<(script|style)\b([^>]*)>(.*?)</(?:script|style)\s*>|"
+                          r"<(/?)([a-zA-Z][\w:.-]*)([^>]*)>",
+                          re.I | re.S)
+
+    def __init__(self, body):
+        self.body = body
+        self._tags = None
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            body = self.body
+
+            if not isinstance(body, str):
+                body = bytes(body).decode("utf8", "replace")
+
+            tags = []
+            for m in self.token_re.finditer(body):
+                if m.group(1):
+                    name = m.group(1).lower()
+                    tags.append(LovetzTag(name, raw=m.group(2),
+                                          text=m.group(3)))
+                    tags.append(LovetzTag(name, closing=True))
+                elif m.group(5):
+                    tags.append(LovetzTag(m.group(5).lower(),
+                                          closing=bool(m.group(4)),
+                                          raw=m.group(6)))
+            self._tags = tags
+
+        return self._tags
+
+
+class LovetzBodyBudget(object):
+    """ Limits on how much of a response body a plugin gets to scan:
+
+        - max_bytes: larger bodies are cut down to a head & tail window
+        - head, tail: size of those windows; by default max_bytes is
+          split evenly between the two
+        - skip_above: larger bodies aren't handed over at all
+
+        None means no limit. Sizes are in bytes, or characters for
+        bodies that were already text in the history (HAR &c.); the
+        window is cut before any decoding.
+    """
+    __slots__ = ['max_bytes', 'head', 'tail', 'skip_above']
+
+    def __init__(self, max_bytes=None, head=None, tail=None,
+                 skip_above=None):
+
+        if max_bytes is None and (head is not None or tail is not None):
+            max_bytes = (head or 0) + (tail or 0)
+
+        if max_bytes is not None:
+            if head is None and tail is None:
+                tail = max_bytes // 2
+                head = max_bytes - tail
+            elif head is None:
+                head = max(max_bytes - tail, 0)
+            elif tail is None:
+                tail = max(max_bytes - head, 0)
+
+        self.max_bytes = max_bytes
+        self.head = head
+        self.tail = tail
+        self.skip_above = skip_above
+
+    def key(self):
+        return (self.max_bytes, self.head, self.tail, self.skip_above)
+
+    def apply(self, body):
+
+        if not body:
+            return body
+
+        size = len(body)
+
+        if self.skip_above is not None and size > self.skip_above:
+            return body[:0]
+
+        if self.max_bytes is None or size <= self.max_bytes:
+            return body
+
+        # keep a line break between the windows so that a regex
+        # can't match across the gap we've cut out.
+        sep = "\n" if isinstance(body, str) else b"\n"
+        tail = body[size - self.tail:] if self.tail else body[:0]
+
+        # join, rather than +, so that memoryviews work too
+        return sep.join((body[:self.head], tail))
+
+
+class LovetzMemoryBudget(object):
+    """ Memory shared by a set of LovetzEventStores. Once the events
+        they hold in memory (roughly) exceed limit bytes, the largest
+        stores spill what they have to their segment files under
+        spill_dir, until they're back under half the limit; small
+        stores are left alone.
+    """
+
+    def __init__(self, limit, spill_dir=None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.used = 0
+        self.stores = []
+
+    def charge(self, size):
+        self.used += size
+        if self.used > self.limit:
+            for store in sorted(self.stores, key=lambda s: s.size,
+                                reverse=True):
+                if self.used <= self.limit // 2 or not store.size:
+                    break
+                store.spill()
+
+
+class LovetzEventStore(object):
+    """ Append-only list of events that, given a LovetzMemoryBudget,
+        moves them to an on-disk segment file (as runs of JSON lines)
+        whenever the budget is exceeded. Iterating yields the spilled
+        events first, then those still in memory, in the order they
+        were appended.
+    """
+
+    # how many sorted runs sorted() merges at once; more than this
+    # are merged in several passes.
+    fanin = 64
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.memory = []
+        self.size = 0
+        self.segment = None
+        self.runs = []   # (offset, count) per spill
+        self.spilled = 0
+
+        if budget is not None:
+            budget.stores.append(self)
+
+    def __len__(self):
+        return self.spilled + len(self.memory)
+
+    def append(self, event):
+        self.memory.append(event)
+
+        if self.budget is not None:
+            # a rough guess at the dict & its strings; plenty good
+            # enough to keep us in the right ballpark.
+            size = 400 + sum(len(v) for v in event.values()
+                             if isinstance(v, str))
+            self.size += size
+            self.budget.charge(size)
+
+    def spill(self):
+        if not self.memory:
+            return
+
+        if self.segment is None:
+            self.segment = tempfile.TemporaryFile(dir=self.budget.spill_dir)
+
+        self.segment.seek(0, os.SEEK_END)
+        self.runs.append((self.segment.tell(), len(self.memory)))
+
+        for event in self.memory:
+            self.segment.write(json.dumps(event, default=str).encode("utf8"))
+            self.segment.write(b"\n")
+
+        self.spilled += len(self.memory)
+        self.budget.used -= self.size
+        self.memory = []
+        self.size = 0
+
+    def _run(self, offset, count, fh=None):
+        # track our own position, since appends (or other runs being
+        # read from the same file) may move the file's
+        fh = fh or self.segment
+        pos = offset
+        for _ in range(count):
+            fh.seek(pos)
+            line = fh.readline()
+            pos += len(line)
+            yield json.loads(line)
+
+    @staticmethod
+    def _write(fh, events):
+        """ Append events to fh as a run; returns its (offset, count) """
+
+        fh.seek(0, os.SEEK_END)
+        offset = fh.tell()
+        count = 0
+
+        for event in events:
+            fh.write(json.dumps(event, default=str).encode("utf8"))
+            fh.write(b"\n")
+            count += 1
+
+        return (offset, count)
+
+    def __iter__(self):
+        for offset, count in list(self.runs):
+            for event in self._run(offset, count):
+                yield event
+        for event in list(self.memory):
+            yield event
+
+    def sorted(self, key):
+        """ Events in key order (stable), without ever holding more
+            than one run in memory: each spilled run is sorted into a
+            single temporary file, and the runs merged fanin at a
+            time, so only two files are ever open.
+        """
+
+        if not self.runs:
+            return iter(sorted(self.memory, key=key))
+
+        fh = tempfile.TemporaryFile(dir=self.budget.spill_dir)
+        runs = [self._write(fh, sorted(self._run(offset, count), key=key))
+                for offset, count in self.runs]
+
+        if self.memory:
+            runs.append(self._write(fh, sorted(self.memory, key=key)))
+
+        while len(runs) > self.fanin:
+            out = tempfile.TemporaryFile(dir=self.budget.spill_dir)
+            runs = [self._write(out, self._merge(fh, runs[idx:idx + self.fanin], key))
+                    for idx in range(0, len(runs), self.fanin)]
+            fh.close()
+            fh = out
+
+        return self._merged(fh, runs, key)
+
+    def _merge(self, fh, runs, key):
+        return heapq.merge(*[self._run(offset, count, fh)
+                             for offset, count in runs], key=key)
+
+    def _merged(self, fh, runs, key):
+        try:
+            for event in self._merge(fh, runs, key):
+                yield event
+        finally:
+            fh.close()
+
+    def clear(self):
+        if self.budget is not None:
+            self.budget.used -= self.size
+        if self.segment is not None:
+            self.segment.close()
+        self.memory = []
+        self.size = 0
+        self.segment = None
+        self.runs = []
+        self.spilled = 0
+
+
 class LovetzPlugin(object):
 
-    def __init__(self, style=LOG_RAW, verbose=False):
+    # name & tags are how the plugin is selected from the command line
+    # (see LovetzPluginRegistry); default says whether it runs when no
+    # explicit selection is made.
+    name = None
+    tags = ()
+    default = True
+
+    # plugins that need more (or less) of the response body than the
+    # engine-wide budget can override this with their own
+    # LovetzBodyBudget; None means use the engine's.
+    body_budget = None
+
+    # by default only text-like response bodies reach check; plugins
+    # that really want images & the like can set this.
+    binary_bodies = False
+
+    # how the plugin wants response_body: BODY_TEXT (decoded using
+    # the response's charset), BODY_BYTES, or None for plugins that
+    # never read it (they get ""). Decoding only happens when some
+    # plugin asks for text.
+    body_type = BODY_TEXT
+
+    # plugins that look at HTML set this, and have their check called
+    # with an extra html keyword: the item's shared LovetzHTMLDocument
+    # (or None when the response isn't HTML).
+    html_aware = False
+
+    # set by a de-duplicating engine to the fingerprint of the item
+    # being checked, so that findings can be attributed to every
+    # source the transaction was seen in.
+    fingerprint = None
+
+    # likewise the URL template of the item being checked, when the
+    # engine is collapsing endpoints (see LovetzTemplater).
+    template = None
+
+    def __init__(self, style=LOG_RAW, verbose=False, body_budget=None,
+                 memory_budget=None, min_severity=LOG_INFO, suppress=None,
+                 entry_name=None, header_rules=()):
         # no longer need to have the DOM checks here; moved them to the
         # reader, which I believe is a cleaner location.
-        self.events = []
+        self.events = LovetzEventStore(memory_budget)
         self.style = style
         self.verbose = verbose
 
+        # extra LovetzHeaderRules (from --header-rules), for plugins
+        # that evaluate header rules
+        self.header_rules = list(header_rules)
+
+        if body_budget is not None:
+            self.body_budget = body_budget
+
+        # min_severity is a level, or {plugin name: level} with None
+        # as the default; suppress is a list of plugin names (drop
+        # everything it logs) & "name:text" (drop messages containing
+        # text). Severity is checked before any formatting; text is
+        # matched against the finished message, though templates
+        # that already contain it are never formatted (see wants).
+        # Plugins are named as the registry knows them (entry_name),
+        # which for directory & entry point plugins is the file or
+        # entry point name rather than the class's own.
+        name = entry_name or self.name or self.__class__.__name__.lower()
+
+        if isinstance(min_severity, dict):
+            min_severity = min_severity.get(name,
+                                            min_severity.get(None, LOG_INFO))
+        self.min_severity = min_severity
+
+        self.suppress = []
+        for token in suppress or []:
+            pname, _, text = token.partition(":")
+            if pname == name:
+                self.suppress.append(text)
+
+        self.suppressed = {}    # message template -> suppressed?
+
     def check(self, url, response_headers, request_headers,
               response_body, request_body, request_status, response_status):
         raise NotImplemented("base lovetz plugin class")
 
+    def observe(self, item):
+        """ Called with every item the engine is given, before it
+            decides whether to check it at all (-S, duplicates,
+            templates, deadlines); for plugins that need to know about
+            the whole history rather than just what gets checked.
+        """
+        pass
+
+    def finish(self):
+        """ Called once every item has been checked; plugins that
+            aggregate across items log their findings here.
+        """
+        pass
+
+    def reset(self):
+        """ Forget everything seen so far, so that a long-lived plugin
+            (see LovetzService) can start on a new history. Compiled
+            checks & caches are kept.
+        """
+        self.events.clear()
+
+    def wants(self, event, message):
+        """ Whether a finding could be kept; plugins can ask before
+            doing the work of building one. message is the template:
+            suppressed text is matched against the finished message
+            (see log), so this only says no to a template that already
+            contains it.
+        """
+
+        if event < self.min_severity:
+            return False
+
+        if not self.suppress:
+            return True
+
+        if message not in self.suppressed:
+            self.suppressed[message] = any(text in message
+                                           for text in self.suppress)
+        return not self.suppressed[message]
+
     def log(self, event, url, message, request_headers=None,
-            response_headers=None, response=None, request=None):
+            response_headers=None, response=None, request=None, args=None):
+        """ Record a finding. message can be a format string, with its
+            arguments in args; it's then only formatted (and the
+            event only made) if the finding is wanted at all.
+        """
+
+        if args is not None:
+            if not self.wants(event, message):
+                return
+            message = message.format(*args)
+        elif event < self.min_severity:
+            return
+
+        if any(text in message for text in self.suppress):
+            return
 
         # really, this should be just access a class-level member that
         # handles the actual output... but for now this is enough.
 
         outputs = ["[-]", "[!]", "[+]"]
 
-        self.events.append(dict(source=self.__class__.__name__,
-                                event=event,
-                                url=url,
-                                message=message,
-                                request_headers=request_headers,
-                                response_headers=response_headers,
-                                request=request,
-                                response=response))
+        val = dict(source=self.__class__.__name__,
+                   event=event,
+                   url=url,
+                   message=message,
+                   request_headers=request_headers,
+                   response_headers=response_headers,
+                   request=request,
+                   response=response)
+
+        if self.fingerprint is not None:
+            val['fingerprint'] = self.fingerprint.hex()
+
+        if self.template is not None:
+            val['template'] = self.template
+
+        self.events.append(val)
         if self.verbose:
             print("{0} ({1}) {2} for {3}".format(outputs[event],
                                                self.__class__.__name__,
@@ -96,46 +713,219 @@ class LovetzPlugin(object):
                                                url))
 
 
-class CORSPlugin(LovetzPlugin):
+class LovetzHeaderRule(object):
+    """ One declarative header check: when header meets condition
+        (present, missing, equals, contains or matches a regex, any of
+        them negated with "!"; negated value conditions only hold when
+        the header is there), log message at severity. message can
+        use {0} for the header's value and {header} for its name.
 
-    def check(self, url, response_headers, request_headers,
-              response_body, request_body, request_status, response_status):
+        also is a list of (header, condition, argument) that must hold
+        on the same response too; final stops any later rules for the
+        same header (in the same list; see LovetzHeaderTable) once this
+        one fires. call names a method of the
+        owning plugin that returns (event, message) pairs for the
+        value, for checks that don't fit the format.
+    """
 
-        headers = ["access-control-allow-methods",
-                   "access-control-allow-headers",
-                   "access-control-max-age",
-                   "access-control-expose-headers",
-                   "access-control-allow-credentials"]
+    __slots__ = ['header', 'condition', 'negate', 'argument', 'severity',
+                 'message', 'final', 'also', 'call']
+
+    def __init__(self, header, condition, argument=None, severity=LOG_INFO,
+                 message=None, final=False, also=(), call=None):
+        self.header = header.lower()
+        self.negate = condition.startswith("!")
+        self.condition = condition.lstrip("!")
+
+        if self.condition not in RULE_CONDITIONS:
+            raise ValueError("unknown rule condition {0}".format(condition))
+
+        if self.condition == "matches":
+            argument = re.compile(argument)
+
+        self.argument = argument
+        self.severity = severity
+        self.message = message
+        self.final = final
+        self.also = [LovetzHeaderRule(h, c, a) for h, c, a in also]
+        self.call = call
+
+    def matches(self, val):
+        """ val is None when the response doesn't carry the header """
+
+        if self.condition == "missing":
+            return (val is None) != self.negate
+        elif self.condition == "present":
+            return (val is not None) != self.negate
+        elif val is None:
+            # "!equals x" &c. mean the header is there, but isn't x
+            return False
+        elif self.condition == "equals":
+            res = val == self.argument
+        elif self.condition == "contains":
+            res = self.argument in val
+        else:
+            if isinstance(val, list):
+                val = ", ".join(val)
+            res = self.argument.search(val) is not None
 
-        if 'access-control-allow-origin' in response_headers:
-            val = response_headers['access-control-allow-origin']
+        return res != self.negate
 
-            if val == "*":
-                self.log(LOG_WARN,
-                         url,
-                         "Widely-scoped access-control-allow-origin header")
-                if "access-control-allow-credentials" in response_headers:
-                    self.log(LOG_WARN,
-                             url,
-                             "Wildcard ACAO with credentials allowed")
-                if ("access-control-expose-headers" in response_headers and \
-                    "authorization" in response_headers["access-control-expose-headers"]) or \
-                   ("access-control-allow-headers" in response_headers and \
-                    "authorization" in response_headers["access-control-allow-headers"]):
-                    self.log(LOG_WARN,
-                             url,
-                             "Wildcard ACAO with authorization allowed")
-            else:
-                self.log(LOG_INFO,
-                         url,
-                         "CORS Origin: {0}".format(val))
+    @staticmethod
+    def parse(val):
+        """ a rule from its JSON form, e.g.
+            {"header": "x-frame-options", "condition": "!matches",
+             "value": "(?i)^(deny|sameorigin)$", "severity": "warn",
+             "message": "framing allowed: {0}"}
+        """
 
-        for header in headers:
-            if header in response_headers:
-                val = response_headers[header]
-                self.log(LOG_INFO,
-                         url,
-                         "CORS Header {0} with value {1}".format(header, val))
+        severity = val.get("severity", "info")
+
+        if severity not in RULE_SEVERITIES:
+            raise ValueError("unknown rule severity {0}".format(severity))
+
+        if "message" not in val:
+            raise ValueError("rule for {0} has no message".format(val.get("header")))
+
+        return LovetzHeaderRule(val["header"],
+                                val.get("condition", "present"),
+                                argument=val.get("value"),
+                                severity=RULE_SEVERITIES[severity],
+                                message=val["message"],
+                                final=bool(val.get("final")),
+                                also=[tuple(a) for a in val.get("also", [])])
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'r') as fh:
+            return [LovetzHeaderRule.parse(val) for val in json.load(fh)]
+
+
+class LovetzHeaderTable(object):
+    """ Header rules compiled into a decision table: rules indexed by
+        the header they look at, in the order given, and the verdict
+        for each header being absent worked out up front. A response
+        then only runs the rules of headers it actually has.
+
+        extra_rules (say, from --header-rules) run after rules, but as
+        a list of their own: a final rule only stops the rules after
+        it in the same list.
+    """
+
+    def __init__(self, rules, owner=None, extra_rules=()):
+        self.headers = []
+        self.rules = {}
+        self.missing = {}
+
+        for group, rule in [(0, r) for r in rules] + [(1, r) for r in extra_rules]:
+            if rule.header not in self.rules:
+                self.headers.append(rule.header)
+                self.rules[rule.header] = []
+
+            call = None
+            if rule.call is not None:
+                call = getattr(owner, rule.call)
+
+            # rules whose findings the owner doesn't want are still
+            # tried, as a final one stops the rest, but never
+            # formatted.
+            silent = call is None and owner is not None and \
+                not owner.wants(rule.severity, rule.message)
+
+            self.rules[rule.header].append((group, rule, call, silent))
+
+        for header in self.headers:
+            # rules that look at other headers can't be decided ahead
+            # of time
+            if not any(rule.also for _, rule, _, _ in self.rules[header]):
+                self.missing[header] = self.verdict(header, None)
+
+    def verdict(self, header, val, headers=None):
+        """ (event, message) pairs for header having val (None if it's
+            absent); headers is the whole response's, for rules with
+            also conditions.
+        """
+
+        if val is None and header in self.missing:
+            return self.missing[header]
+
+        res = []
+        stopped = set()     # groups a final rule has fired in
+
+        for group, rule, call, silent in self.rules[header]:
+            if group in stopped or not rule.matches(val):
+                continue
+
+            if not all(other.matches(headers.get(other.header)
+                                     if headers is not None else None)
+                       for other in rule.also):
+                continue
+
+            if call is not None:
+                res.extend(call(val))
+            elif not silent:
+                res.append((rule.severity,
+                            rule.message.format(val, header=header)))
+
+            if rule.final:
+                stopped.add(group)
+
+        return res
+
+    def check(self, headers):
+        for header in self.headers:
+            for verdict in self.verdict(header, headers.get(header), headers):
+                yield verdict
+
+
+class CORSPlugin(LovetzPlugin):
+
+    name = "cors"
+    tags = ("headers", "cors")
+    body_type = None
+
+    rules = [LovetzHeaderRule("access-control-allow-origin", "equals", "*",
+                              LOG_WARN,
+                              "Widely-scoped access-control-allow-origin header"),
+             LovetzHeaderRule("access-control-allow-origin", "equals", "*",
+                              LOG_WARN,
+                              "Wildcard ACAO with credentials allowed",
+                              also=[("access-control-allow-credentials",
+                                     "present", None)]),
+             # final, so that it's only reported once when both
+             # headers allow it
+             LovetzHeaderRule("access-control-allow-origin", "equals", "*",
+                              LOG_WARN,
+                              "Wildcard ACAO with authorization allowed",
+                              final=True,
+                              also=[("access-control-expose-headers",
+                                     "contains", "authorization")]),
+             LovetzHeaderRule("access-control-allow-origin", "equals", "*",
+                              LOG_WARN,
+                              "Wildcard ACAO with authorization allowed",
+                              final=True,
+                              also=[("access-control-allow-headers",
+                                     "contains", "authorization")]),
+             LovetzHeaderRule("access-control-allow-origin", "!equals", "*",
+                              LOG_INFO,
+                              "CORS Origin: {0}")] + \
+            [LovetzHeaderRule(header, "present", None, LOG_INFO,
+                              "CORS Header {header} with value {0}")
+             for header in ["access-control-allow-methods",
+                            "access-control-allow-headers",
+                            "access-control-max-age",
+                            "access-control-expose-headers",
+                            "access-control-allow-credentials"]]
+
+    def __init__(self, *args, **kwargs):
+        super(CORSPlugin, self).__init__(*args, **kwargs)
+        self.table = LovetzHeaderTable(self.rules, owner=self)
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, request_status, response_status):
+
+        for event, message in self.table.check(response_headers):
+            self.log(event, url, message)
 
 
 class LovetzCookie(object):
@@ -214,8 +1004,94 @@ class LovetzCookie(object):
         return cookies
 
 
+class LovetzRequestLine(object):
+    """ Parsed HTTP request line: method, target & version.
+
+    """
+    __slots__ = ['method', 'target', 'version']
+
+    def __init__(self, method, target, version):
+        self.method = method.upper()
+        self.target = target
+        self.version = version
+
+    def __str__(self):
+        return "{0} {1} {2}".format(self.method, self.target, self.version)
+
+    def __reduce__(self):
+        return (LovetzRequestLine, (self.method, self.target, self.version))
+
+    @staticmethod
+    def parse(val):
+
+        if isinstance(val, LovetzRequestLine):
+            return val
+
+        parts = val.strip().split(" ")
+
+        if len(parts) >= 3:
+            return LovetzRequestLine(parts[0], " ".join(parts[1:-1]),
+                                     parts[-1])
+        elif len(parts) == 2:
+            return LovetzRequestLine(parts[0], parts[1], "")
+
+        return LovetzRequestLine(parts[0], "", "")
+
+
+class LovetzResponseLine(object):
+    """ Parsed HTTP status line: version, integer status code & reason.
+
+        A code of 0 means the status line couldn't be parsed.
+    """
+    __slots__ = ['version', 'code', 'reason']
+
+    def __init__(self, version, code, reason):
+        self.version = version
+        try:
+            self.code = int(code)
+        except (TypeError, ValueError):
+            self.code = 0
+        self.reason = reason
+
+    def __str__(self):
+        return "{0} {1} {2}".format(self.version, self.code, self.reason)
+
+    def __reduce__(self):
+        return (LovetzResponseLine, (self.version, self.code, self.reason))
+
+    @property
+    def status_class(self):
+        return self.code // 100
+
+    @staticmethod
+    def parse(val):
+
+        if isinstance(val, LovetzResponseLine):
+            return val
+
+        parts = val.strip().split(" ", 2)
+
+        # normally "HTTP/1.1 200 OK", but be lenient about readers
+        # that put the version last, such as "200 OK HTTP/1.1"
+        if parts[0].upper().startswith("HTTP/"):
+            return LovetzResponseLine(parts[0],
+                                      parts[1] if len(parts) > 1 else 0,
+                                      parts[2] if len(parts) > 2 else "")
+        elif parts[0].isdigit():
+            rest = " ".join(parts[1:]).rsplit(" ", 1)
+            if len(rest) == 2 and rest[1].upper().startswith("HTTP/"):
+                return LovetzResponseLine(rest[1], parts[0], rest[0])
+            return LovetzResponseLine("", parts[0], " ".join(parts[1:]))
+
+        return LovetzResponseLine("", 0, val.strip())
+
+
 class ETagPlugin(LovetzPlugin):
 
+    name = "etag"
+    tags = ("headers", "cache")
+    body_type = None
+
     def check(self, url, response_headers, request_headers,
               response_body, request_body, response_status, request_status):
 
@@ -223,11 +1099,16 @@ class ETagPlugin(LovetzPlugin):
             val = response_headers["etag"]
             self.log(LOG_WARN,
                      url,
-                     "ETag in response for {0}".format(val))
+                     "ETag in response for {0}",
+                     args=(val,))
 
 
 class CookiePlugin(LovetzPlugin):
 
+    name = "cookie"
+    tags = ("headers", "cookies")
+    body_type = None
+
     def check(self, url, response_headers, request_headers,
               response_body, request_body, response_status, request_status):
 
@@ -289,50 +1170,50 @@ class CookiePlugin(LovetzPlugin):
             msg = "Cookies missing 'http only' for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([ct
-                                           for ct in cookies_httponly])))
+                     msg,
+                     args=(', '.join(cookies_httponly),))
 
         if cookies_secure:
             msg = "Cookies missing 'secure' for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([cs
-                                           for cs in cookies_secure])))
+                     msg,
+                     args=(', '.join(cookies_secure),))
 
         if cookies_both:
             msg = "Cookies missing both 'secure' and 'http only' for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([cb
-                                           for cb in cookies_both])))
+                     msg,
+                     args=(', '.join(cookies_both),))
 
         if cookies_samesite_none:
             msg = "Cookies with SameSite explicitly set to None for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([cb
-                                           for cb in cookies_samesite_none])))
+                     msg,
+                     args=(', '.join(cookies_samesite_none),))
 
         if cookies_samesite_lax:
             msg = "Cookies with SameSite explicitly set to lax for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([cb
-                                           for cb in cookies_samesite_lax])))
+                     msg,
+                     args=(', '.join(cookies_samesite_lax),))
 
         if cookies_missing_samesite:
             msg = "Cookies missing SameSite for {0}"
             self.log(LOG_WARN,
                      url,
-                     msg.format(', '.join([cb
-                                           for cb in cookies_missing_samesite])))
+                     msg,
+                     args=(', '.join(cookies_missing_samesite),))
 
         if cookies_fine:
             msg = "Cookies with the correct flags for {0}"
             self.log(LOG_INFO,
                      url,
-                     msg.format(', '.join([cf
-                                           for cf in cookies_fine])))
+                     msg,
+                     args=(', '.join(cookies_fine),))
 
 
 class FingerprintPlugin(LovetzPlugin):
@@ -343,6 +1224,10 @@ class FingerprintPlugin(LovetzPlugin):
         - bodies: any tell-tale information therein?
     """
 
+    name = "fingerprint"
+    tags = ("url", "body", "fingerprint")
+    body_type = BODY_BYTES
+
     def check(self, url, response_headers, request_headers,
               response_body, request_body, response_status, request_status):
 
@@ -360,7 +1245,7 @@ class FingerprintPlugin(LovetzPlugin):
 
             self.replugins = {
                 'Wordpress': (re.compile('/wp-', re.I), "both"),
-                'WordPress powered by': (re.compile('Powered By WordPress',
+                'WordPress powered by': (re.compile(b'Powered By WordPress',
                                                     re.I), 'body'),
                 'phpMyAdmim': (re.compile('/phpMyAdmin', re.I), "both"),
                 'php': (re.compile(r'\.php', re.I), "url"),
@@ -395,6 +1280,10 @@ class SensitiveDataPlugin(LovetzPlugin):
     """ Attempt to uncover sensitive data such as session IDs in URLs.
     """
 
+    name = "sensitive"
+    tags = ("url",)
+    body_type = None
+
     checks = {"ssn": re.compile("\d\d\d\-\d\d\d-\d\d\d\d"),
               "username": re.compile(r"user(name)?", re.I),
               "password": re.compile(r"pass(word)?", re.I),
@@ -408,223 +1297,1301 @@ class SensitiveDataPlugin(LovetzPlugin):
             if v.search(url) is not None:
                 self.log(LOG_WARN,
                          url,
-                         f"{k} matched for {url}")
+                         "{0} matched for {1}",
+                         args=(k, url))
 
-class AutocompletePlugin(LovetzPlugin):
-    """ Autocomplete in HTML warning.
+class CSRFPlugin(LovetzPlugin):
+    """ Look for missing anti-CSRF tokens:
+
+        - state-changing requests (POST, PUT, PATCH, DELETE) with no
+          token parameter or header
+        - HTML forms that POST without a token field
+
+        Token names are matched against a precompiled set of the usual
+        suspects plus a single regex, and each body is tokenized in
+        one pass.
     """
 
-    def check(self, url, response_headers, request_headers,
-              response_body, request_body, response_status, request_status):
-        pass
+    name = "csrf"
+    tags = ("csrf", "body", "html")
+    html_aware = True
+    body_type = None
 
+    methods = frozenset(["POST", "PUT", "PATCH", "DELETE"])
 
-class HeaderPlugin(LovetzPlugin):
+    token_names = frozenset(["csrf", "csrftoken", "csrf_token", "_csrf",
+                             "csrfmiddlewaretoken", "xsrf", "_xsrf",
+                             "xsrf_token", "authenticity_token",
+                             "__requestverificationtoken", "_token",
+                             "anticsrf", "anti_csrf", "__csrf_magic",
+                             "form_token", "formkey", "nonce", "_wpnonce"])
 
-    def check(self, url, response_headers, request_headers,
-              response_body, request_body, response_status, request_status):
+    token_headers = frozenset(["x-csrf-token", "x-xsrf-token", "x-csrftoken",
+                               "x-csrf", "x-xsrf", "csrf-token",
+                               "x-requested-with"])
 
-        security_headers = ["cache-control", "pragma", "x-xss-protection",
-                            "x-content-type-options", "expires", "x-frame-options",
-                            "strict-transport-security", "x-powered-by", "server",
-                            "www-authenticate", "content-security-policy",
-                            "content-security-policy-report-only"]
+    token_re = re.compile(r"csrf|xsrf|authenticity|verification_?token|nonce",
+                          re.I)
 
-        msg = "Response header {0} with value {1}"
-        for header in list(response_headers.keys()):
-            if header not in security_headers:
-                self.log(LOG_INFO,
-                         url,
-                         msg.format(header, response_headers[header]))
+    # request parameter names, whatever the body's encoding: form
+    # fields (name=...&), multipart (name="...") & JSON keys ("...":)
+    param_re = re.compile(r"""(?:^|[&?])([^=&\s]+)=|"""
+                          r"""\bname="([^"]+)"|"""
+                          r""""([^"\\]{1,64})"\s*:""")
 
-        if not hasattr(self, "server_re"):
-            self.server_re = re.compile('[0-9]')
+    def is_token(self, name):
+        name = name.lower()
+        return name in self.token_names or \
+            self.token_re.search(name) is not None
 
-        if "content-security-policy" in response_headers:
-            self.log(LOG_INFO,
-                     url,
-                     "CSP with policy for {0}".format(response_headers["content-security-policy"]))
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "No CSP defined")
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status,
+              html=None):
 
-        if "content-security-policy-report-only" in response_headers:
-            self.log(LOG_INFO,
-                     url,
-                     "CSP-RO with policy for {0}".format(response_headers["content-security-policy-report-only"]))
-        else:
-            self.log(LOG_INFO,
-                     url,
-                     "No CSP-RO defined")
+        method = getattr(request_status, 'method', '')
 
-        if "www-authenticate" in response_headers:
-            if "Basic realm" in response_headers["www-authenticate"]:
-                self.log(LOG_WARN,
-                         url,
-                         "(www-auth) URL supports Basic authentication for {0}".format(response_headers["www-authenticate"]))
-            else:
-                self.log(LOG_INFO,
-                         url,
-                         "(www-auth) URL Authentication for {0}".format(response_headers["www-authenticate"]))
+        if method in self.methods:
+            self.check_request(url, method, request_headers, request_body)
 
-        if "cache-control" in response_headers:
-            if "private" in response_headers["cache-control"]:
-                self.log(LOG_WARN,
-                         url,
-                         "Broken cache control for {0}".format(response_headers["cache-control"]))
+        if html is not None:
+            self.check_forms(url, html)
 
-            if "must-revalidate" not in response_headers["cache-control"]:
-                msg = "Weak 'cache-control' value for {0}"
-                self.log(LOG_WARN,
-                         url,
-                         msg.format(response_headers["cache-control"]))
-            else:
-                self.log(LOG_INFO,
-                         url,
-                         "Cache-control header found for {0}".format(response_headers["cache-control"]))
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "Cache-control header not found")
+    def check_request(self, url, method, request_headers, request_body):
 
-        if "pragma" in response_headers:
-            msg = "Site defines a pragma header with value {0}"
-            if response_headers["pragma"] != "no-cache":
-                self.log(LOG_WARN,
-                         url,
-                         msg.format(response_headers["pragma"]))
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "Pragma header not found")
+        for header in self.token_headers:
+            if header in request_headers:
+                return
 
-        if "x-xss-protection" in response_headers:
-            if response_headers["x-xss-protection"] != "1; mode=block":
-                self.log(LOG_WARN,
-                         url,
-                         "Weak 'x-xss-protection' header defined")
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "No X-XSS-Protection header defined")
+        params = urllib.parse.urlsplit(url).query + "&" + request_body
 
-        if "x-content-type-options" in response_headers:
-            msg = "Site returns weak 'x-content-type-options' value: {0}"
-            pos_msg = "Site returns relatively strong 'x-content-type-options'"
-            val = response_headers['x-content-type-options']
-            if response_headers['x-content-type-options'] != 'nosniff':
-                self.log(LOG_WARN,
-                         url,
-                         msg.format(val))
-            else:
-                self.log(LOG_INFO,
-                         url,
-                         pos_msg)
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "x-content-type-options not found")
+        for m in self.param_re.finditer(params):
+            name = m.group(1) or m.group(2) or m.group(3)
+            if self.is_token(urllib.parse.unquote_plus(name)):
+                return
 
-        if "expires" in response_headers:
-            self.log(LOG_INFO,
-                     url,
-                     "Expires value: {0}".format(response_headers['expires']))
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "Expires header not defined")
+        self.log(LOG_WARN,
+                 url,
+                 "No CSRF token parameter or header in {0} request",
+                 args=(method,))
 
-        if "x-frame-options" in response_headers:
-            # need to do actual analysis here...
-            msg = "non-standard x-frame-options value: {0}"
-            dmsg = "site denies framing"
-            smsg = "site allows framing from same origin"
-            amsg = "site allows framing from: {0}"
-            val = response_headers['x-frame-options']
+    def check_forms(self, url, html):
 
-            if val.lower() == "sameorigin":
-                self.log(LOG_INFO,
-                         url,
-                         smsg)
-            elif val.lower() == "deny":
-                self.log(LOG_INFO,
-                         url,
-                         dmsg)
-            elif val.lower().startswith("allow"):
-                self.log(LOG_INFO,
-                         url,
-                         amsg.format(val))
-            else:
-                self.log(LOG_INFO,
-                         url,
-                         msg.format(val))
-        else:
-            self.log(LOG_WARN,
-                     url,
-                     "x-frame-options header not defined")
+        msg = "POST form without a CSRF token (action: {0})"
+        form = None    # [action, has-token] of the open POST form
 
-        if "strict-transport-security" in response_headers:
-            self.log(LOG_INFO,
-                     url,
-                     "HSTS found with value: {0}".format(response_headers["strict-transport-security"]))
+        for tag in html.tags:
+            if tag.name == "form":
+                if form is not None and not form[1]:
+                    self.log(LOG_WARN, url, msg, args=(form[0],))
+                form = None
+
+                if not tag.closing and \
+                   tag.get("method", "get").lower() == "post":
+                    form = [tag.get("action", url), False]
+            elif tag.name == "input" and form is not None and not form[1]:
+                name = tag.get("name")
+                if name and self.is_token(name):
+                    form[1] = True
+
+        if form is not None and not form[1]:
+            self.log(LOG_WARN, url, msg, args=(form[0],))
+
+
+class AutocompletePlugin(LovetzPlugin):
+    """ Autocomplete in HTML warning: password fields, and fields that
+        look like they hold card numbers & the like, where neither the
+        field nor its form turns autocomplete off.
+    """
+
+    name = "autocomplete"
+    tags = ("body", "html")
+    html_aware = True
+    body_type = None
+
+    sensitive_re = re.compile(r"card|ccnum|cc_?num|cvv|cvc|ssn|"
+                              r"social|account_?num|pin\b", re.I)
+
+    # values that keep browsers from remembering a field
+    off = frozenset(["off", "new-password", "one-time-code"])
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status,
+              html=None):
+
+        if html is None:
+            return
+
+        form = None     # autocomplete value of the enclosing form
+
+        for tag in html.tags:
+            if tag.name == "form":
+                form = None if tag.closing else \
+                    tag.get("autocomplete", "on").lower()
+            elif tag.name == "input" and not tag.closing:
+                ftype = tag.get("type", "text").lower()
+                name = tag.get("name") or tag.get("id") or ""
+                ac = tag.get("autocomplete", form or "on").lower()
+
+                if ac in self.off:
+                    continue
+
+                if ftype == "password":
+                    msg = "Password field '{0}' with autocomplete enabled"
+                    self.log(LOG_WARN, url, msg, args=(name,))
+                elif ftype in ("text", "tel", "number") and \
+                        self.sensitive_re.search(name):
+                    msg = "Sensitive field '{0}' with autocomplete enabled"
+                    self.log(LOG_INFO, url, msg, args=(name,))
+
+
+# fetch directives that fall back to default-src when missing
+CSP_FETCH_DIRECTIVES = ["child-src", "connect-src", "font-src", "frame-src",
+                        "img-src", "manifest-src", "media-src", "object-src",
+                        "script-src", "style-src", "worker-src"]
+
+# sources that let a script come from more or less anywhere
+CSP_WILD_SOURCES = set(["*", "http:", "https:", "data:", "blob:",
+                        "filesystem:"])
+
+CSP_NONCE_RE = re.compile(r"'nonce-[^']*'", re.I)
+
+
+class LovetzCSP(object):
+    """ Parsed Content-Security-Policy: one dict of directive to source
+        list per policy (a header can carry several, comma-separated).
+
+    """
+    __slots__ = ['policies']
+
+    def __init__(self, policies):
+        self.policies = policies
+
+    @staticmethod
+    def parse(val):
+
+        policies = []
+
+        for text in val.split(","):
+            directives = {}
+            for directive in text.split(";"):
+                tokens = directive.split()
+                if not tokens:
+                    continue
+                name = tokens[0].lower()
+                # per the spec, only the first of a repeated directive counts
+                if name not in directives:
+                    directives[name] = [t.lower() if t.startswith("'") else t
+                                        for t in tokens[1:]]
+            if directives:
+                policies.append(directives)
+
+        return LovetzCSP(policies)
+
+    @staticmethod
+    def sources(directives, name):
+        if name in directives:
+            return directives[name]
+        elif name in CSP_FETCH_DIRECTIVES:
+            return directives.get("default-src")
+        return None
+
+    @staticmethod
+    def _analyze(directives):
+
+        res = []
+        scripts = LovetzCSP.sources(directives, "script-src")
+
+        if scripts is None:
+            res.append((LOG_WARN,
+                        "CSP doesn't restrict scripts (no script-src or default-src)"))
         else:
-            self.log(LOG_WARN,
-                     url,
-                     "HSTS missing")
+            # a nonce or hash makes browsers ignore 'unsafe-inline'
+            nonced = any(s.startswith(("'nonce-", "'sha")) for s in scripts)
 
-        # could probably do some app finger printing here...
+            if "'unsafe-inline'" in scripts and not nonced:
+                res.append((LOG_WARN, "CSP allows 'unsafe-inline' scripts"))
 
-        if "x-powered-by" in response_headers:
-            msg = "x-powered-by value found! {0}"
-            self.log(LOG_WARN,
-                     url,
-                     msg.format(response_headers['x-powered-by']))
+            if "'unsafe-eval'" in scripts:
+                res.append((LOG_WARN, "CSP allows 'unsafe-eval'"))
 
-        if "server" in response_headers:
-            val = response_headers["server"]
-            imsg = "server value found: \"{0}\""
-            wmsg = "server with specific version found: \"{0}\""
+            if "'strict-dynamic'" not in scripts:
+                for src in scripts:
+                    if src.lower() in CSP_WILD_SOURCES:
+                        msg = "CSP allows scripts from wildcard source {0}"
+                        res.append((LOG_WARN, msg.format(src)))
+
+        for name in CSP_FETCH_DIRECTIVES:
+            if name == "script-src" or name not in directives:
+                continue
+            if "*" in directives[name]:
+                msg = "CSP allows any source for {0}"
+                res.append((LOG_WARN, msg.format(name)))
+
+        if "*" in directives.get("default-src", []):
+            res.append((LOG_WARN, "CSP allows any source for default-src"))
+
+        if LovetzCSP.sources(directives, "object-src") is None:
+            res.append((LOG_WARN,
+                        "CSP missing object-src (and no default-src)"))
+
+        if "base-uri" not in directives:
+            res.append((LOG_WARN, "CSP missing base-uri"))
+
+        styles = LovetzCSP.sources(directives, "style-src") or []
+        if "'unsafe-inline'" in styles:
+            res.append((LOG_INFO, "CSP allows 'unsafe-inline' styles"))
+
+        if "frame-ancestors" not in directives:
+            res.append((LOG_INFO, "CSP missing frame-ancestors"))
+
+        return res
+
+    def analyze(self):
+        """ Weaknesses of the policy, as (event, message) pairs. When
+            several policies are enforced together, only weaknesses
+            that every one of them shares are reported.
+        """
+
+        if not self.policies:
+            return [(LOG_WARN, "CSP header is empty")]
+
+        res = self._analyze(self.policies[0])
+
+        for directives in self.policies[1:]:
+            other = set(self._analyze(directives))
+            res = [r for r in res if r in other]
+
+        return res
+
+
+@functools.lru_cache(maxsize=1024)
+def _analyze_csp(policy):
+    return tuple(LovetzCSP.parse(policy).analyze())
+
+
+def analyze_csp(policy):
+    """ Cached LovetzCSP.parse(policy).analyze(). Sites tend to send the
+        same handful of policies on every response, so this is keyed by
+        the policy string, with per-response nonces blanked out so they
+        don't defeat the cache.
+    """
+
+    if isinstance(policy, list):
+        policy = ",".join(policy)
+
+    return _analyze_csp(CSP_NONCE_RE.sub("'nonce-*'", policy))
+
+
+class HeaderPlugin(LovetzPlugin):
+
+    name = "header"
+    tags = ("headers",)
+    body_type = None
+
+    security_headers = ["cache-control", "pragma", "x-xss-protection",
+                        "x-content-type-options", "expires", "x-frame-options",
+                        "strict-transport-security", "x-powered-by", "server",
+                        "www-authenticate", "content-security-policy",
+                        "content-security-policy-report-only"]
+
+    # rules are tried in order for each header; the first that's
+    # final stops the rest. header_rules (from --header-rules) are
+    # tried after them, whatever the built-in rules did.
+
+    rules = [LovetzHeaderRule("content-security-policy", "present", None,
+                              LOG_INFO, "CSP with policy for {0}"),
+             LovetzHeaderRule("content-security-policy", "present",
+                              call="_csp"),
+             LovetzHeaderRule("content-security-policy", "missing", None,
+                              LOG_WARN, "No CSP defined"),
+
+             LovetzHeaderRule("content-security-policy-report-only",
+                              "present", None, LOG_INFO,
+                              "CSP-RO with policy for {0}"),
+             LovetzHeaderRule("content-security-policy-report-only",
+                              "present", call="_csp_ro"),
+             LovetzHeaderRule("content-security-policy-report-only",
+                              "missing", None, LOG_INFO, "No CSP-RO defined"),
+
+             LovetzHeaderRule("www-authenticate", "contains", "Basic realm",
+                              LOG_WARN,
+                              "(www-auth) URL supports Basic authentication for {0}",
+                              final=True),
+             LovetzHeaderRule("www-authenticate", "present", None, LOG_INFO,
+                              "(www-auth) URL Authentication for {0}"),
+
+             LovetzHeaderRule("cache-control", "missing", None, LOG_WARN,
+                              "Cache-control header not found"),
+             LovetzHeaderRule("cache-control", "contains", "private",
+                              LOG_WARN, "Broken cache control for {0}"),
+             LovetzHeaderRule("cache-control", "!contains", "must-revalidate",
+                              LOG_WARN, "Weak 'cache-control' value for {0}",
+                              final=True),
+             LovetzHeaderRule("cache-control", "present", None, LOG_INFO,
+                              "Cache-control header found for {0}"),
+
+             LovetzHeaderRule("pragma", "missing", None, LOG_WARN,
+                              "Pragma header not found"),
+             LovetzHeaderRule("pragma", "!equals", "no-cache", LOG_WARN,
+                              "Site defines a pragma header with value {0}"),
+
+             LovetzHeaderRule("x-xss-protection", "missing", None, LOG_WARN,
+                              "No X-XSS-Protection header defined"),
+             LovetzHeaderRule("x-xss-protection", "!equals", "1; mode=block",
+                              LOG_WARN,
+                              "Weak 'x-xss-protection' header defined"),
+
+             LovetzHeaderRule("x-content-type-options", "missing", None,
+                              LOG_WARN, "x-content-type-options not found"),
+             LovetzHeaderRule("x-content-type-options", "!equals", "nosniff",
+                              LOG_WARN,
+                              "Site returns weak 'x-content-type-options' value: {0}",
+                              final=True),
+             LovetzHeaderRule("x-content-type-options", "present", None,
+                              LOG_INFO,
+                              "Site returns relatively strong 'x-content-type-options'"),
+
+             LovetzHeaderRule("expires", "present", None, LOG_INFO,
+                              "Expires value: {0}"),
+             LovetzHeaderRule("expires", "missing", None, LOG_WARN,
+                              "Expires header not defined"),
+
+             # need to do actual analysis here...
+             LovetzHeaderRule("x-frame-options", "missing", None, LOG_WARN,
+                              "x-frame-options header not defined"),
+             LovetzHeaderRule("x-frame-options", "matches", r"(?i)\Asameorigin\Z",
+                              LOG_INFO, "site allows framing from same origin",
+                              final=True),
+             LovetzHeaderRule("x-frame-options", "matches", r"(?i)\Adeny\Z",
+                              LOG_INFO, "site denies framing", final=True),
+             LovetzHeaderRule("x-frame-options", "matches", r"(?i)\Aallow",
+                              LOG_INFO, "site allows framing from: {0}",
+                              final=True),
+             LovetzHeaderRule("x-frame-options", "present", None, LOG_INFO,
+                              "non-standard x-frame-options value: {0}"),
+
+             LovetzHeaderRule("strict-transport-security", "present", None,
+                              LOG_INFO, "HSTS found with value: {0}"),
+             LovetzHeaderRule("strict-transport-security", "missing", None,
+                              LOG_WARN, "HSTS missing"),
+
+             # could probably do some app finger printing here...
+             LovetzHeaderRule("x-powered-by", "present", None, LOG_WARN,
+                              "x-powered-by value found! {0}"),
+
+             LovetzHeaderRule("server", "matches", "[0-9]", LOG_WARN,
+                              "server with specific version found: \"{0}\"",
+                              final=True),
+             LovetzHeaderRule("server", "present", None, LOG_INFO,
+                              "server value found: \"{0}\"")]
+
+    def __init__(self, *args, **kwargs):
+        super(HeaderPlugin, self).__init__(*args, **kwargs)
+        self.table = LovetzHeaderTable(self.rules, owner=self,
+                                       extra_rules=self.header_rules)
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+
+        self.check_other(url, response_headers)
+
+        for event, message in self.table.check(response_headers):
+            self.log(event, url, message)
+
+    def check_other(self, url, response_headers):
+        """ Note the headers that aren't security headers. """
+
+        msg = "Response header {0} with value {1}"
+        if self.wants(LOG_INFO, msg):
+            for header in list(response_headers.keys()):
+                if header not in self.security_headers:
+                    self.log(LOG_INFO,
+                             url,
+                             msg,
+                             args=(header, response_headers[header]))
+
+    def _csp(self, val):
+        return list(analyze_csp(val))
+
+    def _csp_ro(self, val):
+        # report-only policies aren't enforced, so their
+        # weaknesses are only informational
+        return [(LOG_INFO, "(report-only) " + msg)
+                for _, msg in analyze_csp(val)]
+
+
+class OriginHeaderPlugin(HeaderPlugin):
+    """ HeaderPlugin, but with the site-wide policies (CSP, HSTS,
+        framing, nosniff, server banners &c.) evaluated per origin:
+        each distinct value is checked once, and what gets reported
+        is how much of the origin carries it, plus the URLs that
+        differ from the origin's usual value.
+    """
+
+    name = "origin"
+    tags = ("headers", "origin")
+    default = False
+
+    origin_policies = set(["content-security-policy",
+                           "content-security-policy-report-only",
+                           "x-xss-protection", "x-content-type-options",
+                           "x-frame-options", "strict-transport-security",
+                           "x-powered-by", "server"])
+
+    # how many outlier URLs to remember per origin, header & value
+    outlier_limit = 20
+
+    # how many distinct values to keep per origin & header; responses
+    # with values past that are checked one by one, as HeaderPlugin
+    # does, so memory stays bounded by origins rather than requests.
+    value_limit = 50
+
+    def __init__(self, *args, **kwargs):
+        super(OriginHeaderPlugin, self).__init__(*args, **kwargs)
+        # origin -> [responses, {header -> {value -> [count, urls]}}]
+        self.origins = {}
+        self.verdicts = {}
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+
+        self.check_other(url, response_headers)
+
+        origin = url_origin(url)
+
+        if origin not in self.origins:
+            self.origins[origin] = [0, {}]
+
+        stats = self.origins[origin]
+        stats[0] += 1
+
+        for header in self.table.headers:
+            val = response_headers.get(header)
+
+            if header not in self.origin_policies:
+                for event, message in self.table.verdict(header, val,
+                                                         response_headers):
+                    self.log(event, url, message)
+                continue
+
+            val = self.normalize(header, val)
+            values = stats[1].setdefault(header, {})
+
+            if val not in values:
+                if len(values) >= self.value_limit:
+                    for event, message in self.table.verdict(header, val,
+                                                             response_headers):
+                        self.log(event, url, message)
+                    continue
+                values[val] = [0, []]
+
+            seen = values[val]
+            seen[0] += 1
+
+            if len(seen[1]) < self.outlier_limit:
+                seen[1].append(url)
+
+    def reset(self):
+        super(OriginHeaderPlugin, self).reset()
+        self.origins = {}
+
+    def normalize(self, header, val):
+        """ The value to count & cache val under. CSP nonces change on
+            every response, so they're blanked out (as analyze_csp
+            does); otherwise each response would be a value of its own.
+        """
+
+        if isinstance(val, list):
+            val = ", ".join(val)
+
+        if val is not None and header.startswith("content-security-policy"):
+            val = CSP_NONCE_RE.sub("'nonce-*'", val)
+
+        return val
+
+    def verdict(self, header, val):
+        key = (header, val)
+
+        if key not in self.verdicts:
+            self.verdicts[key] = self.table.verdict(header, val)
+
+        return self.verdicts[key]
+
+    def finish(self):
+
+        for origin, (total, headers) in self.origins.items():
+            for header in self.table.headers:
+                if header not in headers:
+                    continue
+
+                values = headers[header]
+                present = total - values.get(None, [0])[0]
+                msg = "{0} present on {1}% of responses from this origin ({2}/{3})"
 
-            if self.server_re.search(val):
-                self.log(LOG_WARN,
-                         url,
-                         wmsg.format(val))
-            else:
                 self.log(LOG_INFO,
-                         url,
-                         imsg.format(val))
+                         origin,
+                         msg,
+                         args=(header,
+                               int(round(100.0 * present / total)),
+                               present,
+                               total))
+
+                usual = max(values, key=lambda v: values[v][0])
+
+                for val, (count, urls) in values.items():
+                    suffix = " ({0}/{1} responses)".format(count, total)
+
+                    if val != usual:
+                        more = count - len(urls)
+                        suffix += ", outliers: {0}".format(", ".join(urls))
+                        if more > 0:
+                            suffix += " (+{0} more)".format(more)
+
+                    for event, message in self.verdict(header, val):
+                        self.log(event, origin, message + suffix)
+
+
+class LovetzHeaderMatrix(object):
+    """ Header presence & normalized values for every item, kept as
+        columns rather than rows: an array of origin / content type /
+        status codes, a bitmask of which tracked headers each item
+        had, and an array of value codes per header. Coverage is then
+        counted over whole columns at once (see coverage), which stays
+        quick well into the millions of items.
+    """
+
+    dimensions = ("origin", "type", "status")
+
+    def __init__(self, headers):
+        if len(headers) > 64:
+            raise ValueError("can only track up to 64 headers")
+
+        self.headers = [h.lower() for h in headers]
+        self.urls = []
+        # dimension -> [labels, label -> code, column of codes]
+        self.groups = dict((d, [[], {}, array.array('I')])
+                           for d in self.dimensions)
+        self.present = array.array('Q')
+        # per header: [values, value -> code, column of codes]; code 0
+        # (None) is "not present"
+        self.values = [[[None], {None: 0}, array.array('I')]
+                       for _ in self.headers]
+
+    def __len__(self):
+        return len(self.urls)
+
+    @staticmethod
+    def normalize(val):
+        if val is None:
+            return None
+        if isinstance(val, list):
+            val = ", ".join(val)
+        return " ".join(val.split()).rstrip(";").lower()
+
+    @staticmethod
+    def _intern(column, val):
+        labels, codes, data = column
+        if val not in codes:
+            codes[val] = len(labels)
+            labels.append(val)
+        data.append(codes[val])
+
+    def add(self, url, headers, content_type=None, status=None):
+        self.urls.append(url)
+        self._intern(self.groups["origin"], url_origin(url))
+        self._intern(self.groups["type"], mime_type(content_type) or "unknown")
+        self._intern(self.groups["status"], str(status))
+
+        mask = 0
+        for idx, header in enumerate(self.headers):
+            val = self.normalize(headers.get(header))
+            if val is not None:
+                mask |= 1 << idx
+            self._intern(self.values[idx], val)
+        self.present.append(mask)
+
+    def coverage(self, dimension):
+        """ {group: (items, [items with header, for each header])} for
+            one of the dimensions, or a tuple of them (such as
+            ("origin", "type")), in which case each group is a tuple of
+            labels too.
+        """
+
+        if isinstance(dimension, tuple):
+            columns = [self.groups[d] for d in dimension]
+        else:
+            columns = [self.groups[dimension]]
+
+        res = {}
+
+        # distinct (group, header set) pairs are few, even when items
+        # aren't, so the per-header split is cheap.
+        pairs = zip(zip(*[data for _, _, data in columns]), self.present)
+        for (codes, mask), count in collections.Counter(pairs).items():
+            group = tuple(labels[code] for (labels, _, _), code
+                          in zip(columns, codes))
+            if not isinstance(dimension, tuple):
+                group = group[0]
+            if group not in res:
+                res[group] = (0, [0] * len(self.headers))
+            total, present = res[group]
+            for idx in range(len(self.headers)):
+                if mask >> idx & 1:
+                    present[idx] += count
+            res[group] = (total + count, present)
+
+        return res
+
+    def export(self, fh):
+        """ the matrix as CSV: one row per item, one column per header,
+            empty where the header was missing.
+        """
+
+        writer = csv.writer(fh)
+        writer.writerow(["url"] + list(self.dimensions) + self.headers)
+
+        columns = [self.groups[d] for d in self.dimensions] + self.values
+
+        for row, url in enumerate(self.urls):
+            writer.writerow([url] + [labels[data[row]] or ""
+                                     for labels, _, data in columns])
+
+
+class CoveragePlugin(LovetzPlugin):
+    """ Records the tracked headers of every response into a
+        LovetzHeaderMatrix, and reports what share of each origin,
+        content type, status & content type within each origin has
+        them once the run is done.
+    """
+
+    name = "coverage"
+    tags = ("headers", "coverage")
+    default = False
+    body_type = None
+
+    tracked = ["strict-transport-security", "content-security-policy",
+               "x-content-type-options", "x-frame-options",
+               "referrer-policy", "permissions-policy", "cache-control"]
+
+    # what coverage is reported over: matrix dimensions, or tuples of
+    # them (e.g. "what share of each origin's HTML lacks CSP")
+    groupings = ["origin", "type", "status", ("origin", "type")]
+
+    def __init__(self, *args, **kwargs):
+        super(CoveragePlugin, self).__init__(*args, **kwargs)
+        self.matrix = LovetzHeaderMatrix(self.tracked)
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+        self.matrix.add(url,
+                        response_headers,
+                        response_headers.get("content-type"),
+                        getattr(response_status, "code", response_status))
+
+    def reset(self):
+        super(CoveragePlugin, self).reset()
+        self.matrix = LovetzHeaderMatrix(self.tracked)
+
+    def finish(self):
+        msg = "{0} present on {1}% of responses ({2}/{3})"
+
+        for dimension in self.groupings:
+            coverage = self.matrix.coverage(dimension)
+            for group in sorted(coverage):
+                total, present = coverage[group]
+                label = self.label(dimension, group)
+                for header, count in zip(self.matrix.headers, present):
+                    self.log(LOG_INFO,
+                             label,
+                             msg,
+                             args=(header,
+                                   int(round(100.0 * count / total)),
+                                   count,
+                                   total))
+
+    @staticmethod
+    def label(dimension, group):
+        """ origin, "type text/html", "https://host type text/html" &c. """
+
+        if not isinstance(dimension, tuple):
+            dimension, group = (dimension,), (group,)
+
+        return " ".join(label if dim == "origin" else
+                        "{0} {1}".format(dim, label)
+                        for dim, label in zip(dimension, group))
 
 
 class JSDumpingPlugin(LovetzPlugin):
 
+    name = "jsdump"
+    tags = ("body", "js")
+    default = False
+
     # inspired by what https://github.com/sxthomas is doing
     # with his tool
 
+    # we're writing the script out to disk, so we need all of it,
+    # as it was sent
+    body_budget = LovetzBodyBudget()
+    body_type = BODY_BYTES
+
     def check(self, url, response_headers, request_headers,
               response_body, request_body, response_status, request_status):
         parsed_url = urllib.parse.urlsplit(url)
         if parsed_url.path.endswith(".js"):
             fname = urllib.parse.urlsplit(url).path.split('/')[-1]
 
-            # XXX: this is pretty awful
-            # I have to split the response status line here, to check
-            # those few times that we actually have a 200, instead of
-            # a 304 (which would mean it's a cache hit). There's probably
+            # only dump those times that we actually have a 200, instead
+            # of a 304 (which would mean it's a cache hit). There's probably
             # some more intelligent things we can do here, like check the
-            # size of the JS on disk vs the size we see in the response,
-            # but having a parsed status line is key.
+            # size of the JS on disk vs the size we see in the response.
 
-            vals = response_status.split(" ")
-
-            if vals[1] == "200" and not os.path.isfile(fname):
+            if response_status.code == 200 and not os.path.isfile(fname):
                 self.log(LOG_INFO,
                          url,
                          "Dumped JavaScript body")
-                with open(fname, 'w') as fh:
+                with open(fname, 'wb') as fh:
                     fh.write(response_body)
 
 
+class JSAnalysisPlugin(LovetzPlugin):
+    """ Runs an external JavaScript analyzer (SAST &c.) over each
+        distinct script in the history, e.g.
+
+            --js-analyzer "semgrep --config p/javascript --quiet {file}"
+            --js-analyzer "grep -n eval( {file}"
+
+        {file} is the script's path; without it, the path is added at
+        the end. Scripts run through a pool of jobs analyzer processes
+        while the scan goes on; results are cached in cache_dir by a
+        hash of the command & the script, so duplicate bundles & later
+        runs never analyze a script twice. The script itself is only
+        kept there while it's being analyzed.
+
+        Each line of the analyzer's output is a finding: either a JSON
+        object with message (and optionally severity & line), or
+        "severity: message", or just text, which is taken as a warning.
+    """
+
+    name = "jsanalyze"
+    tags = ("body", "js")
+    default = False
+
+    body_budget = LovetzBodyBudget()
+    body_type = BODY_BYTES
+
+    js_types = frozenset(["application/javascript", "text/javascript",
+                          "application/x-javascript",
+                          "application/ecmascript", "text/ecmascript"])
+
+    # set from the command line (see --js-analyzer &c.)
+    command = None
+    cache_dir = os.path.expanduser(os.path.join("~", ".cache", "lovetz", "js"))
+    jobs = os.cpu_count() or 1
+    timeout = 120
+
+    def __init__(self, *args, **kwargs):
+        super(JSAnalysisPlugin, self).__init__(*args, **kwargs)
+        self.pool = None
+        self.reset_scripts()
+
+    def reset_scripts(self):
+        # key -> [urls, future or cached findings]; urls is a dict used
+        # as an ordered set, as a script is usually fetched many times
+        # from the same URL.
+        self.scripts = {}
+
+    def key(self, body):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.command.encode("utf8") + b"\0")
+        h.update(body)
+        return h.hexdigest()
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+
+        if self.command is None or response_status.code != 200 or \
+           not len(response_body):
+            return
+
+        if mime_type(response_headers.get('content-type')) not in self.js_types and \
+           not urllib.parse.urlsplit(url).path.endswith(".js"):
+            return
+
+        key = self.key(response_body)
+
+        if key in self.scripts:
+            self.scripts[key][0][url] = None
+            return
+
+        cached = os.path.join(self.cache_dir, key + ".json")
+
+        if os.path.isfile(cached):
+            with open(cached, 'r') as fh:
+                self.scripts[key] = [{url: None}, json.load(fh)]
+            return
+
+        script = os.path.join(self.cache_dir, key + ".js")
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(script, 'wb') as fh:
+                fh.write(response_body)
+        except OSError as e:
+            self.scripts[key] = [{url: None},
+                                 [[LOG_ERROR, "JS analyzer failed: {0}".format(e)]]]
+            return
+
+        if self.pool is None:
+            # threads are enough; the work happens in the analyzer's
+            # own processes
+            self.pool = concurrent.futures.ThreadPoolExecutor(self.jobs)
+
+        self.scripts[key] = [{url: None}, self.pool.submit(self.analyze,
+                                                           script, cached)]
+
+    def analyze(self, script, cached):
+        cmd = shlex.split(self.command)
+
+        if any("{file}" in arg for arg in cmd):
+            cmd = [arg.replace("{file}", script) for arg in cmd]
+        else:
+            cmd.append(script)
+
+        try:
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            # not cached, so that it's tried again next time
+            return [[LOG_ERROR, "JS analyzer failed: {0}".format(e)]]
+        finally:
+            try:
+                os.unlink(script)
+            except OSError:
+                pass
+
+        res = self.normalize(proc.stdout.decode("utf8", "replace"))
+
+        if not res and proc.returncode not in (0, 1):
+            err = proc.stderr.decode("utf8", "replace").strip()
+            return [[LOG_ERROR, "JS analyzer exited with {0}: {1}".format(
+                proc.returncode, err.splitlines()[-1] if err else "")]]
+
+        try:
+            with open(cached, 'w') as fh:
+                json.dump(res, fh)
+        except OSError as e:
+            res.append([LOG_ERROR, "JS analyzer results not cached: {0}".format(e)])
+
+        return res
+
+    def normalize(self, output):
+        res = []
+
+        for line in output.splitlines():
+            line = line.strip()
+
+            if not line:
+                continue
+
+            event, message = LOG_WARN, line
+
+            if line.startswith("{"):
+                try:
+                    val = json.loads(line)
+                    message = val["message"]
+                    event = RULE_SEVERITIES.get(str(val.get("severity", "warn")).lower(),
+                                                LOG_WARN)
+                    if val.get("line") is not None:
+                        message = "line {0}: {1}".format(val["line"], message)
+                except (ValueError, KeyError, TypeError):
+                    pass
+            else:
+                level, _, rest = line.partition(":")
+                if level.strip().lower() in RULE_SEVERITIES and rest.strip():
+                    event = RULE_SEVERITIES[level.strip().lower()]
+                    message = rest.strip()
+
+            res.append([event, message])
+
+        return res
+
+    def finish(self):
+        for urls, res in self.scripts.values():
+            if isinstance(res, concurrent.futures.Future):
+                res = res.result()
+
+            suffix = ""
+            if len(urls) > 1:
+                suffix = " (same script at {0} other URLs)".format(len(urls) - 1)
+
+            url = next(iter(urls))
+            for event, message in res:
+                self.log(event, url, "(js) " + message + suffix)
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def reset(self):
+        super(JSAnalysisPlugin, self).reset()
+        self.reset_scripts()
+
+
+class DiscoveryPlugin(LovetzPlugin):
+    """ Out-of-band discovery: pulls the URLs, API paths & hosts that
+        bodies (HTML, JavaScript, JSON &c.) and Location/Link headers
+        point at, and reports those the history never visited, by
+        origin. Each body gets a single regex pass.
+
+        Links are kept as 8-byte digests for de-duplication, and only
+        the first limit distinct ones are kept at all; past that they
+        are just counted per origin. The history's own URLs (every
+        one, whether or not the engine checks it; see seen) go into
+        a bloom filter of visited_bits bits, so memory stays fixed
+        however long the history is.
+    """
+
+    name = "discovery"
+    tags = ("body", "discovery")
+    default = False
+    body_type = BODY_BYTES
+
+    # absolute URLs; quoted root- or protocol-relative paths (JS &
+    # JSON); and href/src/action attributes, which may be relative
+    link_re = re.compile(rb"""(https?://[a-z0-9.-]+(?::\d+)?(?:/[^\s"'<>()\\`]*)?)|"""
+                         rb"""["'`](//[a-z0-9.-]+[^\s"'<>()\\`]*|/[\w\-.~%/:@+=,;]+)["'`]|"""
+                         rb"""\b(?:href|src|action)\s*=\s*["']?([^\s"'<>#?]+)""",
+                         re.I)
+
+    link_header_re = re.compile(r"<([^>]+)>")
+
+    ignored = ("data:", "javascript:", "mailto:", "tel:", "#", "about:")
+
+    limit = 100000
+
+    # 16 MiB; with 3 bits per URL, fewer than 1% of discovered links
+    # are mistaken for visited ones until the history has ~10 million
+    # distinct URLs.
+    visited_bits = 1 << 27
+
+    def __init__(self, *args, **kwargs):
+        super(DiscoveryPlugin, self).__init__(*args, **kwargs)
+        self.reset_inventory()
+
+    def reset_inventory(self):
+        self.visited = bytearray(self.visited_bits // 8)
+        self.origins = set()    # origins in the history
+        self.seen = set()       # digests of discovered links
+        self.found = {}         # origin -> [url, ...]
+        self.overflow = {}      # origin -> links past limit
+
+    @staticmethod
+    def key(url):
+        return hashlib.blake2b(url.encode("utf8", "replace"),
+                               digest_size=8).digest()
+
+    def _bits(self, url):
+        digest = hashlib.blake2b(url.encode("utf8", "replace"),
+                                 digest_size=12).digest()
+        return [int.from_bytes(digest[idx:idx + 4], "little") % self.visited_bits
+                for idx in (0, 4, 8)]
+
+    def visit(self, url):
+        for bit in self._bits(url):
+            self.visited[bit >> 3] |= 1 << (bit & 7)
+
+    def was_visited(self, url):
+        return all(self.visited[bit >> 3] & (1 << (bit & 7))
+                   for bit in self._bits(url))
+
+    def normalize(self, link, base):
+        """ scheme://host[:port]/path of link, resolved against base;
+            None for anything that isn't an http(s) URL.
+        """
+
+        link = link.strip()
+
+        if not link or link.lower().startswith(self.ignored):
+            return None
+
+        try:
+            parts = urllib.parse.urlsplit(urllib.parse.urljoin(base, link))
+            port = parts.port
+        except ValueError:
+            return None
+
+        scheme = parts.scheme.lower()
+
+        if scheme not in ("http", "https") or not parts.hostname:
+            return None
+
+        netloc = parts.hostname
+        if port is not None and (scheme, port) not in [("http", 80), ("https", 443)]:
+            netloc += ":{0}".format(port)
+
+        return "{0}://{1}{2}".format(scheme, netloc, parts.path or "/")
+
+    def add(self, url):
+        if url is None:
+            return
+
+        key = self.key(url)
+
+        if key in self.seen:
+            return
+
+        origin = url_origin(url)
+
+        if len(self.seen) >= self.limit:
+            self.overflow[origin] = self.overflow.get(origin, 0) + 1
+            return
+
+        self.seen.add(key)
+        self.found.setdefault(origin, []).append(url)
+
+    def observe(self, item):
+        here = self.normalize(item.url, item.url)
+
+        if here is not None:
+            self.visit(here)
+            self.origins.add(url_origin(here))
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+
+        for header in ("location", "content-location"):
+            val = response_headers.get(header)
+            if isinstance(val, str):
+                self.add(self.normalize(val, url))
+
+        val = response_headers.get("link")
+        if val is not None:
+            if isinstance(val, list):
+                val = ", ".join(val)
+            for link in self.link_header_re.findall(val):
+                self.add(self.normalize(link, url))
+
+        if not len(response_body):
+            return
+
+        for m in self.link_re.finditer(response_body):
+            link = m.group(1) or m.group(2) or m.group(3)
+            self.add(self.normalize(link.decode("utf8", "replace"), url))
+
+    def inventory(self):
+        """ {origin: [never-visited URLs]} """
+
+        res = {}
+
+        for origin, urls in self.found.items():
+            unvisited = sorted(u for u in urls if not self.was_visited(u))
+            if unvisited:
+                res[origin] = unvisited
+
+        return res
+
+    def finish(self):
+        inventory = self.inventory()
+
+        for origin in sorted(set(inventory) | set(self.overflow)):
+            urls = inventory.get(origin, [])
+
+            if urls:
+                self.log(LOG_INFO,
+                         origin,
+                         "{0} discovered endpoints never visited{1}",
+                         args=(len(urls),
+                               "" if origin in self.origins else
+                               " (origin not in history)"))
+
+            for url in urls:
+                self.log(LOG_INFO, url, "Discovered endpoint not in history")
+
+            if origin in self.overflow:
+                self.log(LOG_WARN,
+                         origin,
+                         "{0} more links (not de-duplicated) past the discovery limit of {1}",
+                         args=(self.overflow[origin], self.limit))
+
+    def reset(self):
+        super(DiscoveryPlugin, self).reset()
+        self.reset_inventory()
+
+
+# entry point group third-party packages register plugins under, e.g.
+#   [project.entry-points."lovetz.plugins"]
+#   csp = "mypkg.plugins:CSPPlugin [headers, csp]"
+# the bracketed extras double as the plugin's tags, so that selecting
+# by tag doesn't require importing anything.
+PLUGIN_GROUP = "lovetz.plugins"
+
+# marker line plugin-directory modules can use to declare tags,
+# read without importing the module.
+PLUGIN_TAGS_RE = re.compile(r"^#\s*lovetz-tags:\s*(.*)$")
+
+
+class LovetzPluginEntry(object):
+    """ A plugin the registry knows about, but hasn't necessarily loaded.
+
+        target is a LovetzPlugin subclass (builtin), an entry point
+        (entrypoint) or the path to a module (directory).
+    """
+    __slots__ = ['name', 'tags', 'default', 'source', 'target']
+
+    def __init__(self, name, target, tags=(), default=True, source="builtin"):
+        self.name = name
+        self.target = target
+        self.tags = tuple(tags)
+        self.default = default
+        self.source = source
+
+    def matches(self, token):
+        return token == self.name or token in self.tags
+
+    def selected_by(self, token):
+        """ Whether token turns this plugin on: its name always does,
+            but a tag only picks up default plugins, so that opt-in
+            ones (which may write files, or repeat other plugins'
+            findings) have to be asked for by name.
+        """
+        return token == self.name or (self.default and token in self.tags)
+
+    def load(self):
+        """ Import (if need be) and return the plugin classes for this
+            entry.
+        """
+
+        if self.source == "builtin":
+            return [self.target]
+
+        # make sure plugin modules that import lovetz get *this*
+        # module, even when we're running as __main__; otherwise
+        # their LovetzPlugin is a different class to ours.
+        sys.modules.setdefault("lovetz", sys.modules[__name__])
+
+        if self.source == "entrypoint":
+            obj = self.target.load()
+        else:
+            modname = "lovetz_plugin_{0}".format(self.name)
+            spec = importlib.util.spec_from_file_location(modname,
+                                                          self.target)
+            obj = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(obj)
+
+        if isinstance(obj, type):
+            return [obj]
+
+        return [v for v in vars(obj).values()
+                if isinstance(v, type) and issubclass(v, LovetzPlugin) and
+                v.__module__ == obj.__name__]
+
+
+class LovetzPluginRegistry(object):
+    """ Knows which plugins exist, and imports & instantiates only the
+        ones that have been selected.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def register(self, entry):
+        self.entries[entry.name] = entry
+
+    def register_class(self, cls):
+        self.register(LovetzPluginEntry(cls.name or cls.__name__.lower(),
+                                        cls,
+                                        tags=cls.tags,
+                                        default=cls.default))
+
+    def discover_entry_points(self, group=PLUGIN_GROUP):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+
+        eps = entry_points()
+
+        if hasattr(eps, "select"):
+            eps = eps.select(group=group)
+        else:
+            eps = eps.get(group, [])
+
+        for ep in eps:
+            self.register(LovetzPluginEntry(ep.name, ep,
+                                            tags=ep.extras,
+                                            source="entrypoint"))
+
+    def discover_directory(self, path):
+        for fname in sorted(os.listdir(path)):
+            if not fname.endswith(".py") or fname.startswith("_"):
+                continue
+
+            fullpath = os.path.join(path, fname)
+            tags = []
+
+            with open(fullpath, 'r') as fh:
+                for _, line in zip(range(20), fh):
+                    m = PLUGIN_TAGS_RE.match(line.strip())
+                    if m:
+                        tags = [t.strip() for t in m.group(1).split(",")
+                                if t.strip()]
+                        break
+
+            self.register(LovetzPluginEntry(fname[:-3], fullpath, tags=tags,
+                                            source="directory"))
+
+    def select(self, only=None, enable=None, disable=None):
+        """ Work out which plugins to run: the defaults, or just those
+            named in only; then add enable & remove disable. Each of
+            these is a list of plugin names or tags; tags in only &
+            enable never select non-default plugins (see selected_by).
+        """
+
+        for token in (only or []) + (enable or []) + (disable or []):
+            if not any(e.matches(token) for e in self.entries.values()):
+                raise ValueError("no plugin or tag named {0}".format(token))
+
+        if only:
+            names = [n for n, e in self.entries.items()
+                     if any(e.selected_by(t) for t in only)]
+        else:
+            names = [n for n, e in self.entries.items() if e.default]
+
+        for n, e in self.entries.items():
+            if n not in names and any(e.selected_by(t) for t in enable or []):
+                names.append(n)
+
+        return [n for n in names
+                if not any(self.entries[n].matches(t)
+                           for t in disable or [])]
+
+    def instantiate(self, names, **kwargs):
+        plugins = []
+        for name in names:
+            for cls in self.entries[name].load():
+                plugins.append(cls(entry_name=name, **kwargs))
+        return plugins
+
+
+def default_registry(plugin_dirs=None):
+    registry = LovetzPluginRegistry()
+
+    for cls in [CORSPlugin, CookiePlugin, HeaderPlugin, OriginHeaderPlugin,
+                ETagPlugin, SensitiveDataPlugin, FingerprintPlugin,
+                CSRFPlugin, AutocompletePlugin, CoveragePlugin,
+                JSDumpingPlugin, JSAnalysisPlugin, DiscoveryPlugin]:
+        registry.register_class(cls)
+
+    registry.discover_entry_points()
+
+    for path in plugin_dirs or []:
+        registry.discover_directory(path)
+
+    return registry
+
+
 class LovetzHistoryItem(object):
 
     # perhaps History items should have a cookie jar attached? That way plugins
@@ -632,26 +2599,242 @@ class LovetzHistoryItem(object):
     # rather there would already be a cookie jar attached here... creates a bit
     # more work for the history readers, but shouldn't be terribly difficult...
 
+    # content_type, content_class & charset describe the response
+    # body, which is kept however the reader had it: bytes (or a
+    # memoryview) for Burp, text for the others; text() decodes it.
+    # they aren't part of myslots, so plugins' check doesn't receive
+    # them.
+
+    # as is source, the history file the item was read from.
+
+    # a body can also be held still encoded (body_encoding "base64",
+    # from HARs & NDJSON), and is then only decoded when something
+    # reads response_body. body_size is its decoded size, when known
+    # without decoding it. A body that turns out not to be valid
+    # base64 is dropped (checked as empty) and the item marked
+    # undecodable.
+
     __slots__ = ['url', 'request_status', 'request_headers', 'request_body',
-                 'response_status', 'response_headers', 'response_body',
-                 'myslots']
+                 'response_status', 'response_headers', '_response_body',
+                 'body_encoding', 'body_size', 'content_type',
+                 'content_class', 'charset', 'source', 'html',
+                 'undecodable', 'myslots']
+
+    # response headers that go into fingerprint; these are the ones
+    # plugins look at, and that don't vary between two tools' captures
+    # of the same transaction (unlike, say, Date or Age).
+    fingerprint_headers = ["content-type", "location", "set-cookie", "etag",
+                           "cache-control", "pragma", "expires",
+                           "x-xss-protection", "x-content-type-options",
+                           "x-frame-options", "strict-transport-security",
+                           "x-powered-by", "server", "www-authenticate",
+                           "content-security-policy",
+                           "content-security-policy-report-only",
+                           "access-control-allow-origin",
+                           "access-control-allow-methods",
+                           "access-control-allow-headers",
+                           "access-control-allow-credentials",
+                           "access-control-expose-headers",
+                           "access-control-max-age"]
 
     def __init__(self, url, req_status, req_headers, req_body,
-                 res_status, res_headers, res_body):
+                 res_status, res_headers, res_body, content_type=None,
+                 content_class=None, source=None, body_encoding=None,
+                 body_size=None):
         self.url = url
+        self.source = source
+        self.html = None
+        self.undecodable = False
         self.request_status = req_status
         self.request_headers = req_headers
         self.request_body = req_body
         self.response_status = res_status
         self.response_headers = res_headers
-        self.response_body = res_body
+        self._response_body = res_body
+        self.body_encoding = body_encoding
+
+        if body_size is None and body_encoding is None and res_body is not None:
+            body_size = len(res_body)
+        self.body_size = body_size
+
+        self.charset = None
+        if res_headers is not None:
+            self.charset = content_charset(res_headers.get('content-type'))
+
+        if content_type is None and res_headers is not None:
+            content_type = res_headers.get('content-type')
+        self.content_type = mime_type(content_type)
+
+        if content_class is None:
+            content_class = classify_content(self.content_type,
+                                             self.sniff())
+        if self.undecodable:
+            content_class = CONTENT_EMPTY
+        self.content_class = content_class
         self.myslots = ['url', 'request_status', 'request_headers',
                         'request_body', 'response_status', 'response_headers',
                         'response_body']
 
+    @property
+    def response_body(self):
+        if self.body_encoding == "base64":
+            try:
+                self._response_body = base64.b64decode(self._response_body)
+            except ValueError:
+                # bad padding &c.; there's nothing to check
+                self._response_body = b""
+                self.content_class = CONTENT_EMPTY
+                self.undecodable = True
+            self.body_encoding = None
+            self.body_size = len(self._response_body)
+        return self._response_body
+
+    @response_body.setter
+    def response_body(self, body):
+        self._response_body = body
+        self.body_encoding = None
+        self.body_size = len(body)
+
+    def sniff(self, size=512):
+        """ The first size-odd bytes of the body, without decoding the
+            rest of it; enough for classify_content.
+        """
+
+        if self.body_encoding != "base64":
+            return self._response_body
+
+        # 4 characters of base64 to every 3 bytes
+        head = "".join(self._response_body[:size * 2].split())
+
+        try:
+            return base64.b64decode(head[:(size // 3 + 1) * 4])
+        except ValueError:
+            return self.response_body[:size]
+
     def keys(self):
         return self.myslots
 
+    def __reduce__(self):
+        # much cheaper than the generic __slots__ pickling, which
+        # matters when workers send items back (see ParallelBurpReader)
+        return (LovetzHistoryItem, (self.url, self.request_status,
+                                    self.request_headers, self.request_body,
+                                    self.response_status,
+                                    self.response_headers,
+                                    self.response_body, self.content_type,
+                                    self.content_class, self.source))
+
+    def text(self):
+        """ The response body as text, using the response's charset """
+        return decode_body(self.response_body, self.charset)
+
+    def fingerprint(self):
+        """ Digest of the transaction: method, normalized URL, status,
+            the fingerprint_headers & a hash of the response body. Two
+            captures of the same request/response (say, from Burp and
+            a HAR) come out the same.
+
+            Binary bodies are only hashed by their size: images & fonts
+            are most of a history and no plugin reads them by default,
+            so decoding (say) every base64 HAR body just to tell them
+            apart isn't worth it. Two binary responses to the same
+            request with the same headers & size count as one.
+        """
+
+        parts = urllib.parse.urlsplit(self.url)
+        netloc = parts.netloc.lower()
+
+        if (parts.scheme.lower(), parts.port) in [("http", 80), ("https", 443)]:
+            netloc = netloc.rsplit(":", 1)[0]
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update("{0} {1}://{2}{3}?{4} {5}\n".format(
+            getattr(self.request_status, 'method', ''),
+            parts.scheme.lower(),
+            netloc,
+            parts.path or "/",
+            parts.query,
+            getattr(self.response_status, 'code', 0)).encode("utf8"))
+
+        for header in self.fingerprint_headers:
+            val = self.response_headers.get(header)
+            if val is None:
+                continue
+            if isinstance(val, list):
+                val = "\n".join(val)
+            h.update("{0}: {1}\n".format(header, val).encode("utf8"))
+
+        if self.content_class == CONTENT_BINARY:
+            size = self.body_size
+            if size is None:
+                size = len(self.response_body)
+            h.update("binary {0}\n".format(size).encode("utf8"))
+            return h.digest()
+
+        body = self.response_body
+        if isinstance(body, str):
+            body = body.encode("utf8", errors="replace")
+        if len(body):
+            h.update(hashlib.blake2b(body, digest_size=16).digest())
+
+        return h.digest()
+
+    @staticmethod
+    def from_dict(val):
+        """ Build a history item from a plain dict, such as a line of
+            JSON from another tool:
+
+            {"url": "http://host/path",
+             "method": "GET",             # or "request_line": "GET / HTTP/1.1"
+             "status": 200,               # or "status_line": "HTTP/1.1 200 OK"
+             "request_headers": {"Host": "host"},   # or [[name, value], ...]
+             "response_headers": {"Content-Type": "text/html"},
+             "request_body": "", "response_body": "<html>..."}
+
+            response_body_base64 may be given instead of response_body
+            for binary content.
+        """
+
+        url = val['url']
+
+        if 'request_line' in val:
+            req_status = LovetzRequestLine.parse(val['request_line'])
+        else:
+            req_status = LovetzRequestLine(val.get('method', 'GET'),
+                                           url,
+                                           val.get('version', 'HTTP/1.1'))
+
+        if 'status_line' in val:
+            res_status = LovetzResponseLine.parse(val['status_line'])
+        else:
+            res_status = LovetzResponseLine(val.get('version', 'HTTP/1.1'),
+                                            val.get('status', 0),
+                                            val.get('reason', ''))
+
+        headers = []
+        for key in ['request_headers', 'response_headers']:
+            res = HeaderDict()
+            tmp = val.get(key) or {}
+            if isinstance(tmp, dict):
+                tmp = tmp.items()
+            for name, value in tmp:
+                res[name] = value
+            headers.append(res)
+
+        encoding = None
+
+        if val.get('response_body_base64'):
+            res_body = val['response_body_base64']
+            encoding = "base64"
+        else:
+            res_body = val.get('response_body') or ''
+
+        return LovetzHistoryItem(url, req_status, headers[0],
+                                 val.get('request_body') or '',
+                                 res_status, headers[1], res_body,
+                                 source=val.get('source'),
+                                 body_encoding=encoding)
+
     def __getitem__(self, key):
         if key not in self.myslots:
             return KeyError("no such key: {0}".format(key))
@@ -676,6 +2859,13 @@ class LovetzHistoryItem(object):
 
 class LovetzReader(object):
 
+    # for progress reports (see LovetzProgress): the source's size in
+    # bytes, how many entries it holds, if that's known once it's
+    # loaded, and how many have been read so far.
+    size = 0
+    count = 0
+    done = 0
+
     def __init__(self, filename=None, loadNow=False, dom=None, domre=False):
         self.filename = filename
 
@@ -706,6 +2896,29 @@ class LovetzReader(object):
     def iteritem(self):
         raise NotImplemented("iteritem not implemented in base")
 
+    def iterraw(self):
+        """ (url, content type, raw entry) for each entry, without
+            decoding anything else; decode turns a raw entry into a
+            history item (or None). See LovetzSampler.
+        """
+        raise NotImplemented("iterraw not implemented in base")
+
+    def decode(self, raw):
+        raise NotImplemented("decode not implemented in base")
+
+    def position(self):
+        """ Roughly how many bytes of the source have been read """
+
+        if self.count:
+            return self.size * min(self.done, self.count) // self.count
+        return 0
+
+
+def source_size(filename):
+    if filename and os.path.isfile(filename):
+        return os.path.getsize(filename)
+    return 0
+
 
 class HARReader(LovetzReader):
 
@@ -715,6 +2928,8 @@ class HARReader(LovetzReader):
             self.json_doc = None
             with open(self.filename, 'r') as f:
                 self.json_doc = json.load(f)
+            self.size = source_size(self.filename)
+            self.count = len(self.json_doc['log']['entries'])
         else:
             self.filename = None
             self.json_doc = None
@@ -734,7 +2949,7 @@ class HARReader(LovetzReader):
         url = req['url']
         method = req['method']
         version = req['httpVersion']
-        req_stat = "{0} {1} {2}".format(method, url, version)
+        req_stat = LovetzRequestLine(method, url, version)
 
         if req['bodySize'] <= 0:
             req_body = ''
@@ -755,23 +2970,63 @@ class HARReader(LovetzReader):
 
         res_headers = self._headers(res['headers'])
 
-        res_stat = "{0} {1} {2}".format(ver, scode, stext)
-
-        if res['bodySize'] <= 0:
-            res_body = ''
+        res_stat = LovetzResponseLine(ver, scode, stext)
+
+        content = res.get('content') or {}
+        ctype = mime_type(content.get('mimeType'))
+
+        # bodySize is what went over the wire, so it's 0 for cached
+        # responses & smaller than the body for compressed ones;
+        # whether there's a body is down to content.text, and its
+        # real size is content.size.
+        res_body = content.get('text') or ''
+        encoding = content.get('encoding')
+        size = content.get('size')
+
+        if size is None or size < 0:
+            size = None
+
+        if not res_body:
+            cclass = CONTENT_EMPTY
+            encoding = None
+        elif encoding == 'base64' and \
+             (ctype is None or TEXT_TYPES.search(ctype) is None):
+            # base64'd content with no textual mimeType is an
+            # image, font &c.; don't bother looking inside it.
+            cclass = CONTENT_BINARY
+        elif encoding == 'base64':
+            cclass = None   # let the item sniff it
         else:
-            res_body = res['content']['text']
+            encoding = None
+            cclass = classify_content(ctype, res_body)
+
+        return (res_stat, res_headers, res_body, ctype, cclass, encoding,
+                size)
+
+    def iterraw(self):
 
-        return (res_stat, res_headers, res_body)
+        for entry in self.json_doc['log']['entries']:
+            self.done += 1
+            content = entry['response'].get('content') or {}
+            yield (entry['request']['url'], content.get('mimeType'), entry)
+
+    def decode(self, entry):
+        req = self._request(entry['request'])
+        res = self._response(entry['response'])
+
+        return LovetzHistoryItem(req[0], req[1], req[2], req[3],
+                                 res[0], res[1], res[2],
+                                 content_type=res[3],
+                                 content_class=res[4],
+                                 source=self.filename,
+                                 body_encoding=res[5],
+                                 body_size=res[6])
 
     def iteritem(self):
 
         for entry in self.json_doc['log']['entries']:
-            req = self._request(entry['request'])
-            res = self._response(entry['response'])
-
-            yield LovetzHistoryItem(req[0], req[1], req[2], req[3],
-                                    res[0], res[1], res[2])
+            self.done += 1
+            yield self.decode(entry)
 
 
 class BurpProxyReader(LovetzReader):
@@ -780,17 +3035,21 @@ class BurpProxyReader(LovetzReader):
         if filename is not None:
             self.filename = filename
             self.tree = parse(self.filename)
+            self.size = source_size(self.filename)
+            self.count = len(self.tree.getroot())
         else:
             self.tree = None
             self.filename = None
 
     def _headers(self, item):
-        tmp = item.split(b'\r\n\r\n')
-        try:
-            body = str(tmp[1], encoding="utf8")
-        except:
-            body = tmp[1]
-        tmp = str(tmp[0], encoding="utf8").split('\r\n')
+        idx = item.find(b'\r\n\r\n')
+
+        if idx < 0:
+            head, body = item, memoryview(b'')
+        else:
+            head, body = item[:idx], memoryview(item)[idx + 4:]
+
+        tmp = str(head, encoding="utf8", errors="replace").split('\r\n')
         status = tmp[0]
         tmp = tmp[1:]
 
@@ -798,9 +3057,79 @@ class BurpProxyReader(LovetzReader):
 
         for t in tmp:
             if ':' in t:
-                k, v = t.split(': ', 1)
-                headers[k] = v
-        return (status, headers, body)
+                k, v = t.split(':', 1)
+                headers[k] = v.strip()
+
+        ctype = mime_type(headers.get('content-type'))
+        cclass = classify_content(ctype, body)
+
+        # bodies stay as a view over the base64-decoded item; text is
+        # only decoded if a plugin asks for it (see LovetzEngine).
+        if cclass == CONTENT_EMPTY:
+            body = b''
+
+        return (status, headers, body, ctype, cclass)
+
+    def _item(self, item):
+        url, response, request = "", "", ""
+        for c in item:
+            if c.tag == "url":
+                url = c.text
+            elif c.tag == "response":
+                try:
+                    response = base64.b64decode(c.text)
+                except:
+                    response = c.text
+            elif c.tag == "request":
+                try:
+                    request = base64.b64decode(c.text)
+                except:
+                    request = c.text
+
+        if self.dom and self.dom.search(url) is None:
+            return None
+
+        # are there actually cases wherein we care about
+        # requests that failed... at the network level?
+        # debugging?
+
+        if response is None:
+            return None
+
+        req_status, req_head, req_body = self._headers(request)[:3]
+
+        # plugins have always been handed request bodies as text; only
+        # response bodies go through body_type.
+        if req_body:
+            req_body = decode_body(bytes(req_body),
+                                   content_charset(req_head.get('content-type')))
+        else:
+            req_body = ''
+        res_status, res_head, res_body, ctype, cclass = \
+            self._headers(response)
+
+        return LovetzHistoryItem(url,
+                                 LovetzRequestLine.parse(req_status),
+                                 req_head,
+                                 req_body,
+                                 LovetzResponseLine.parse(res_status),
+                                 res_head,
+                                 res_body,
+                                 content_type=ctype,
+                                 content_class=cclass,
+                                 source=self.filename)
+
+    def iterraw(self):
+
+        if self.tree is None:
+            raise Exception("no file has been previously loaded")
+
+        for item in self.tree.iterfind('./item'):
+            self.done += 1
+            yield (item.findtext('url'), item.findtext('mimetype'), item)
+
+    def decode(self, item):
+        return self._item(item)
 
     def iteritem(self):
 
@@ -808,36 +3137,161 @@ class BurpProxyReader(LovetzReader):
             raise Exception("no file has been previously loaded")
 
         for item in self.tree.iterfind('./item'):
-            url, response, request = "", "", ""
-            for c in item:
-                if c.tag == "url":
-                    url = c.text
-                elif c.tag == "response":
-                    try:
-                        response = base64.b64decode(c.text)
-                    except:
-                        response = c.text
-                elif c.tag == "request":
-                    try:
-                        request = base64.b64decode(c.text)
-                    except:
-                        request = c.text
-
-            if self.dom and self.dom.search(url) is None:
-                continue
+            self.done += 1
+            res = self._item(item)
+            if res is not None:
+                yield res
 
-            # are there actually cases wherein we care about
-            # requests that failed... at the network level?
-            # debugging?
 
-            if response is None:
-                continue
+def _burp_boundary(mm, pos, end):
+    """ Offset of the first <item> at or after pos (and before end)
+        that really starts a Burp item, i.e. is followed by its <time>;
+        unencoded bodies (RSS, say) can contain <item> too.
+    """
+
+    while True:
+        pos = mm.find(b"<item>", pos, end)
+
+        if pos < 0:
+            return end
+
+        nxt = pos + 6
+        while nxt < end and mm[nxt:nxt + 1] in b" \t\r\n":
+            nxt += 1
+
+        if mm[nxt:nxt + 6] == b"<time>":
+            return pos
+
+        pos += 6
+
+
+def _burp_chunk(args):
+    """ Worker for ParallelBurpReader: parse the items in one byte
+        range of the export, and return them as history items.
+    """
+
+    filename, start, end, dom = args
+
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+
+    reader = BurpProxyReader()
+    reader.filename = filename
+    reader.dom = dom
+
+    res = []
+    for item in fromstring(b"<items>" + data + b"</items>").iterfind('./item'):
+        item = reader._item(item)
+        if item is None:
+            continue
+        # views don't survive the trip back to the parent
+        if isinstance(item.response_body, memoryview):
+            item.response_body = bytes(item.response_body)
+        res.append(item)
+
+    return res
+
+
+class ParallelBurpReader(BurpProxyReader):
+    """ BurpProxyReader that splits the export on <item> boundaries
+        (a byte scan over an mmap of the file, without parsing it) and
+        has a pool of jobs worker processes parse & base64-decode the
+        ranges. Items are still yielded in file order, and only a
+        window of ranges is handed out ahead of the one being yielded,
+        so the parent never holds much more than that in memory.
+    """
+
+    # ranges per worker; a few each keeps the pool busy when some
+    # ranges are heavier than others
+    chunks_per_job = 4
+
+    # ranges smaller than this aren't worth shipping to a worker
+    min_chunk = 1024 * 1024
+
+    # ...and larger ones are split further, so that the window below
+    # bounds memory however big the export is
+    max_chunk = 32 * 1024 * 1024
+
+    # ranges in flight (being parsed, or parsed & waiting) per worker
+    window_per_job = 2
+
+    def __init__(self, jobs=None, **kwargs):
+        self.jobs = jobs or os.cpu_count() or 1
+        super(ParallelBurpReader, self).__init__(**kwargs)
+
+    def load(self, filename=None):
+        self.tree = None
+        self.filename = filename
+        self.size = source_size(filename)
+        self.offset = 0
+
+    def position(self):
+        # the end of the last range whose items have all been yielded
+        return self.offset
+
+    def ranges(self):
+        with open(self.filename, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+
+            if size == 0:
+                return []
+
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                first = _burp_boundary(mm, 0, size)
+                last = mm.rfind(b"</items>")
+                if last < first:
+                    last = size
+
+                count = max(1, min(max(self.jobs * self.chunks_per_job,
+                                       -(-(last - first) // self.max_chunk)),
+                                   (last - first) // self.min_chunk))
+                step = (last - first) // count
+
+                bounds = [first]
+                for idx in range(1, count):
+                    pos = _burp_boundary(mm, max(first + idx * step,
+                                                 bounds[-1] + 1), last)
+                    if pos >= last:
+                        break
+                    bounds.append(pos)
+                bounds.append(last)
+
+        return [(self.filename, bounds[idx], bounds[idx + 1], self.dom)
+                for idx in range(len(bounds) - 1)]
+
+    def iteritem(self):
+
+        if self.filename is None:
+            raise Exception("no file has been previously loaded")
+
+        ranges = self.ranges()
+
+        if len(ranges) <= 1 or self.jobs <= 1:
+            for args in ranges:
+                for item in _burp_chunk(args):
+                    yield item
+                self.offset = args[2]
+            return
+
+        with multiprocessing.Pool(min(self.jobs, len(ranges))) as pool:
+            # Pool.imap would parse every range as fast as it could,
+            # whether or not the plugins were keeping up
+            todo = iter(ranges)
+            pending = collections.deque(
+                (args, pool.apply_async(_burp_chunk, (args,)))
+                for args in itertools.islice(todo, self.jobs * self.window_per_job))
 
-            req_status, req_head, req_body = self._headers(request)
-            res_status, res_head, res_body = self._headers(response)
+            while pending:
+                args, res = pending.popleft()
+                items = res.get()
 
-            yield LovetzHistoryItem(url, req_status, req_head, req_body,
-                                    res_status, res_head, res_body)
+                for nxt in itertools.islice(todo, 1):
+                    pending.append((nxt, pool.apply_async(_burp_chunk, (nxt,))))
+
+                for item in items:
+                    yield item
+                self.offset = args[2]
 
 
 class IEReader(LovetzReader):
@@ -847,6 +3301,8 @@ class IEReader(LovetzReader):
             try:
                 self.filename = filename
                 self.tree = parse(self.filename)
+                self.size = source_size(self.filename)
+                self.count = len(self.tree.findall("./entries/entry"))
             except:
                 self.tree = None
                 self.filename = None
@@ -877,7 +3333,7 @@ class IEReader(LovetzReader):
         url = req_element.find("./url").text
         ver = req_element.find("./httpVersion").text
 
-        status = "{0} {1} {2}".format(method, url, ver)
+        status = LovetzRequestLine(method, url, ver)
 
         headers = self._headers(req_element.find("./headers"))
 
@@ -898,29 +3354,32 @@ class IEReader(LovetzReader):
         message = res_element.find("./statusText").text
         ver = res_element.find("./httpVersion").text
 
-        status = "{0} {1} {2}".format(numstat, message, ver)
+        status = LovetzResponseLine(ver, numstat, message)
 
         headers = self._headers(res_element.find("./headers"))
 
         body_size = res_element.find("./bodySize").text
 
         body_content = None
+        content_type = mime_type(res_element.findtext("./content/mimeType"))
 
         if int(body_size) != 0:
             body = res_element.find("./content/text")
 
             if body is not None:
-                body_content = res_element.find("./content/text").text
+                body_content = body.text or ""
+                content_class = classify_content(content_type, body_content)
             else:
-                # this must mean there's some other type of node...
-                # TODO: check this out
-                # NOTE: ah, seems to be regarding Binary content... look into
-                # this further
+                # IE leaves the text node out entirely for binary
+                # content (images & the like), so say as much rather
+                # than pretending the body was empty.
                 body_content = ""
+                content_class = CONTENT_BINARY
         else:
             body_content = ""
+            content_class = CONTENT_EMPTY
 
-        return (status, headers, body_content)
+        return (status, headers, body_content, content_type, content_class)
 
     def iteritem(self):
 
@@ -928,12 +3387,959 @@ class IEReader(LovetzReader):
             raise Exception("no file has been previously loaded")
 
         for item in self.tree.iterfind("./entries/entry"):
-            req = self._request(item.find("./request"))
-            res = self._response(item.find("./response"))
+            self.done += 1
+            yield self.decode(item)
+
+    def iterraw(self):
+
+        if self.tree is None:
+            raise Exception("no file has been previously loaded")
+
+        for item in self.tree.iterfind("./entries/entry"):
+            self.done += 1
+            yield (item.findtext("./request/url"),
+                   item.findtext("./response/content/mimeType"),
+                   item)
+
+    def decode(self, item):
+        req = self._request(item.find("./request"))
+        res = self._response(item.find("./response"))
+
+        # named tuple might be nicer here, just for legibility...
+        return LovetzHistoryItem(req[0], req[1], req[2], req[3],
+                                 res[0], res[1], res[2],
+                                 content_type=res[3],
+                                 content_class=res[4],
+                                 source=self.filename)
+
+
+class LovetzTemplater(object):
+    """ Learns URL templates from the stream of URLs as they go by.
+        Path segments that look like identifiers (see SEGMENT_RES)
+        become placeholders straight away; any other position that
+        shows more than max_values distinct values under the same
+        prefix becomes {var} from then on. Query values are always
+        placeholders. Templates include the method, so GET & POST to
+        the same path are kept apart.
+    """
+
+    def __init__(self, max_values=20):
+        self.max_values = max_values
+        # (origin, prefix template) -> values seen after it, or None
+        # once the position has been decided to be a variable
+        self.positions = {}
+        self.hits = {}
+
+    def template(self, method, url):
+        parts = urllib.parse.urlsplit(url)
+        origin = "{0}://{1}".format(parts.scheme.lower(), parts.netloc.lower())
+        out = []
+
+        for seg in (parts.path or "/").split("/"):
+            tmpl = segment_template(seg)
+
+            if tmpl == seg and seg:
+                key = (origin, "/".join(out))
+                values = self.positions.get(key, ())
+
+                if values is None:
+                    tmpl = "{var}"
+                elif seg not in values:
+                    if len(values) >= self.max_values:
+                        self.positions[key] = None
+                        tmpl = "{var}"
+                    else:
+                        if not values:
+                            values = self.positions[key] = set()
+                        values.add(seg)
+
+            out.append(tmpl)
+
+        res = "{0} {1}{2}".format(method, origin, "/".join(out))
+
+        if parts.query:
+            names = sorted(set(k for k, _ in
+                               urllib.parse.parse_qsl(parts.query,
+                                                      keep_blank_values=True)))
+            res += "?" + "&".join("{0}={{}}".format(n) for n in names)
+
+        return res
+
+    def hit(self, template):
+        """ Count a request against template; returns the count so far.
+        """
+
+        count = self.hits.get(template, 0) + 1
+        self.hits[template] = count
+        return count
+
+
+class LovetzPrioritizer(object):
+    """ Cheap ingest-time scoring for deadline scans (higher goes
+        first): HTML, authentication endpoints, state-changing requests
+        and origins or path templates not seen before are worth more;
+        static assets and 304s are worth less. Each item is also put in
+        a category, for reporting what was & wasn't covered.
+    """
+
+    auth_re = re.compile(r"log_?[io]n|sign_?[io]n|auth|oauth|sso|saml|"
+                         r"session|passw|register|signup|account|token",
+                         re.I)
+
+    static_re = re.compile(r"\.(css|js|mjs|map|png|jpe?g|gif|svg|ico|webp|"
+                           r"bmp|woff2?|ttf|otf|eot|mp[34]|webm|ogg|wav|"
+                           r"avi|mov|pdf|zip|gz)$", re.I)
+
+    def __init__(self):
+        self.origins = set()
+        self.templates = set()
+
+    def score(self, item):
+        """ (score, category) for an item. """
+
+        parts = urllib.parse.urlsplit(item.url)
+        code = getattr(item.response_status, 'code', 0)
+        method = getattr(item.request_status, 'method', '')
+        score = 0
+
+        if code == 304:
+            category = "not-modified"
+            score -= 50
+        elif self.static_re.search(parts.path) or \
+                item.content_class == CONTENT_BINARY:
+            category = "static"
+            score -= 30
+        elif self.auth_re.search(parts.path) or \
+                "www-authenticate" in item.response_headers:
+            category = "auth"
+            score += 40
+        elif item.content_type in HTML_TYPES:
+            category = "html"
+            score += 30
+        else:
+            category = "other"
+
+        if item.content_type in HTML_TYPES:
+            score += 20
+
+        if method in ("POST", "PUT", "PATCH", "DELETE"):
+            score += 20
+
+        if "set-cookie" in item.response_headers:
+            score += 10
+
+        origin = url_origin(item.url)
+        if origin not in self.origins:
+            self.origins.add(origin)
+            score += 30
+
+        template = url_template(item.url)
+        if template not in self.templates:
+            self.templates.add(template)
+            score += 20
+
+        return score, category
+
+
+class LovetzEngine(object):
+    """ Drives history items from a reader through a set of plugins.
+
+        skip_status is a list of status codes ("304") or status
+        classes ("5xx") whose responses are dropped before any
+        plugin sees them.
+
+        body_budget is the LovetzBodyBudget applied to response bodies
+        for any plugin that doesn't define its own.
+
+        With dedupe, a transaction whose fingerprint has already been
+        seen (from this or another history file) isn't checked again;
+        instead its source is added to the first one's findings.
+
+        With a templater (a LovetzTemplater), only the first exemplars
+        requests for each URL template are checked, and findings are
+        reported once per template, with its request count.
+    """
+
+    def __init__(self, plugins, skip_status=None, body_budget=None,
+                 dedupe=False, templater=None, exemplars=3):
+        self.plugins = plugins
+        # plugins that want to see every item (see LovetzPlugin.observe)
+        self.observers = [p for p in plugins
+                          if type(p).observe is not LovetzPlugin.observe]
+        self.skip_codes = set()
+        self.skip_classes = set()
+        self.skipped = 0
+        self.body_budget = body_budget
+        self.windowed = 0
+        self.dedupe = dedupe
+        self.seen = {}
+        self.duplicates = 0
+        self.templater = templater
+        self.exemplars = exemplars
+        self.templated = 0
+        self.undecodable = 0
+        self.reported = set()
+
+        for status in skip_status or []:
+            status = status.strip().lower()
+            if status.endswith("xx"):
+                self.skip_classes.add(int(status[0]))
+            else:
+                self.skip_codes.add(int(status))
+
+    def wanted(self, item):
+        code = item.response_status.code
+        if code in self.skip_codes or code // 100 in self.skip_classes:
+            return False
+        return True
+
+    def _window(self, item, budget, body_type, windows):
+        """ item's response body cut down to budget, in the form
+            body_type asks for. windows caches both the cut and the
+            conversion for the item, so each is done once however
+            many plugins want it.
+        """
+
+        key = budget.key() if budget is not None else None
+
+        if key not in windows:
+            if budget is not None and budget.skip_above is not None and \
+               (item.body_size or 0) > budget.skip_above:
+                # no need to decode a body we're only going to drop
+                windows[key] = b""
+                self.windowed += 1
+            elif budget is not None:
+                body = item.response_body
+                windows[key] = budget.apply(body)
+                if len(windows[key]) != len(body):
+                    self.windowed += 1
+            else:
+                windows[key] = item.response_body
+
+        if (key, body_type) not in windows:
+            if body_type == BODY_TEXT:
+                windows[(key, body_type)] = decode_body(windows[key],
+                                                        item.charset)
+            else:
+                windows[(key, body_type)] = body_bytes(windows[key])
+
+        return windows[(key, body_type)]
+
+    def _body_for(self, plugin, item, windows):
+        # there's no text to decode in a binary body
+        body_type = plugin.body_type
+        if item.content_class == CONTENT_BINARY:
+            body_type = BODY_BYTES
+
+        return self._window(item, plugin.body_budget or self.body_budget,
+                            body_type, windows)
+
+    def html(self, item, windows):
+        """ The item's shared LovetzHTMLDocument, made on first request
+            (it tokenizes lazily too); None for non-HTML responses. It
+            covers the body as cut down by the engine's own budget.
+        """
+
+        if item.html is None and item.content_class == CONTENT_TEXT and \
+           item.content_type in HTML_TYPES:
+            item.html = LovetzHTMLDocument(self._window(item,
+                                                        self.body_budget,
+                                                        BODY_TEXT,
+                                                        windows))
+
+        return item.html
+
+    def duplicate(self, item):
+        fp = item.fingerprint()
+        sources = self.seen.get(fp)
+
+        if sources is None:
+            self.seen[fp] = [item.source]
+            return fp
+
+        if item.source not in sources:
+            sources.append(item.source)
+
+        self.duplicates += 1
+        return None
+
+    def process(self, item):
+        for plugin in self.observers:
+            plugin.observe(item)
+        return self._process(item)
+
+    def _process(self, item):
+        if not self.wanted(item):
+            self.skipped += 1
+            return False
+
+        fp = None
+        template = None
+
+        if self.dedupe:
+            fp = self.duplicate(item)
+            if fp is None:
+                return False
+
+        if self.templater is not None:
+            template = self.templater.template(
+                getattr(item.request_status, 'method', ''), item.url)
+            if self.templater.hit(template) > self.exemplars:
+                self.templated += 1
+                return False
+
+        # response_body is filled in per plugin below; reading it
+        # here would decode a body no plugin may want.
+        args = {key: item[key] for key in item.keys()
+                if key != 'response_body'}
+        binary = item.content_class == CONTENT_BINARY
+        empty = item.content_class == CONTENT_EMPTY
+        windows = {}
+
+        for plugin in self.plugins:
+            if plugin.body_type is None or empty or \
+               (binary and not plugin.binary_bodies):
+                args['response_body'] = b"" if plugin.body_type == BODY_BYTES else ""
+            else:
+                args['response_body'] = self._body_for(plugin, item, windows)
+            plugin.fingerprint = fp
+            plugin.template = template
+            if plugin.html_aware:
+                plugin.check(html=self.html(item, windows), **args)
+            else:
+                plugin.check(**args)
+            plugin.fingerprint = None
+            plugin.template = None
+
+        if item.undecodable:
+            self.undecodable += 1
+
+        return True
+
+    def finish(self):
+        for plugin in self.plugins:
+            plugin.finish()
+
+    def reset(self):
+        for plugin in self.plugins:
+            plugin.reset()
+        self.seen = {}
+        self.reported = set()
+        self.skipped = self.windowed = self.duplicates = self.templated = 0
+        self.undecodable = 0
+        if self.templater is not None:
+            self.templater = LovetzTemplater(self.templater.max_values)
+
+    def run(self, items):
+        for item in items:
+            self.process(item)
+        self.finish()
+
+    def run_prioritized(self, items, deadline, window=10000):
+        """ Scan items best-first (see LovetzPrioritizer) until deadline
+            seconds have gone by. Items are read into a heap of at most
+            window items (0 for no limit), the best being scanned
+            whenever it fills up, so memory stays bounded & scanning
+            starts straight away. Reading stops once half the time is
+            gone, leaving the rest for draining the heap. Returns a
+            report of what was covered and what was skipped, by
+            category.
+        """
+
+        start = time.monotonic()
+        stop = start + deadline
+        stop_reading = start + deadline / 2.0
+        prioritizer = LovetzPrioritizer()
+        heap = []
+        report = dict(scanned={}, skipped={}, read=0, exhausted=True)
+        seq = 0
+
+        def scan_best():
+            _, _, category, item = heapq.heappop(heap)
+            self._process(item)
+            report["scanned"][category] = report["scanned"].get(category, 0) + 1
+
+        for item in items:
+            if time.monotonic() >= stop_reading:
+                report["exhausted"] = False
+                break
+
+            for plugin in self.observers:
+                plugin.observe(item)
+
+            score, category = prioritizer.score(item)
+            report["read"] += 1
+            seq += 1
+            heapq.heappush(heap, (-score, seq, category, item))
+
+            if window and len(heap) > window:
+                scan_best()
+
+        while heap and time.monotonic() < stop:
+            scan_best()
+
+        for _, _, category, _ in heap:
+            report["skipped"][category] = report["skipped"].get(category, 0) + 1
+
+        self.finish()
+        return report
+
+    def events(self, collate=False):
+        """ Every plugin's events, streamed rather than gathered into
+            one list; with collate, grouped by source & then by
+            severity (most severe first).
+        """
+
+        if not collate:
+            events = itertools.chain.from_iterable(p.events
+                                                   for p in self.plugins)
+        else:
+            key = lambda e: (e["source"], -e["event"])
+            events = heapq.merge(*[p.events.sorted(key)
+                                   for p in self.plugins],
+                                 key=key)
+
+        return self.annotate(events)
+
+    def annotate(self, events):
+        """ Fill in what's only known once the scan is over: the sources
+            a de-duplicated transaction was seen in, and the request
+            count of a template (dropping repeats of a finding that
+            several of its exemplars produced).
+        """
+
+        if not self.dedupe and self.templater is None:
+            return events
+        return self._annotate(events)
+
+    def _annotate(self, events):
+        for event in events:
+            fp = event.pop("fingerprint", None)
+            if fp is not None:
+                event["sources"] = self.seen.get(bytes.fromhex(fp), [])
+
+            template = event.get("template")
+            if template is not None:
+                key = hashlib.blake2b("{0}\0{1}\0{2}\0{3}".format(
+                    event["source"], event["event"],
+                    message_template(event["message"]),
+                    template).encode("utf8"), digest_size=16).digest()
+                if key in self.reported:
+                    continue
+                self.reported.add(key)
+                event["template_hits"] = self.templater.hits.get(template, 0)
+
+            yield event
+
+
+class NDJSONReader(LovetzReader):
+    """ Reads newline-delimited JSON history items (in the format of
+        LovetzHistoryItem.from_dict) from a file, named pipe or stdin
+        ("-"), yielding each one as soon as its line arrives. A line
+        of {"end": true} stops the reader early; lines that can't be
+        parsed are counted in errors and skipped. A file it opens is
+        closed once it's been read (or by close).
+    """
+
+    def load(self, filename=None, stream=None):
+        self.errors = 0
+        self.offset = 0
+        self.size = source_size(filename if filename != "-" else None)
+        self.fh = None
+
+        if stream is not None:
+            self.filename = None
+            self.stream = stream
+        elif filename == "-" or filename is None:
+            self.filename = "-"
+            self.stream = iter(sys.stdin.readline, "")
+        else:
+            self.filename = filename
+            self.fh = open(self.filename, 'r')
+            self.stream = iter(self.fh.readline, "")
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def iterraw(self):
+
+        if self.stream is None:
+            raise Exception("no file has been previously loaded")
+
+        try:
+            for line in self.stream:
+                # characters rather than bytes, but near enough
+                self.offset += len(line)
+                line = line.strip()
+
+                if not line:
+                    continue
+
+                try:
+                    val = json.loads(line)
+                    if val.get('end'):
+                        break
+                    url = val['url']
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self.errors += 1
+                    continue
+
+                ctype = None
+                headers = val.get('response_headers') or {}
+                if isinstance(headers, dict):
+                    headers = headers.items()
+                for name, value in headers:
+                    if name.lower() == 'content-type':
+                        ctype = value
+
+                yield (url, ctype, val)
+        finally:
+            self.close()
+
+    def position(self):
+        return self.offset
+
+    def decode(self, val):
+        try:
+            item = LovetzHistoryItem.from_dict(val)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.errors += 1
+            return None
+
+        if self.dom and self.dom.search(item.url) is None:
+            return None
+
+        if item.source is None:
+            item.source = self.filename
+
+        return item
+
+    def iteritem(self):
+
+        for _, _, val in self.iterraw():
+            item = self.decode(val)
+            if item is not None:
+                yield item
+
+
+# history file types, as given to -T
+READERS = {"burp": lambda: BurpProxyReader(),
+           "ie": lambda: IEReader(),
+           "har": lambda: HARReader(),
+           "ndjson": lambda: NDJSONReader()}
+
+
+class LovetzSampler(object):
+    """ Stratified sample of one or more histories: a reservoir of size
+        items per (origin, content type), so every origin with any
+        traffic is represented. Works on readers' raw entries, so the
+        items that aren't picked are never decoded; those that are come
+        out in their original order.
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.random = random.Random(seed)
+        self.strata = {}    # (origin, type) -> [seen, reservoir]
+        self.seen = 0
 
-            # named tuple might be nicer here, just for legibility...
-            yield LovetzHistoryItem(req[0], req[1], req[2], req[3],
-                                    res[0], res[1], res[2])
+    def _offer(self, stratum, entry):
+        if stratum not in self.strata:
+            self.strata[stratum] = [0, []]
+
+        tmp = self.strata[stratum]
+        tmp[0] += 1
+
+        if len(tmp[1]) < self.size:
+            tmp[1].append(entry)
+        else:
+            idx = self.random.randrange(tmp[0])
+            if idx < self.size:
+                tmp[1][idx] = entry
+
+    def sample(self, readers):
+        for reader in readers:
+            for url, ctype, raw in reader.iterraw():
+                self.seen += 1
+                stratum = (url_origin(url or ""), mime_type(ctype) or "unknown")
+                self._offer(stratum, (self.seen, reader, raw))
+
+        chosen = sorted((entry for _, res in self.strata.values()
+                         for entry in res), key=lambda e: e[0])
+
+        for _, reader, raw in chosen:
+            item = reader.decode(raw)
+            if item is not None:
+                yield item
+
+    def report(self):
+        """ Items seen & sampled in all, and per origin. """
+
+        origins = {}
+        for (origin, _), (seen, res) in self.strata.items():
+            tmp = origins.setdefault(origin, [0, 0])
+            tmp[0] += seen
+            tmp[1] += len(res)
+
+        sampled = sum(len(res) for _, res in self.strata.values())
+        return dict(seen=self.seen, sampled=sampled,
+                    strata=len(self.strata), origins=origins)
+
+
+def load_sources(sources, jobs=1, loaded=None):
+    """ A loaded reader for each (type, filename) history in turn; each
+        file is only loaded once the previous one is done with. Burp
+        exports are parsed by jobs worker processes when jobs > 1.
+        Readers are also appended to loaded, if given, so that their
+        error counts can be reported afterwards.
+    """
+
+    for ftype, fname in sources:
+        if ftype == "burp" and jobs > 1:
+            reader = ParallelBurpReader(jobs=jobs)
+        else:
+            reader = READERS[ftype]()
+        reader.load(fname)
+        if loaded is not None:
+            loaded.append(reader)
+        yield reader
+
+
+class LovetzProgress(object):
+    """ Progress line on stderr: items per second, how much of the
+        input has been read, findings so far, elapsed time & an ETA.
+        Redrawn every interval seconds at most; between redraws the
+        per-item cost is a counter & (every 64 items) a clock read.
+    """
+
+    def __init__(self, sources, plugins, stream=None, interval=0.25):
+        self.total = sum(source_size(fname) for _, fname in sources
+                         if fname != "-")
+        self.plugins = plugins
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.items = 0
+        self.finished = 0   # bytes in sources that are done with
+        self.reader = None
+        self.start = time.monotonic()
+        self.next = self.start + interval
+
+    def readers(self, readers):
+        for reader in readers:
+            self.reader = reader
+            yield reader
+            self.finished += reader.size or reader.position()
+            self.reader = None
+
+    def track(self, items):
+        for item in items:
+            yield item
+            self.items += 1
+            if self.items & 63 == 0 and time.monotonic() >= self.next:
+                self.report()
+
+    def position(self):
+        if self.reader is None:
+            return self.finished
+        return self.finished + self.reader.position()
+
+    @staticmethod
+    def clock(seconds):
+        seconds = int(seconds)
+        return "{0}:{1:02}:{2:02}".format(seconds // 3600,
+                                         seconds // 60 % 60,
+                                         seconds % 60)
+
+    def report(self, final=False):
+        now = time.monotonic()
+        self.next = now + self.interval
+        elapsed = max(now - self.start, 1e-6)
+        read = self.position()
+
+        line = "[~] {0} items ({1:.0f}/s), {2:.1f}".format(self.items,
+                                                        self.items / elapsed,
+                                                        read / 1048576.0)
+        if self.total:
+            line += " of {0:.1f} MiB ({1:.0%})".format(self.total / 1048576.0,
+                                                       min(read / float(self.total), 1.0))
+        else:
+            line += " MiB"
+
+        line += ", {0} findings, {1} elapsed".format(
+            sum(len(p.events) for p in self.plugins),
+            self.clock(elapsed))
+
+        if not final and self.total and 0 < read < self.total:
+            line += ", ETA {0}".format(self.clock(elapsed * (self.total - read) / read))
+
+        self.stream.write("\r" + line.ljust(79) + ("\n" if final else ""))
+        self.stream.flush()
+
+
+def iter_sources(sources, jobs=1, progress=None, loaded=None):
+    """ Items from each (type, filename) history in turn. """
+
+    readers = load_sources(sources, jobs=jobs, loaded=loaded)
+
+    if progress is not None:
+        readers = progress.readers(readers)
+
+    for reader in readers:
+        for item in reader.iteritem():
+            yield item
+
+
+class LovetzService(object):
+    """ Keeps an engine, and so its plugins, warm between scans.
+
+        Clients connect to a Unix socket (or a localhost TCP port) and
+        speak newline-delimited JSON. The first line is a request:
+
+        {"type": "burp", "file": "/path/to/history.xml"}
+        {"items": [{...}, {...}]}
+        {"stream": true}
+
+        where items are in LovetzHistoryItem.from_dict's format; a
+        stream request is followed by one item per line, until EOF or
+        {"end": true}. Findings are written back one per line as they
+        are produced, followed by a {"done": true, ...} summary.
+
+        Anyone on the machine who can reach the socket or port can
+        send requests, so file requests are refused unless file_root
+        is given, and then only for files under it. The Unix socket
+        is only accessible to its owner.
+    """
+
+    def __init__(self, engine, file_root=None):
+        self.engine = engine
+        self.file_root = None
+        if file_root is not None:
+            self.file_root = os.path.realpath(file_root)
+
+    def allowed(self, filename):
+        if self.file_root is None:
+            return False
+        path = os.path.realpath(filename)
+        return os.path.commonpath([path, self.file_root]) == self.file_root
+
+    def _flush(self, write):
+        count = 0
+        for plugin in self.engine.plugins:
+            for event in self.engine.annotate(plugin.events):
+                write(event)
+                count += 1
+            plugin.events.clear()
+        return count
+
+    def _items(self, request, lines):
+        if 'file' in request:
+            if request.get('type') not in READERS:
+                raise ValueError("type must be one of: burp, ie, har, ndjson")
+            if not self.allowed(request['file']):
+                raise ValueError("file requests are only allowed under --serve-root")
+            reader = READERS[request['type']]()
+            reader.load(request['file'])
+            return reader.iteritem()
+        elif 'items' in request:
+            return (LovetzHistoryItem.from_dict(i) for i in request['items'])
+        elif request.get('stream'):
+            reader = NDJSONReader()
+            reader.load(stream=lines)
+            return reader.iteritem()
+        raise ValueError("request needs a file, items or stream")
+
+    def handle(self, request, lines, write):
+        self.engine.reset()
+
+        processed = skipped = findings = 0
+
+        try:
+            for item in self._items(request, lines):
+                if self.engine.process(item):
+                    processed += 1
+                else:
+                    skipped += 1
+                findings += self._flush(write)
+
+            self.engine.finish()
+            findings += self._flush(write)
+        except Exception as e:
+            write(dict(error=str(e)))
+
+        write(dict(done=True, items=processed, skipped=skipped,
+                   findings=findings))
+
+    def serve(self, path=None, port=None):
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                lines = (str(l, encoding="utf8") for l in self.rfile)
+
+                def write(val):
+                    self.wfile.write(json.dumps(val).encode("utf8") + b"\n")
+                    self.wfile.flush()
+
+                for line in lines:
+                    if line.strip():
+                        try:
+                            request = json.loads(line)
+                        except ValueError as e:
+                            write(dict(error=str(e)))
+                            continue
+                        service.handle(request, lines, write)
+
+        if path is not None:
+            if os.path.exists(path):
+                if not stat.S_ISSOCK(os.stat(path).st_mode):
+                    raise ValueError("{0} exists and isn't a socket".format(path))
+                os.unlink(path)
+            # owner only, from the moment the socket exists
+            umask = os.umask(0o177)
+            try:
+                server = socketserver.UnixStreamServer(path, Handler)
+            finally:
+                os.umask(umask)
+            os.chmod(path, 0o600)
+        else:
+            class Server(socketserver.TCPServer):
+                allow_reuse_address = True
+
+            server = Server(("127.0.0.1", port), Handler)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+
+
+# parts of a finding's message that change from run to run without
+# the finding itself changing: cookie & parameter values, hashes,
+# tokens, numbers.
+MESSAGE_VALUE_RES = [(re.compile(r"=[^;,\s]+"), "=*"),
+                     (re.compile(r"[0-9a-f]{8,}|[A-Za-z0-9+/_-]{24,}={0,2}",
+                                 re.I), "*"),
+                     (re.compile(r"\d+"), "#")]
+
+
+# the same messages & URLs come up over and over in a run, so both
+# normalizations are cached.
+
+@functools.lru_cache(maxsize=65536)
+def message_template(message):
+    for regex, placeholder in MESSAGE_VALUE_RES:
+        message = regex.sub(placeholder, message)
+    return message
+
+
+@functools.lru_cache(maxsize=65536)
+def url_template(url):
+    """ Origin & path template of a URL, without the query. """
+
+    parts = urllib.parse.urlsplit(url)
+    return "{0}://{1}{2}".format(parts.scheme.lower(),
+                                 parts.netloc.lower(),
+                                 path_template(parts.path))
+
+
+def finding_key(event):
+    """ Stable identity of a finding across runs: the plugin, the
+        message template, and the origin & path template of its URL.
+        Returns (digest, description).
+    """
+
+    desc = "({0}) {1} at {2}".format(event.get("source"),
+                                     message_template(event.get("message") or ""),
+                                     url_template(event.get("url") or ""))
+    return hashlib.blake2b(desc.encode("utf8"), digest_size=16).digest(), desc
+
+
+def iter_events(filename):
+    """ Stream the events back out of a dump_logs JSON file, without
+        loading the whole thing; files of one event per line (such as
+        LovetzService output) work too.
+    """
+
+    decoder = json.JSONDecoder()
+
+    with open(filename, 'r') as fh:
+        buf = fh.read(65536)
+        idx = len(buf) - len(buf.lstrip())
+
+        if buf.startswith('{"events"', idx):
+            idx = buf.index("[", idx) + 1
+        else:
+            idx = 0
+
+        eof = False
+
+        while True:
+            while idx < len(buf) and buf[idx] in " \t\r\n,":
+                idx += 1
+
+            if idx < len(buf) and buf[idx] in "]}":
+                return
+
+            try:
+                if idx >= len(buf):
+                    raise ValueError("need more")
+                event, end = decoder.raw_decode(buf, idx)
+            except ValueError:
+                if eof:
+                    if buf[idx:].strip():
+                        raise
+                    return
+                chunk = fh.read(65536)
+                eof = not chunk
+                buf = buf[idx:] + chunk
+                idx = 0
+                continue
+
+            idx = end
+            if "done" in event or "error" in event:
+                continue
+            yield event
+
+
+def diff_logs(old, new):
+    """ Compare two runs' events by finding_key: old is indexed, new is
+        streamed against it. Yields (status, description, old count,
+        new count) with status one of "new", "fixed" or "unchanged".
+    """
+
+    index = {}
+    for event in old:
+        digest, desc = finding_key(event)
+        if digest in index:
+            index[digest][0] += 1
+        else:
+            index[digest] = [1, 0, desc]
+
+    added = {}
+    for event in new:
+        digest, desc = finding_key(event)
+        if digest in index:
+            index[digest][1] += 1
+        elif digest in added:
+            added[digest][0] += 1
+        else:
+            added[digest] = [1, desc]
+
+    for count, desc in added.values():
+        yield ("new", desc, 0, count)
+
+    for old_count, new_count, desc in index.values():
+        if new_count:
+            yield ("unchanged", desc, old_count, new_count)
+        else:
+            yield ("fixed", desc, old_count, 0)
 
 
 def dump_logs(events, style=LOG_RAW, location=None, collate=False):
@@ -954,6 +4360,12 @@ def dump_logs(events, style=LOG_RAW, location=None, collate=False):
                 line = "{0} {1} for {2}".format(outputs[event["event"]],
                                                 event["message"],
                                                 event["url"])
+                if event.get("template"):
+                    line += " (template {0}: {1} requests)".format(
+                        event["template"], event.get("template_hits", 0))
+                if event.get("sources"):
+                    line += " [{0}]".format(", ".join(str(s) for s in
+                                                      event["sources"]))
                 if location is None:
                     print(line)
                 else:
@@ -963,21 +4375,67 @@ def dump_logs(events, style=LOG_RAW, location=None, collate=False):
             for event in events:
                 writer.writerow(event)
         elif style is LOG_JSON:
-            output = json.dumps({'events': events})
+            # written out piecemeal, so events can be streamed in
+            # (say, from spilled LovetzEventStores) rather than listed
+            fh.write('{"events": [')
+            for idx, event in enumerate(events):
+                if idx:
+                    fh.write(", ")
+                fh.write(json.dumps(event))
+            fh.write(']}')
             if location is None:
-                print(output)
-            else:
-                fh.write(output)
+                fh.write("\n")
     finally:
         if location is not None:
             fh.close()
 
 def validate_type(s):
-    if s in ["burp", "har", "ie"]:
+    if s in READERS:
         return s
     else:
         raise argparse.ArgumentTypeError("Invalid input type")
 
+def validate_status(s):
+    statuses = [v.strip() for v in s.split(",") if v.strip()]
+    for status in statuses:
+        if re.match(r"^([1-5][0-9][0-9]|[1-5]xx)$", status, re.I) is None:
+            raise argparse.ArgumentTypeError("Invalid status: {0}".format(status))
+    return statuses
+
+def validate_size(s):
+    units = {"k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+    s = s.strip().lower()
+    mult = 1
+
+    if s and s[-1] in units:
+        mult = units[s[-1]]
+        s = s[:-1]
+
+    try:
+        val = int(s) * mult
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid size")
+
+    if val < 0:
+        raise argparse.ArgumentTypeError("Invalid size")
+    return val
+
+def validate_list(s):
+    return [v.strip() for v in s.split(",") if v.strip()]
+
+def validate_severity(s):
+    """ "warn", or "header=warn,cors=info" &c.; returns {name: level}
+        with None for the default.
+    """
+
+    res = {}
+    for v in validate_list(s):
+        name, _, level = v.rpartition("=")
+        if level.lower() not in RULE_SEVERITIES:
+            raise argparse.ArgumentTypeError("Invalid severity {0}".format(level))
+        res[name or None] = RULE_SEVERITIES[level.lower()]
+    return res
+
 def validate_output(s):
     if s == "csv":
         return LOG_CSV
@@ -1002,11 +4460,13 @@ including Burp's history file format, and InternetExplorer's NetworkData."""
 
     argp.add_argument('-T', "--file-type",
                       dest='filetype',
-                      help="the type of history file to load (burp|ie|har)",
+                      help="the type of history file to load (burp|ie|har|ndjson)",
                       type=validate_type)
     argp.add_argument('-F', "--file-name",
-                      dest='filename',
-                      help="the name of the history file",
+                      dest='filenames',
+                      default=[],
+                      action="append",
+                      help="the name of the history file (\"-\" for stdin with ndjson); may be repeated, optionally as type:filename",
                       type=str)
     argp.add_argument('-o', "--output-type",
                       dest='outputtype',
@@ -1022,6 +4482,19 @@ including Burp's history file format, and InternetExplorer's NetworkData."""
                       const=True,
                       action="store_const",
                       help="enable dumping JavaScript files from history")
+    argp.add_argument("--js-analyzer",
+                      dest='jsanalyzer',
+                      default=None,
+                      help="run this command over each distinct script ({file} is its path)")
+    argp.add_argument("--js-cache",
+                      dest='jscache',
+                      default=None,
+                      help="where analyzed scripts & results are cached (default ~/.cache/lovetz/js)")
+    argp.add_argument("--js-jobs",
+                      dest='jsjobs',
+                      default=None,
+                      help="how many analyzer processes to run at once",
+                      type=int)
     argp.add_argument('-v', "--verbose",
                       dest='verbose',
                       default=False,
@@ -1034,48 +4507,400 @@ including Burp's history file format, and InternetExplorer's NetworkData."""
                       const=True,
                       action="store_const",
                       help="enable output collation by type and source")
+    argp.add_argument('-S', "--skip-status",
+                      dest='skipstatus',
+                      default=None,
+                      help="comma-separated status codes or classes to skip (e.g. 304,5xx)",
+                      type=validate_status)
+    argp.add_argument("--body-max",
+                      dest='bodymax',
+                      default=BODY_MAX,
+                      help="max bytes of a response body scanned by plugins (e.g. 512k, 0 for no limit)",
+                      type=validate_size)
+    argp.add_argument("--body-head",
+                      dest='bodyhead',
+                      default=None,
+                      help="bytes kept from the start of an over-sized body",
+                      type=validate_size)
+    argp.add_argument("--body-tail",
+                      dest='bodytail',
+                      default=None,
+                      help="bytes kept from the end of an over-sized body",
+                      type=validate_size)
+    argp.add_argument("--body-skip-above",
+                      dest='bodyskip',
+                      default=None,
+                      help="don't scan response bodies larger than this at all",
+                      type=validate_size)
+
+    argp.add_argument("--by-origin",
+                      dest='byorigin',
+                      default=False,
+                      const=True,
+                      action="store_const",
+                      help="evaluate site-wide header policies once per origin")
+    argp.add_argument("--min-severity",
+                      dest='minseverity',
+                      default=None,
+                      help="only keep findings at least this severe: info, warn or error, optionally per plugin (header=warn,...)",
+                      type=validate_severity)
+    argp.add_argument("--suppress",
+                      dest='suppress',
+                      default=None,
+                      help="drop findings from these plugins, or plugin:text for messages containing text (comma-separated)",
+                      type=validate_list)
+    argp.add_argument("--header-rules",
+                      dest='headerrules',
+                      default=[],
+                      action="append",
+                      help="JSON file of extra header rules for the header plugins (repeatable)")
+    argp.add_argument('-P', "--plugins",
+                      dest='plugins',
+                      default=None,
+                      help="only run these plugins (comma-separated names or tags)",
+                      type=validate_list)
+    argp.add_argument("--coverage",
+                      dest='coverage',
+                      default=None,
+                      metavar="FILE",
+                      help="record a header-coverage matrix & write it to FILE as CSV (- for stdout)")
+    argp.add_argument("--inventory",
+                      dest='inventory',
+                      default=None,
+                      metavar="FILE",
+                      help="discover endpoints the history links to but never visited, & write them to FILE as JSON (- for stdout)")
+    argp.add_argument("--enable",
+                      dest='enable',
+                      default=None,
+                      help="also run these plugins (comma-separated names or tags)",
+                      type=validate_list)
+    argp.add_argument("--disable",
+                      dest='disable',
+                      default=None,
+                      help="don't run these plugins (comma-separated names or tags)",
+                      type=validate_list)
+    argp.add_argument("--plugin-dir",
+                      dest='plugindirs',
+                      default=[],
+                      action="append",
+                      help="load additional plugins from this directory")
+    argp.add_argument('-j', "--jobs",
+                      dest='jobs',
+                      default=1,
+                      help="worker processes for parsing Burp exports (0 for one per CPU)",
+                      type=int)
+    argp.add_argument('-D', "--dedupe",
+                      dest='dedupe',
+                      default=False,
+                      const=True,
+                      action="store_const",
+                      help="check identical transactions once (always on with several files)")
+    argp.add_argument("--templates",
+                      dest='templates',
+                      default=False,
+                      const=True,
+                      action="store_const",
+                      help="collapse URLs into templates, checking a few exemplars of each")
+    argp.add_argument("--exemplars",
+                      dest='exemplars',
+                      default=3,
+                      help="requests checked per URL template (with --templates)",
+                      type=int)
+    argp.add_argument("--template-values",
+                      dest='templatevalues',
+                      default=20,
+                      help="distinct values before a path segment becomes a variable",
+                      type=int)
+    argp.add_argument("--sample",
+                      dest='sample',
+                      default=None,
+                      help="only scan a random sample of this many items per origin & content type",
+                      type=int)
+    argp.add_argument("--seed",
+                      dest='seed',
+                      default=None,
+                      help="random seed for --sample",
+                      type=int)
+    argp.add_argument("--deadline",
+                      dest='deadline',
+                      default=None,
+                      help="scan the most valuable items first, stopping after this many seconds",
+                      type=float)
+    argp.add_argument("--priority-window",
+                      dest='prioritywindow',
+                      default=10000,
+                      help="items held for prioritizing in deadline mode (0 for all)",
+                      type=int)
+    argp.add_argument("--progress",
+                      dest='progress',
+                      default=False,
+                      const=True,
+                      action="store_const",
+                      help="show progress & throughput on stderr")
+    argp.add_argument("--memory-budget",
+                      dest='memorybudget',
+                      default=EVENT_MEMORY,
+                      help="memory for findings before they spill to disk (e.g. 64m)",
+                      type=validate_size)
+    argp.add_argument("--spill-dir",
+                      dest='spilldir',
+                      default=None,
+                      help="directory for spilled findings (default: system temp)",
+                      type=str)
+    argp.add_argument("--serve",
+                      dest='servepath',
+                      default=None,
+                      help="run as a scan service listening on this Unix socket",
+                      type=str)
+    argp.add_argument("--serve-port",
+                      dest='serveport',
+                      default=None,
+                      help="run as a scan service listening on this localhost port",
+                      type=int)
+    argp.add_argument("--serve-root",
+                      dest='serveroot',
+                      default=None,
+                      help="let service clients scan history files under this directory",
+                      type=str)
+    argp.add_argument("--diff",
+                      dest='diff',
+                      default=None,
+                      nargs=2,
+                      metavar=("OLD", "NEW"),
+                      help="compare two JSON result files: new, fixed & unchanged findings")
+    argp.add_argument("--list-plugins",
+                      dest='listplugins',
+                      default=False,
+                      const=True,
+                      action="store_const",
+                      help="list the available plugins and exit")
 
     args = argp.parse_args()
 
-    reader = None
+    if args.diff is not None:
+        outputs = {"new": "[+]", "fixed": "[-]", "unchanged": "[=]"}
+        counts = {"new": 0, "fixed": 0, "unchanged": 0}
+        fh = sys.stdout
+        if args.outputlocation not in (None, "-"):
+            fh = open(args.outputlocation, "w")
+
+        for status, desc, old_count, new_count in diff_logs(iter_events(args.diff[0]),
+                                                            iter_events(args.diff[1])):
+            counts[status] += 1
+            if args.outputtype is LOG_JSON:
+                fh.write(json.dumps(dict(status=status, finding=desc,
+                                         old=old_count, new=new_count)) + "\n")
+            elif status != "unchanged" or args.verbose:
+                fh.write("{0} {1} ({2} -> {3})\n".format(outputs[status], desc,
+                                                         old_count, new_count))
+
+        if args.outputtype is not LOG_JSON:
+            fh.write("{new} new, {fixed} fixed, {unchanged} unchanged\n".format(**counts))
+        if fh is not sys.stdout:
+            fh.close()
+        sys.exit(0)
 
-    if args.filetype == "burp":
-        reader = BurpProxyReader()
-    elif args.filetype == "ie":
-        reader = IEReader()
-    elif args.filetype == "har":
-        reader = HARReader()
-    else:
-        print("filetype must be one of: burp, ie, har")
-        sys.exit(1)
+    registry = default_registry(args.plugindirs)
 
-    if args.filename == "":
-        print("filename must be specified")
-        sys.exit(2)
+    if args.listplugins:
+        for entry in registry.entries.values():
+            print("{0}{1} ({2}) tags: {3}".format(entry.name,
+                                                  "" if entry.default else "*",
+                                                  entry.source,
+                                                  ", ".join(entry.tags)))
+        print("* not run unless enabled")
+        sys.exit(0)
+
+    enable = args.enable or []
+    disable = args.disable or []
 
-    reader.load(args.filename)
-    plugins = [CORSPlugin(verbose=args.verbose),
-               CookiePlugin(verbose=args.verbose),
-               HeaderPlugin(verbose=args.verbose),
-               ETagPlugin(verbose=args.verbose),
-               SensitiveDataPlugin(verbose=args.verbose),
-               FingerprintPlugin(verbose=args.verbose)]
+    if args.byorigin:
+        enable.append("origin")
+        disable.append("header")
+
+    if args.coverage is not None:
+        enable.append("coverage")
+
+    if args.inventory is not None:
+        enable.append("discovery")
 
     if args.jsdumping:
         print("[!] adding JS File Dumping")
-        plugins.append(JSDumpingPlugin())
+        enable.append("jsdump")
+
+    if args.jsanalyzer is not None:
+        JSAnalysisPlugin.command = args.jsanalyzer
+        if args.jscache is not None:
+            JSAnalysisPlugin.cache_dir = args.jscache
+        if args.jsjobs:
+            JSAnalysisPlugin.jobs = args.jsjobs
+        enable.append("jsanalyze")
+
+    try:
+        selected = registry.select(only=args.plugins,
+                                   enable=enable,
+                                   disable=disable)
+    except ValueError as e:
+        print(e)
+        sys.exit(3)
+
+    header_rules = []
+
+    try:
+        for fname in args.headerrules:
+            header_rules.extend(LovetzHeaderRule.load(fname))
+    except (IOError, ValueError, KeyError, TypeError, re.error) as e:
+        print("unable to load header rules: {0}".format(e))
+        sys.exit(3)
+
+    memory = LovetzMemoryBudget(args.memorybudget, spill_dir=args.spilldir)
+    plugins = registry.instantiate(selected,
+                                   verbose=args.verbose,
+                                   memory_budget=memory,
+                                   min_severity=args.minseverity or LOG_INFO,
+                                   suppress=args.suppress,
+                                   header_rules=header_rules)
+
+    budget = LovetzBodyBudget(max_bytes=args.bodymax or None,
+                              head=args.bodyhead,
+                              tail=args.bodytail,
+                              skip_above=args.bodyskip)
+    sources = []
+
+    for fname in args.filenames:
+        ftype = args.filetype
+        if ":" in fname and fname.split(":", 1)[0] in READERS:
+            ftype, fname = fname.split(":", 1)
+        sources.append((ftype, fname))
+
+    if not sources and args.filetype == "ndjson":
+        sources.append(("ndjson", "-"))
+
+    engine = LovetzEngine(plugins,
+                          skip_status=args.skipstatus,
+                          body_budget=budget,
+                          dedupe=args.dedupe or len(sources) > 1,
+                          templater=LovetzTemplater(args.templatevalues)
+                          if args.templates else None,
+                          exemplars=args.exemplars)
+
+    if args.servepath is not None or args.serveport is not None:
+        try:
+            LovetzService(engine,
+                          file_root=args.serveroot).serve(path=args.servepath,
+                                                          port=args.serveport)
+        except ValueError as e:
+            print(e)
+            sys.exit(3)
+        sys.exit(0)
+
+    if not sources:
+        print("filename must be specified")
+        sys.exit(2)
+
+    if any(ftype not in READERS for ftype, _ in sources):
+        print("filetype must be one of: burp, ie, har, ndjson")
+        sys.exit(1)
+
+    sampler = None
+    progress = None
+    loaded = []
+
+    if args.progress:
+        progress = LovetzProgress(sources, plugins)
+
+    if args.sample:
+        # sampling works on raw entries, which the parallel reader
+        # doesn't give out
+        sampler = LovetzSampler(args.sample, seed=args.seed)
+        readers = load_sources(sources, loaded=loaded)
+        if progress is not None:
+            readers = progress.readers(readers)
+        items = sampler.sample(readers)
+    else:
+        items = iter_sources(sources, jobs=args.jobs or os.cpu_count() or 1,
+                             progress=progress, loaded=loaded)
+
+    if progress is not None:
+        items = progress.track(items)
+
+    if args.deadline is not None:
+        report = engine.run_prioritized(items,
+                                        args.deadline,
+                                        window=args.prioritywindow)
+        if progress is not None:
+            progress.report(final=True)
+        scanned = sum(report["scanned"].values())
+        skipped = sum(report["skipped"].values())
+        msg = "[!] deadline: scanned {0} of {1} items read ({2} skipped){3}"
+        sys.stderr.write(msg.format(scanned, report["read"], skipped,
+                                    "" if report["exhausted"] else
+                                    "; input not fully read") + "\n")
+        for category in sorted(set(report["scanned"]) | set(report["skipped"])):
+            sys.stderr.write("    {0}: {1} scanned, {2} skipped\n".format(
+                category,
+                report["scanned"].get(category, 0),
+                report["skipped"].get(category, 0)))
+    else:
+        engine.run(items)
+        if progress is not None:
+            progress.report(final=True)
+
+    errors = sum(getattr(reader, "errors", 0) for reader in loaded)
+    if errors:
+        sys.stderr.write("[!] {0} NDJSON lines couldn't be read as history "
+                         "items and were skipped\n".format(errors))
+
+    dropped = [(engine.skipped, "skipped for their status (-S)"),
+               (engine.duplicates, "duplicates of items already checked"),
+               (engine.templated, "past --exemplars for their URL template")]
+    dropped = ["{0} {1}".format(count, what) for count, what in dropped if count]
+    if dropped:
+        sys.stderr.write("[!] items not checked: {0}\n".format("; ".join(dropped)))
+
+    if engine.windowed:
+        sys.stderr.write("[!] {0} response bodies were cut down to the body "
+                         "budget\n".format(engine.windowed))
+
+    if engine.undecodable:
+        sys.stderr.write("[!] {0} response bodies weren't valid base64 and were "
+                         "checked as empty\n".format(engine.undecodable))
+
+    if sampler is not None:
+        report = sampler.report()
+        msg = "[!] sampled {0} of {1} items ({2:.1%}) across {3} strata and {4} origins"
+        sys.stderr.write(msg.format(report["sampled"],
+                                    report["seen"],
+                                    report["sampled"] / float(report["seen"] or 1),
+                                    report["strata"],
+                                    len(report["origins"])) + "\n")
+        for origin, (seen, sampled) in sorted(report["origins"].items()):
+            sys.stderr.write("    {0}: {1} of {2}\n".format(origin, sampled, seen))
+
+    if args.coverage is not None:
+        for plugin in plugins:
+            if isinstance(plugin, CoveragePlugin):
+                if args.coverage == "-":
+                    plugin.matrix.export(sys.stdout)
+                else:
+                    with open(args.coverage, "w", newline="") as fh:
+                        plugin.matrix.export(fh)
 
-    for item in reader.iteritem():
+    if args.inventory is not None:
         for plugin in plugins:
-            plugin.check(**item)
+            if isinstance(plugin, DiscoveryPlugin):
+                if args.inventory == "-":
+                    json.dump(plugin.inventory(), sys.stdout, indent=2)
+                    sys.stdout.write("\n")
+                else:
+                    with open(args.inventory, "w") as fh:
+                        json.dump(plugin.inventory(), fh, indent=2)
 
     if args.outputlocation is not None:
         # we collect together all the events here
         # so that we can actually collate them and
         # what not
-        events = []
-        for plugin in plugins:
-            events.extend(plugin.events)
+        events = engine.events(collate=args.collate)
         dump_logs(events,
                   style=args.outputtype,
                   location=args.outputlocation,
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# test_server.py is a bottle app for generating history files, not a
+# test module.
+collect_ignore = ["test_server.py"]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,1243 @@
+import base64
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from xml.etree.ElementTree import fromstring
+
+import lovetz
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = lovetz.default_registry()
+
+    def test_defaults(self):
+        names = self.registry.select()
+        self.assertIn("header", names)
+        self.assertNotIn("jsdump", names)
+        self.assertNotIn("origin", names)
+
+    def test_tags_skip_opt_in_plugins(self):
+        self.assertNotIn("jsdump", self.registry.select(only=["body"]))
+        names = self.registry.select(only=["headers"])
+        self.assertIn("header", names)
+        self.assertNotIn("origin", names)
+        self.assertNotIn("coverage", names)
+
+    def test_names_select_opt_in_plugins(self):
+        self.assertEqual(self.registry.select(only=["jsdump"]), ["jsdump"])
+        self.assertIn("origin", self.registry.select(enable=["origin"]))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            self.registry.select(only=["nope"])
+
+
+PLUGIN_SOURCE = """
+import lovetz
+
+class MinePlugin(lovetz.LovetzPlugin):
+    name = "mine"
+    body_type = None
+
+    def check(self, url, *args, **kwargs):
+        self.log(lovetz.LOG_INFO, url, "saw {0}", args=(url,))
+        self.log(lovetz.LOG_WARN, url, "odd {0}", args=(url,))
+"""
+
+
+class TestDirectoryPlugins(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, "myplug.py"), "w") as fh:
+            fh.write(PLUGIN_SOURCE)
+        self.registry = lovetz.default_registry([self.tmp.name])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def messages(self, **kwargs):
+        plugin = self.registry.instantiate(["myplug"], **kwargs)[0]
+        plugin.check("http://a/", None, None, "", "", None, None)
+        return [e["message"] for e in plugin.events]
+
+    def test_min_severity_by_entry_name(self):
+        self.assertEqual(self.messages(min_severity={"myplug": lovetz.LOG_WARN}),
+                         ["odd http://a/"])
+
+    def test_suppress_by_entry_name(self):
+        self.assertEqual(self.messages(suppress=["myplug:saw"]), ["odd http://a/"])
+        self.assertEqual(self.messages(suppress=["myplug"]), [])
+        self.assertEqual(len(self.messages(suppress=["mine"])), 2)
+
+
+class TestSuppress(unittest.TestCase):
+
+    def check(self, name, suppress, **kwargs):
+        plugin = lovetz.default_registry().instantiate([name], suppress=suppress)[0]
+        plugin.check("http://a/", headers(**kwargs), headers(), "", "",
+                     lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"),
+                     lovetz.LovetzRequestLine.parse("GET / HTTP/1.1"))
+        return [e["message"] for e in plugin.events]
+
+    def test_text_matches_finished_message(self):
+        # whether the plugin formats the message or log does
+        cookies = ["sid=1; Secure; HttpOnly; SameSite=Strict", "other=2"]
+        self.assertTrue(any("sid" in m for m in self.check("cookie", [],
+                                                           set_cookie=cookies)))
+        messages = self.check("cookie", ["cookie:sid"], set_cookie=cookies)
+        self.assertTrue(messages)
+        self.assertFalse(any("sid" in m for m in messages))
+
+        messages = self.check("header", ["header:nginx"], server="nginx", x_foo="nginx")
+        self.assertFalse(any("nginx" in m for m in messages))
+        self.assertTrue(messages)
+
+    def test_template_text(self):
+        messages = self.check("etag", ["etag:ETag in"], etag="abc")
+        self.assertEqual(messages, [])
+        self.assertEqual(self.check("etag", ["etag:xyz"], etag="abc"),
+                         ["ETag in response for abc"])
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_engine(*names):
+    registry = lovetz.default_registry()
+    return lovetz.LovetzEngine(registry.instantiate(registry.select(only=list(names))))
+
+
+class TestService(unittest.TestCase):
+
+    def run_request(self, service, request):
+        out = []
+        service.handle(request, iter([]), out.append)
+        return out
+
+    def test_file_requests_refused_without_root(self):
+        service = lovetz.LovetzService(make_engine("cors"))
+        out = self.run_request(service, {"type": "ie",
+                                         "file": os.path.join(HERE, "Lojikil.xml")})
+        self.assertIn("error", out[0])
+        self.assertEqual(out[-1]["items"], 0)
+
+    def test_file_requests_under_root(self):
+        service = lovetz.LovetzService(make_engine("cors"), file_root=HERE)
+        out = self.run_request(service, {"type": "ie",
+                                         "file": os.path.join(HERE, "Lojikil.xml")})
+        self.assertEqual(out[-1]["items"], 3)
+
+        out = self.run_request(service, {"type": "ie",
+                                         "file": os.path.join(HERE, "..", "lovetz.py")})
+        self.assertIn("error", out[0])
+
+    def test_inline_items(self):
+        service = lovetz.LovetzService(make_engine("cors"))
+        out = self.run_request(service, {"items": [{
+            "url": "http://a/", "status": 200,
+            "response_headers": {"Access-Control-Allow-Origin": "*"}}]})
+        self.assertEqual(out[-1]["items"], 1)
+        self.assertEqual(out[0]["event"], lovetz.LOG_WARN)
+
+
+class TestEventStore(unittest.TestCase):
+
+    def test_sorted_merges_many_runs(self):
+        budget = lovetz.LovetzMemoryBudget(2000)
+        store = lovetz.LovetzEventStore(budget)
+        store.fanin = 3
+
+        events = [dict(url="u{0}".format(i % 7), n=i) for i in range(300)]
+        for event in events:
+            store.append(event)
+
+        self.assertGreater(len(store.runs), store.fanin ** 2)
+        self.assertEqual(list(store), events)
+
+        key = lambda e: e["url"]
+        self.assertEqual(list(store.sorted(key)), sorted(events, key=key))
+
+    def test_only_large_stores_spill(self):
+        budget = lovetz.LovetzMemoryBudget(4000)
+        small = lovetz.LovetzEventStore(budget)
+        large = lovetz.LovetzEventStore(budget)
+
+        small.append(dict(url="u"))
+        for i in range(20):
+            large.append(dict(url="u{0}".format(i)))
+
+        self.assertTrue(large.runs)
+        self.assertFalse(small.runs)
+        self.assertEqual(len(small) + len(large), 21)
+
+
+def headers(**kwargs):
+    res = lovetz.HeaderDict()
+    for name, value in kwargs.items():
+        res[name.replace("_", "-")] = value
+    return res
+
+
+class TestHeaderRules(unittest.TestCase):
+
+    def test_final_stops_later_rules(self):
+        rules = [lovetz.LovetzHeaderRule("server", "matches", "[0-9]",
+                                         lovetz.LOG_WARN, "versioned", final=True),
+                 lovetz.LovetzHeaderRule("server", "present", None,
+                                         lovetz.LOG_INFO, "plain")]
+        table = lovetz.LovetzHeaderTable(rules)
+        self.assertEqual(table.verdict("server", "nginx/1.2"),
+                         [(lovetz.LOG_WARN, "versioned")])
+        self.assertEqual(table.verdict("server", "nginx"),
+                         [(lovetz.LOG_INFO, "plain")])
+
+    def test_extra_rules_run_after_builtin_final(self):
+        extra = [lovetz.LovetzHeaderRule.parse({"header": "server",
+                                                "condition": "matches",
+                                                "value": "(?i)nginx",
+                                                "severity": "error",
+                                                "message": "nginx: {0}"})]
+        table = lovetz.LovetzHeaderTable(lovetz.HeaderPlugin.rules,
+                                         owner=lovetz.HeaderPlugin(),
+                                         extra_rules=extra)
+        res = table.verdict("server", "nginx/1.2")
+        self.assertIn((lovetz.LOG_ERROR, "nginx: nginx/1.2"), res)
+        self.assertEqual(res[0][0], lovetz.LOG_WARN)
+
+    def test_header_rules_per_instance(self):
+        rule = lovetz.LovetzHeaderRule("x-debug", "present", None,
+                                       lovetz.LOG_WARN, "debug header {0}")
+        registry = lovetz.default_registry()
+        with_rules = registry.instantiate(["header", "origin"], header_rules=[rule])
+        plain = registry.instantiate(["header"])[0]
+
+        for plugin in with_rules:
+            self.assertEqual(plugin.table.verdict("x-debug", "1"),
+                             [(lovetz.LOG_WARN, "debug header 1")])
+        self.assertNotIn("x-debug", plain.table.headers)
+
+    def test_missing_and_negated(self):
+        rules = [lovetz.LovetzHeaderRule("pragma", "missing", None,
+                                         lovetz.LOG_WARN, "none"),
+                 lovetz.LovetzHeaderRule("pragma", "!equals", "no-cache",
+                                         lovetz.LOG_WARN, "odd {0}")]
+        table = lovetz.LovetzHeaderTable(rules)
+        self.assertEqual(list(table.check(headers())), [(lovetz.LOG_WARN, "none")])
+        self.assertEqual(list(table.check(headers(pragma="no-cache"))), [])
+        self.assertEqual(list(table.check(headers(pragma="x"))),
+                         [(lovetz.LOG_WARN, "odd x")])
+
+    def test_bad_rules(self):
+        with self.assertRaises(ValueError):
+            lovetz.LovetzHeaderRule.parse({"header": "x", "condition": "nope",
+                                           "message": "m"})
+        with self.assertRaises(ValueError):
+            lovetz.LovetzHeaderRule.parse({"header": "x", "severity": "loud",
+                                           "message": "m"})
+
+    def test_cors_authorization_reported_once(self):
+        plugin = lovetz.CORSPlugin()
+        plugin.check("http://a/", headers(access_control_allow_origin="*",
+                                          access_control_allow_headers="authorization",
+                                          access_control_expose_headers="authorization"),
+                     None, "", "", None, None)
+        messages = [e["message"] for e in plugin.events]
+        self.assertEqual(messages.count("Wildcard ACAO with authorization allowed"), 1)
+
+
+def burp_item(request, response, url="http://example.com/login"):
+    return fromstring("<item><url>{0}</url><request base64=\"true\">{1}</request>"
+                      "<response base64=\"true\">{2}</response></item>".format(
+                          url, base64.b64encode(request).decode(),
+                          base64.b64encode(response).decode()))
+
+
+class TestBurpReader(unittest.TestCase):
+
+    def test_request_body_is_text(self):
+        item = lovetz.BurpProxyReader()._item(burp_item(
+            b"POST /login HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Type: application/x-www-form-urlencoded; charset=latin-1"
+            b"\r\n\r\nuser=j\xf6rg&pass=x",
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html></html>"))
+        self.assertEqual(item.request_body, "user=j\xf6rg&pass=x")
+        self.assertEqual(bytes(item.response_body), b"<html></html>")
+
+    def test_no_request_body(self):
+        item = lovetz.BurpProxyReader()._item(burp_item(
+            b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n",
+            b"HTTP/1.1 204 No Content\r\n\r\n"))
+        self.assertEqual(item.request_body, "")
+
+    def test_csrf_plugin_reads_request_body(self):
+        item = lovetz.BurpProxyReader()._item(burp_item(
+            b"POST /login HTTP/1.1\r\nHost: example.com\r\n\r\nuser=a&pass=b",
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html></html>"))
+        engine = make_engine("csrf")
+        engine.process(item)
+        self.assertTrue(engine.plugins[0].events)
+
+
+def b64_item(text, content_type="text/html"):
+    return lovetz.LovetzHistoryItem("http://example.com/",
+                                    lovetz.LovetzRequestLine.parse("GET / HTTP/1.1"),
+                                    lovetz.HeaderDict(), "",
+                                    lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"),
+                                    headers(content_type=content_type), text,
+                                    body_encoding="base64")
+
+
+class TestBase64Bodies(unittest.TestCase):
+
+    def test_lazy_decode(self):
+        item = b64_item(base64.b64encode(b"<html></html>").decode())
+        self.assertEqual(item.content_class, lovetz.CONTENT_TEXT)
+        self.assertEqual(item.response_body, b"<html></html>")
+        self.assertFalse(item.undecodable)
+
+    def test_bad_padding(self):
+        item = b64_item("PGh0bWw+PC9odG1sPg=")
+        self.assertTrue(item.undecodable)
+        self.assertEqual(item.content_class, lovetz.CONTENT_EMPTY)
+        self.assertEqual(item.response_body, b"")
+
+    def test_bad_padding_past_the_sniff(self):
+        text = base64.b64encode(b"<html>" + b" " * 2000 + b"</html>").decode()
+        item = b64_item(text[:-1])
+        self.assertEqual(item.content_class, lovetz.CONTENT_TEXT)
+        engine = make_engine("header", "autocomplete")
+        self.assertTrue(engine.process(item))
+        self.assertTrue(item.undecodable)
+        self.assertEqual(engine.undecodable, 1)
+
+
+STUB_ANALYZER = """
+import sys
+
+with open(sys.argv[2], "a") as fh:
+    fh.write(sys.argv[1] + "\\n")
+
+if "fetch(" in open(sys.argv[1]).read():
+    print('{"message": "uses fetch", "severity": "info", "line": 3}')
+print("error: hardcoded API path")
+print("something odd")
+"""
+
+
+class TestJSAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stub = os.path.join(self.tmp.name, "stub.py")
+        self.runs = os.path.join(self.tmp.name, "runs.log")
+        with open(self.stub, "w") as fh:
+            fh.write(STUB_ANALYZER)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def plugin(self):
+        plugin = lovetz.JSAnalysisPlugin()
+        plugin.command = "{0} {1} {{file}} {2}".format(sys.executable,
+                                                     self.stub, self.runs)
+        plugin.cache_dir = os.path.join(self.tmp.name, "cache")
+        plugin.jobs = 1
+        return plugin
+
+    def feed(self, plugin, url, body):
+        plugin.check(url, headers(content_type="application/javascript"), None,
+                     body, "", lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"),
+                     None)
+
+    def runs_logged(self):
+        if not os.path.exists(self.runs):
+            return 0
+        with open(self.runs) as fh:
+            return len(fh.readlines())
+
+    def test_findings_and_distinct_urls(self):
+        plugin = self.plugin()
+        for url in ["http://a/app.js", "http://a/app.js", "http://b/app.js",
+                    "http://a/app.js", "http://c/app.js"]:
+            self.feed(plugin, url, b"fetch('/api');\n")
+        plugin.finish()
+
+        self.assertEqual(self.runs_logged(), 1)
+        events = [(e["event"], e["url"], e["message"]) for e in plugin.events]
+        suffix = " (same script at 2 other URLs)"
+        self.assertEqual(events, [
+            (lovetz.LOG_INFO, "http://a/app.js", "(js) line 3: uses fetch" + suffix),
+            (lovetz.LOG_ERROR, "http://a/app.js", "(js) hardcoded API path" + suffix),
+            (lovetz.LOG_WARN, "http://a/app.js", "(js) something odd" + suffix)])
+
+    def test_cache(self):
+        plugin = self.plugin()
+        self.feed(plugin, "http://a/app.js", b"var x = 1;\n")
+        plugin.finish()
+        first = [e["message"] for e in plugin.events]
+
+        plugin = self.plugin()
+        self.feed(plugin, "http://b/other.js", b"var x = 1;\n")
+        plugin.finish()
+
+        self.assertEqual(self.runs_logged(), 1)
+        self.assertEqual([e["message"] for e in plugin.events], first)
+        self.assertEqual(len(first), 2)
+
+    def test_scripts_not_kept(self):
+        plugin = self.plugin()
+        self.feed(plugin, "http://a/app.js", b"var x = 1;\n")
+        plugin.finish()
+        self.assertEqual([f for f in os.listdir(plugin.cache_dir) if f.endswith(".js")], [])
+
+    def test_unwritable_cache(self):
+        plugin = self.plugin()
+        body = b"var y = 2;\n"
+        # a directory where the results should go
+        os.makedirs(os.path.join(plugin.cache_dir, plugin.key(body) + ".json"))
+        self.feed(plugin, "http://a/app.js", body)
+        plugin.finish()
+        messages = [e["message"] for e in plugin.events]
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[-1].startswith("(js) JS analyzer results not cached"))
+
+        plugin = self.plugin()
+        plugin.cache_dir = self.stub
+        self.feed(plugin, "http://a/app.js", body)
+        plugin.finish()
+        messages = [e["message"] for e in plugin.events]
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith("(js) JS analyzer failed"))
+
+    def test_skips_non_scripts(self):
+        plugin = self.plugin()
+        plugin.check("http://a/", headers(content_type="text/html"), None,
+                     b"<html>", "", lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"),
+                     None)
+        plugin.finish()
+        self.assertEqual(self.runs_logged(), 0)
+
+    def test_normalize(self):
+        plugin = lovetz.JSAnalysisPlugin()
+        self.assertEqual(plugin.normalize('{"message": "m", "severity": "ERROR"}\n'
+                                          '\n'
+                                          '{"broken\n'
+                                          'info: fine\n'
+                                          'http://x: not a level\n'),
+                         [[lovetz.LOG_ERROR, "m"],
+                          [lovetz.LOG_WARN, '{"broken'],
+                          [lovetz.LOG_INFO, "fine"],
+                          [lovetz.LOG_WARN, "http://x: not a level"]])
+
+
+class TestStatusLines(unittest.TestCase):
+
+    def test_response_line(self):
+        line = lovetz.LovetzResponseLine.parse("HTTP/1.1 404 Not Found")
+        self.assertEqual((line.version, line.code, line.reason),
+                         ("HTTP/1.1", 404, "Not Found"))
+        self.assertEqual(line.status_class, 4)
+
+    def test_response_line_version_last(self):
+        line = lovetz.LovetzResponseLine.parse("200 OK HTTP/1.1")
+        self.assertEqual((line.version, line.code, line.reason),
+                         ("HTTP/1.1", 200, "OK"))
+
+    def test_response_line_garbage(self):
+        line = lovetz.LovetzResponseLine.parse("nonsense")
+        self.assertEqual(line.code, 0)
+        self.assertEqual(line.reason, "nonsense")
+        self.assertEqual(lovetz.LovetzResponseLine.parse("HTTP/1.1 abc").code, 0)
+
+    def test_request_line(self):
+        line = lovetz.LovetzRequestLine.parse("get /a b HTTP/1.1")
+        self.assertEqual((line.method, line.target, line.version),
+                         ("GET", "/a b", "HTTP/1.1"))
+        line = lovetz.LovetzRequestLine.parse("GET /")
+        self.assertEqual((line.method, line.target, line.version), ("GET", "/", ""))
+
+
+def make_item(body, content_type="text/html", url="http://example.com/",
+              status="HTTP/1.1 200 OK", **kwargs):
+    return lovetz.LovetzHistoryItem(url,
+                                    lovetz.LovetzRequestLine.parse("GET / HTTP/1.1"),
+                                    lovetz.HeaderDict(), "",
+                                    lovetz.LovetzResponseLine.parse(status),
+                                    headers(content_type=content_type), body,
+                                    **kwargs)
+
+
+class Recorder(lovetz.LovetzPlugin):
+    """ Keeps the response bodies it's handed. """
+
+    name = "recorder"
+
+    def __init__(self, *args, **kwargs):
+        super(Recorder, self).__init__(*args, **kwargs)
+        self.bodies = []
+
+    def check(self, url, response_headers, request_headers,
+              response_body, request_body, response_status, request_status):
+        self.bodies.append(response_body)
+
+
+class TestBodyBudget(unittest.TestCase):
+
+    def test_defaults(self):
+        budget = lovetz.LovetzBodyBudget(max_bytes=10)
+        self.assertEqual((budget.head, budget.tail), (5, 5))
+        budget = lovetz.LovetzBodyBudget(head=4)
+        self.assertEqual((budget.max_bytes, budget.head, budget.tail), (4, 4, 0))
+
+    def test_apply(self):
+        budget = lovetz.LovetzBodyBudget(max_bytes=6)
+        self.assertEqual(budget.apply("0123456789"), "012\n789")
+        self.assertEqual(budget.apply(b"0123456789"), b"012\n789")
+        self.assertEqual(budget.apply(memoryview(b"0123456789")), b"012\n789")
+        self.assertEqual(budget.apply("short"), "short")
+        self.assertEqual(budget.apply(""), "")
+
+    def test_skip_above(self):
+        budget = lovetz.LovetzBodyBudget(skip_above=4)
+        self.assertEqual(budget.apply(b"12345"), b"")
+        self.assertEqual(budget.apply(b"1234"), b"1234")
+
+    def test_engine_windows_bodies(self):
+        plugin = Recorder()
+        engine = lovetz.LovetzEngine([plugin],
+                                     body_budget=lovetz.LovetzBodyBudget(max_bytes=4))
+        engine.process(make_item(b"<html></html>"))
+        engine.process(make_item(b"<p>"))
+        self.assertEqual(plugin.bodies, ["<h\nl>", "<p>"])
+        self.assertEqual(engine.windowed, 1)
+
+    def test_plugin_budget_wins(self):
+        plugin = Recorder(body_budget=lovetz.LovetzBodyBudget())
+        engine = lovetz.LovetzEngine([plugin],
+                                     body_budget=lovetz.LovetzBodyBudget(max_bytes=4))
+        engine.process(make_item(b"<html></html>"))
+        self.assertEqual(plugin.bodies, ["<html></html>"])
+        self.assertEqual(engine.windowed, 0)
+
+
+class TestClassifyContent(unittest.TestCase):
+
+    def classify(self, content_type, body):
+        return lovetz.classify_content(content_type, body)
+
+    def test_empty(self):
+        self.assertEqual(self.classify("text/html", b""), lovetz.CONTENT_EMPTY)
+        self.assertEqual(self.classify("text/html", None), lovetz.CONTENT_EMPTY)
+
+    def test_magic_beats_content_type(self):
+        self.assertEqual(self.classify("text/html", b"\x89PNG\r\n\x1a\n..."),
+                         lovetz.CONTENT_BINARY)
+        self.assertEqual(self.classify(None, b"\x00\x00\x00\x18ftypmp42"),
+                         lovetz.CONTENT_BINARY)
+
+    def test_content_type(self):
+        self.assertEqual(self.classify("application/json", b"{}"), lovetz.CONTENT_TEXT)
+        self.assertEqual(self.classify("image/svg+xml", b"<svg/>"), lovetz.CONTENT_TEXT)
+        self.assertEqual(self.classify("font/woff2", b"abc"), lovetz.CONTENT_BINARY)
+        self.assertEqual(self.classify("image/jpeg", "text already"),
+                         lovetz.CONTENT_BINARY)
+
+    def test_sniffing(self):
+        self.assertEqual(self.classify(None, b"hello there"), lovetz.CONTENT_TEXT)
+        self.assertEqual(self.classify(None, b"a\x00b"), lovetz.CONTENT_BINARY)
+        self.assertEqual(self.classify(None, bytes(range(1, 32)) * 4),
+                         lovetz.CONTENT_BINARY)
+        self.assertEqual(self.classify(None, "nul\x00in text"), lovetz.CONTENT_BINARY)
+
+    def test_binary_bodies_kept_from_plugins(self):
+        plugin = Recorder()
+        engine = lovetz.LovetzEngine([plugin])
+        engine.process(make_item(b"GIF89a...", content_type="image/gif"))
+        engine.process(make_item(b"", content_type="text/html"))
+        self.assertEqual(plugin.bodies, ["", ""])
+
+
+class TestOriginHeaders(unittest.TestCase):
+
+    def check(self, plugin, url, **kwargs):
+        plugin.check(url, headers(**kwargs), None, "", "",
+                     lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"), None)
+
+    def csp_messages(self, plugin):
+        return [e["message"] for e in plugin.events
+                if e["message"].startswith("CSP with policy")]
+
+    def test_per_response_nonces(self):
+        plugin = lovetz.OriginHeaderPlugin()
+        for n in range(5):
+            self.check(plugin, "http://a/page/{0}".format(n),
+                       content_security_policy="script-src 'nonce-{0}'".format(n))
+        plugin.finish()
+
+        self.assertEqual(len(plugin.origins["http://a"][1]["content-security-policy"]), 1)
+        messages = self.csp_messages(plugin)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].endswith("(5/5 responses)"))
+
+    def test_outliers(self):
+        plugin = lovetz.OriginHeaderPlugin()
+        for n in range(3):
+            self.check(plugin, "http://a/{0}".format(n), x_frame_options="DENY")
+        self.check(plugin, "http://a/odd", x_frame_options="SAMEORIGIN")
+        plugin.finish()
+
+        odd = [e["message"] for e in plugin.events if "outliers" in e["message"]]
+        self.assertTrue(odd)
+        self.assertTrue(all("http://a/odd" in m and "(1/4 responses)" in m for m in odd))
+
+    def test_values_bounded(self):
+        plugin = lovetz.OriginHeaderPlugin()
+        plugin.value_limit = 2
+        for n in range(5):
+            self.check(plugin, "http://a/{0}".format(n),
+                       server="nginx/1.{0}".format(n))
+        self.assertEqual(len(plugin.origins["http://a"][1]["server"]), 2)
+        # the rest are reported straight away, against their own URL
+        self.assertIn("http://a/4", [e["url"] for e in plugin.events])
+
+
+class TestCSP(unittest.TestCase):
+
+    def messages(self, policy):
+        return [msg for _, msg in lovetz.analyze_csp(policy)]
+
+    def test_parse(self):
+        csp = lovetz.LovetzCSP.parse("default-src 'self'; script-src 'self' https://cdn.x")
+        self.assertEqual(len(csp.policies), 1)
+        self.assertIn("script-src", csp.policies[0])
+
+    def test_weak_policy(self):
+        res = self.messages("script-src 'unsafe-inline' *")
+        self.assertIn("CSP allows 'unsafe-inline' scripts", res)
+        self.assertIn("CSP allows scripts from wildcard source *", res)
+
+    def test_nonces_share_a_verdict(self):
+        self.assertEqual(self.messages("script-src 'nonce-abc123'"),
+                         self.messages("script-src 'nonce-zzz999'"))
+
+    def test_repeated_directive(self):
+        csp = lovetz.LovetzCSP.parse("script-src 'self'; script-src *")
+        self.assertEqual(csp.policies[0]["script-src"], ["'self'"])
+
+    def test_multiple_policies(self):
+        # a response with two policies must satisfy both, so only what
+        # both allow is reported
+        self.assertNotIn("CSP allows scripts from wildcard source *",
+                         self.messages("script-src *, script-src 'self'"))
+
+    def test_cached(self):
+        lovetz._analyze_csp.cache_clear()
+        lovetz.analyze_csp("script-src 'nonce-a'")
+        lovetz.analyze_csp("script-src 'nonce-b'")
+        self.assertEqual(lovetz._analyze_csp.cache_info().hits, 1)
+
+
+NDJSON_LINES = ['{"url": "http://a/", "status": 200, '
+                '"response_headers": {"Content-Type": "text/html"}, '
+                '"response_body": "<html></html>"}\n',
+                '\n',
+                '{not json\n',
+                '{"status": 200}\n',
+                '{"url": "http://b/x", "status_line": "HTTP/1.1 404 Not Found", '
+                '"response_headers": [["Server", "nginx"]], '
+                '"response_body_base64": "AAEC"}\n',
+                '{"end": true}\n',
+                '{"url": "http://c/"}\n']
+
+
+class TestNDJSONReader(unittest.TestCase):
+
+    def read(self, **kwargs):
+        reader = lovetz.NDJSONReader(**kwargs)
+        reader.load(stream=iter(NDJSON_LINES))
+        return reader, list(reader.iteritem())
+
+    def test_items(self):
+        reader, items = self.read()
+        self.assertEqual([i.url for i in items], ["http://a/", "http://b/x"])
+        self.assertEqual(items[0].response_status.code, 200)
+        self.assertEqual(items[0].content_class, lovetz.CONTENT_TEXT)
+        self.assertEqual(items[1].response_status.code, 404)
+        self.assertEqual(items[1].response_headers["server"], "nginx")
+        self.assertEqual(items[1].response_body, b"\x00\x01\x02")
+        self.assertEqual(reader.errors, 2)
+
+    def test_domain(self):
+        _, items = self.read(dom="b")
+        self.assertEqual([i.url for i in items], ["http://b/x"])
+
+    def test_file_closed(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as fh:
+            fh.writelines(NDJSON_LINES)
+        try:
+            reader = lovetz.NDJSONReader()
+            reader.load(fh.name)
+            handle = reader.fh
+            self.assertEqual(len(list(reader.iteritem())), 2)
+            self.assertTrue(handle.closed)
+            self.assertEqual(reader.position(), sum(len(l) for l in NDJSON_LINES[:6]))
+        finally:
+            os.unlink(fh.name)
+
+
+class TestDedupe(unittest.TestCase):
+
+    def test_same_transaction_across_sources(self):
+        one = make_item(b"<html></html>", url="http://A:80/x", source="burp.xml")
+        two = make_item("<html></html>", url="http://a/x", source="log.har")
+        other = make_item(b"<html>!</html>", url="http://a/x")
+        self.assertEqual(one.fingerprint(), two.fingerprint())
+        self.assertNotEqual(one.fingerprint(), other.fingerprint())
+
+    def test_binary_bodies_not_decoded(self):
+        raw = b"\x89PNG" + b"\x00" * 60
+        encoded = make_item(base64.b64encode(raw).decode(), content_type="image/png",
+                            body_encoding="base64", body_size=len(raw),
+                            content_class=lovetz.CONTENT_BINARY)
+        plain = make_item(raw, content_type="image/png")
+        self.assertEqual(encoded.fingerprint(), plain.fingerprint())
+        self.assertEqual(encoded.body_encoding, "base64")
+
+    def test_engine(self):
+        plugin = Recorder()
+        engine = lovetz.LovetzEngine([plugin], dedupe=True)
+        self.assertTrue(engine.process(make_item(b"<p>", source="one")))
+        self.assertFalse(engine.process(make_item(b"<p>", source="two")))
+        self.assertTrue(engine.process(make_item(b"<b>", source="two")))
+        self.assertEqual(engine.duplicates, 1)
+        self.assertEqual(len(plugin.bodies), 2)
+        self.assertEqual(list(engine.seen.values())[0], ["one", "two"])
+
+
+def burp_export(count):
+    out = ['<?xml version="1.0"?>', '<items burpVersion="2.0">']
+    for idx in range(count):
+        request = "GET /{0} HTTP/1.1\r\nHost: example.com\r\n\r\n".format(idx)
+        response = ("HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n"
+                    "item {0}".format(idx))
+        # a comment with <item> in it mustn't be taken for a boundary
+        out.append('<item><time>now</time><url><![CDATA[http://example.com/{0}]]></url>'
+                   '<request base64="true"><![CDATA[{1}]]></request>'
+                   '<status>200</status><response base64="true"><![CDATA[{2}]]>'
+                   '</response><comment><![CDATA[<item>  <title/>]]></comment>'
+                   '</item>'.format(idx, base64.b64encode(request.encode()).decode(),
+                                    base64.b64encode(response.encode()).decode()))
+    out.append('</items>')
+    return "\n".join(out).encode("utf8")
+
+
+class TestParallelBurpReader(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(suffix=".xml", delete=False) as fh:
+            fh.write(burp_export(40))
+        self.filename = fh.name
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def reader(self, jobs):
+        reader = lovetz.ParallelBurpReader(jobs=jobs)
+        reader.min_chunk = 512
+        reader.load(self.filename)
+        return reader
+
+    def test_boundary_skips_item_in_bodies(self):
+        data = b"<items>\n<item><time>x</time><r><rss><item>  <title/></item>\n<item>\n<time>"
+        self.assertEqual(lovetz._burp_boundary(data, 0, len(data)), 8)
+        self.assertEqual(lovetz._burp_boundary(data, 9, len(data)), data.rindex(b"<item>"))
+        self.assertEqual(lovetz._burp_boundary(data, len(data) - 3, len(data)), len(data))
+
+    def test_ranges(self):
+        with open(self.filename, "rb") as fh:
+            data = fh.read()
+        ranges = self.reader(4).ranges()
+        self.assertEqual(len(ranges), 16)
+        self.assertEqual(ranges[0][1], data.index(b"<item>"))
+        self.assertEqual(ranges[-1][2], data.rindex(b"</items>"))
+        for (_, _, end, _), (_, start, _, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertTrue(data[start:].startswith(b"<item><time>"))
+
+    def test_parallel_matches_serial(self):
+        serial = lovetz.BurpProxyReader()
+        serial.load(self.filename)
+        expected = [(i.url, i.response_body) for i in serial.iteritem()]
+
+        reader = self.reader(2)
+        reader.window_per_job = 1
+        got = [(i.url, bytes(i.response_body)) for i in reader.iteritem()]
+
+        self.assertEqual(len(expected), 40)
+        self.assertEqual(got, [(url, bytes(body)) for url, body in expected])
+        self.assertEqual(reader.position(), reader.ranges()[-1][2])
+
+
+class TestCSRF(unittest.TestCase):
+
+    def setUp(self):
+        self.plugin = lovetz.CSRFPlugin()
+
+    def request(self, method, body="", url="http://a/save", **kwargs):
+        self.plugin.check(url, headers(), headers(**kwargs), "", body,
+                          lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"),
+                          lovetz.LovetzRequestLine.parse(method + " /save HTTP/1.1"))
+        return [e["message"] for e in self.plugin.events]
+
+    def forms(self, page):
+        self.plugin.check_forms("http://a/", lovetz.LovetzHTMLDocument(page))
+        return [e["message"] for e in self.plugin.events]
+
+    def test_request_without_token(self):
+        self.assertEqual(self.request("POST", "name=x&age=3"),
+                         ["No CSRF token parameter or header in POST request"])
+
+    def test_request_tokens(self):
+        self.assertEqual(self.request("POST", "name=x&csrfmiddlewaretoken=1"), [])
+        self.assertEqual(self.request("PUT", '{"name": "x", "_xsrf": "1"}'), [])
+        self.assertEqual(self.request("POST", 'Content-Disposition: form-data; '
+                                              'name="authenticity_token"'), [])
+        self.assertEqual(self.request("DELETE", url="http://a/x?my_nonce=1"), [])
+        self.assertEqual(self.request("PATCH", "a=1", x_csrf_token="1"), [])
+
+    def test_safe_methods(self):
+        self.assertEqual(self.request("GET", "name=x"), [])
+
+    def test_forms(self):
+        page = ('<form method="post" action="/a"><input name="q"></form>'
+                '<form method="POST" action="/b"><input type="hidden" name="_token">'
+                '</form><form action="/c"><input name="q"></form>'
+                '<form method="post"><input name="x">')
+        self.assertEqual(self.forms(page),
+                         ["POST form without a CSRF token (action: /a)",
+                          "POST form without a CSRF token (action: http://a/)"])
+
+
+class TestHTMLDocument(unittest.TestCase):
+
+    def test_tags(self):
+        doc = lovetz.LovetzHTMLDocument(
+            '<!-- <input name="hidden"> --><FORM Method="post">'
+            '<script type="x">var s = "<input name=\'no\'>";</script>'
+            '<input name=a value="1 > 0"></form>')
+        names = [(t.name, t.closing) for t in doc.tags]
+        self.assertEqual(names, [("form", False), ("script", False), ("script", True),
+                                 ("input", False), ("form", True)])
+        self.assertEqual(doc.tags[0].get("method"), "post")
+        self.assertIn("<input name='no'>", doc.tags[1].text)
+        self.assertEqual(doc.tags[3].get("name"), "a")
+
+    def test_lazy_and_bytes(self):
+        doc = lovetz.LovetzHTMLDocument(memoryview(b"<p>caf\xc3\xa9</p>"))
+        self.assertIsNone(doc._tags)
+        self.assertEqual([t.name for t in doc.tags], ["p", "p"])
+
+    def test_shared_between_plugins(self):
+        engine = make_engine("csrf", "autocomplete")
+        item = make_item(b'<form method="post"><input type="password" name="pw"></form>')
+        engine.process(item)
+        self.assertIsNotNone(item.html)
+        messages = sorted(e["message"] for p in engine.plugins for e in p.events)
+        self.assertEqual(messages, ["POST form without a CSRF token (action: http://example.com/)",
+                                    "Password field 'pw' with autocomplete enabled"])
+
+    def test_not_html(self):
+        engine = make_engine("autocomplete")
+        item = make_item(b'<input type="password">', content_type="application/json")
+        engine.process(item)
+        self.assertIsNone(item.html)
+        self.assertFalse(engine.plugins[0].events)
+
+
+class TestAutocomplete(unittest.TestCase):
+
+    def messages(self, page):
+        plugin = lovetz.AutocompletePlugin()
+        plugin.check("http://a/", None, None, "", "", None, None,
+                     html=lovetz.LovetzHTMLDocument(page))
+        return [e["message"] for e in plugin.events]
+
+    def test_fields(self):
+        self.assertEqual(self.messages('<input type="password" name="pw">'
+                                       '<input name="ccnum">'
+                                       '<input name="q">'),
+                         ["Password field 'pw' with autocomplete enabled",
+                          "Sensitive field 'ccnum' with autocomplete enabled"])
+
+    def test_turned_off(self):
+        self.assertEqual(self.messages('<input type="password" autocomplete="new-password">'
+                                       '<form autocomplete="off">'
+                                       '<input type="password" name="pw"></form>'), [])
+        self.assertEqual(self.messages('<form autocomplete="off"></form>'
+                                       '<input type="password" id="later">'),
+                         ["Password field 'later' with autocomplete enabled"])
+
+
+class TestDiff(unittest.TestCase):
+
+    def event(self, url, message, source="cookie"):
+        return {"source": source, "event": lovetz.LOG_WARN, "url": url,
+                "message": message}
+
+    def test_path_template(self):
+        self.assertEqual(lovetz.path_template("/user/123/orders/9f86d081884c7d65"),
+                         "/user/{int}/orders/{hex}")
+        self.assertEqual(lovetz.path_template(
+            "/o/123e4567-e89b-12d3-a456-426614174000"), "/o/{uuid}")
+        self.assertEqual(lovetz.path_template(""), "/")
+
+    def test_url_template(self):
+        self.assertEqual(lovetz.url_template("HTTP://Example.COM/item/42?x=1"),
+                         "http://example.com/item/{int}")
+
+    def test_message_template(self):
+        self.assertEqual(lovetz.message_template("Cookie sid=abc123 seen 3 times"),
+                         "Cookie sid=* seen # times")
+
+    def test_finding_key(self):
+        one = self.event("http://a/user/1", "cookie 'sid' not HttpOnly")
+        two = dict(one, url="http://A/user/2")
+        other = dict(one, source="header")
+        self.assertEqual(lovetz.finding_key(one), lovetz.finding_key(two))
+        self.assertNotEqual(lovetz.finding_key(one)[0], lovetz.finding_key(other)[0])
+        self.assertIn("http://a/user/{int}", lovetz.finding_key(one)[1])
+
+    def test_diff(self):
+        old = [self.event("http://a/1", "sid=1 not Secure"),
+               self.event("http://a/2", "sid=2 not Secure"),
+               self.event("http://a/", "no HSTS")]
+        new = [self.event("http://a/3", "sid=3 not Secure"),
+               self.event("http://a/", "no CSP")]
+        res = sorted((status, old_count, new_count)
+                     for status, _, old_count, new_count in lovetz.diff_logs(old, new))
+        self.assertEqual(res, [("fixed", 1, 0), ("new", 0, 1), ("unchanged", 2, 1)])
+
+    def test_iter_events(self):
+        events = [self.event("http://a/{0}".format(n), "x" * 5000) for n in range(30)]
+        with tempfile.TemporaryDirectory() as tmp:
+            dumped = os.path.join(tmp, "run.json")
+            lovetz.dump_logs(events, style=lovetz.LOG_JSON, location=dumped)
+            self.assertEqual([e["url"] for e in lovetz.iter_events(dumped)],
+                             [e["url"] for e in events])
+
+            lines = os.path.join(tmp, "service.ndjson")
+            with open(lines, "w") as fh:
+                for event in events[:3] + [{"done": True, "items": 3}]:
+                    fh.write(json.dumps(event) + "\n")
+            self.assertEqual(len(list(lovetz.iter_events(lines))), 3)
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_categories(self):
+        prioritizer = lovetz.LovetzPrioritizer()
+        self.assertEqual(prioritizer.score(make_item(b"", status="HTTP/1.1 304 Not Modified"))[1],
+                         "not-modified")
+        self.assertEqual(prioritizer.score(make_item(b"x", content_type="text/css",
+                                                     url="http://a/s.css"))[1], "static")
+        self.assertEqual(prioritizer.score(make_item(b"<p>", url="http://a/login"))[1], "auth")
+        self.assertEqual(prioritizer.score(make_item(b"<p>", url="http://a/home"))[1], "html")
+        self.assertEqual(prioritizer.score(make_item(b"{}", content_type="application/json",
+                                                     url="http://a/api"))[1], "other")
+
+    def test_new_origins_first(self):
+        prioritizer = lovetz.LovetzPrioritizer()
+        first = prioritizer.score(make_item(b"<p>", url="http://a/x"))[0]
+        again = prioritizer.score(make_item(b"<p>", url="http://a/x"))[0]
+        elsewhere = prioritizer.score(make_item(b"<p>", url="http://b/x"))[0]
+        self.assertEqual(first - again, 50)
+        self.assertEqual(elsewhere, first)
+
+    def test_best_first_within_window(self):
+        plugin = Recorder()
+        engine = lovetz.LovetzEngine([plugin])
+        items = [make_item(b"a{}", content_type="text/css", url="http://a/1.css"),
+                 make_item(b"<p>1</p>", url="http://a/page"),
+                 make_item(b"<p>2</p>", url="http://a/login")]
+        report = engine.run_prioritized(iter(items), 60, window=0)
+        self.assertEqual(plugin.bodies, ["<p>2</p>", "<p>1</p>", "a{}"])
+        self.assertEqual(report["read"], 3)
+        self.assertTrue(report["exhausted"])
+        self.assertEqual(report["scanned"], {"static": 1, "html": 1, "auth": 1})
+
+    def test_deadline_passed(self):
+        engine = lovetz.LovetzEngine([Recorder()])
+        report = engine.run_prioritized(iter([make_item(b"<p>")]), 0)
+        self.assertFalse(report["exhausted"])
+        self.assertEqual(report["read"], 0)
+
+
+class TestTemplater(unittest.TestCase):
+
+    def test_templates(self):
+        templater = lovetz.LovetzTemplater(max_values=2)
+        self.assertEqual(templater.template("GET", "http://a/item/7?b=1&a=2"),
+                         "GET http://a/item/{int}?a={}&b={}")
+        self.assertEqual(templater.template("GET", "http://a/p/one"), "GET http://a/p/one")
+        self.assertEqual(templater.template("GET", "http://a/p/two"), "GET http://a/p/two")
+        self.assertEqual(templater.template("GET", "http://a/p/three"), "GET http://a/p/{var}")
+        self.assertEqual(templater.template("GET", "http://a/p/one"), "GET http://a/p/{var}")
+        self.assertEqual(templater.template("POST", "http://b/p/one"), "POST http://b/p/one")
+
+    def test_exemplars(self):
+        engine = lovetz.LovetzEngine(make_engine("cookie").plugins,
+                                     templater=lovetz.LovetzTemplater(),
+                                     exemplars=2)
+        for n in range(5):
+            item = make_item(b"<p>", url="http://a/user/{0}".format(n))
+            item.response_headers["set-cookie"] = "sid={0}; Path=/".format(n)
+            engine.process(item)
+        self.assertEqual(engine.templated, 3)
+
+        events = list(engine.annotate(engine.plugins[0].events))
+        self.assertTrue(events)
+        self.assertTrue(all(e["template_hits"] == 5 for e in events))
+        # the two exemplars' identical findings are only reported once
+        messages = [lovetz.finding_key(e)[0] for e in events]
+        self.assertEqual(len(messages), len(set(messages)))
+
+
+def ndjson_reader(lines):
+    reader = lovetz.NDJSONReader()
+    reader.load(stream=iter(lines))
+    return reader
+
+
+class TestSampler(unittest.TestCase):
+
+    def lines(self):
+        res = []
+        for n in range(50):
+            res.append(json.dumps({"url": "http://big/{0}".format(n), "status": 200,
+                                   "response_headers": {"Content-Type": "text/html"},
+                                   "response_body": "<p>"}) + "\n")
+        res.append(json.dumps({"url": "http://small/", "status": 200,
+                               "response_headers": {"Content-Type": "image/png"}}) + "\n")
+        return res
+
+    def test_every_stratum_represented(self):
+        sampler = lovetz.LovetzSampler(5, seed=1)
+        items = list(sampler.sample([ndjson_reader(self.lines())]))
+        urls = [i.url for i in items]
+
+        self.assertEqual(len(items), 6)
+        self.assertIn("http://small/", urls)
+        # original order is kept
+        everything = [json.loads(line)["url"] for line in self.lines()]
+        self.assertEqual(urls, [url for url in everything if url in urls])
+        report = sampler.report()
+        self.assertEqual((report["seen"], report["sampled"], report["strata"]), (51, 6, 2))
+        self.assertEqual(report["origins"]["http://big"], [50, 5])
+
+    def test_seeded(self):
+        one = [i.url for i in lovetz.LovetzSampler(3, seed=7).sample([ndjson_reader(self.lines())])]
+        two = [i.url for i in lovetz.LovetzSampler(3, seed=7).sample([ndjson_reader(self.lines())])]
+        self.assertEqual(one, two)
+
+
+class TestHeaderMatrix(unittest.TestCase):
+
+    def matrix(self):
+        matrix = lovetz.LovetzHeaderMatrix(["strict-transport-security",
+                                            "content-security-policy"])
+        matrix.add("https://a/", headers(strict_transport_security="max-age=1"),
+                   "text/html; charset=utf-8", 200)
+        matrix.add("https://a/x", headers(content_security_policy="default-src 'self'"),
+                   "text/html", 200)
+        matrix.add("https://a/app.js", headers(), "application/javascript", 200)
+        matrix.add("https://b/", headers(strict_transport_security="max-age=1"),
+                   "text/html", 404)
+        return matrix
+
+    def test_coverage(self):
+        matrix = self.matrix()
+        self.assertEqual(matrix.coverage("origin"),
+                         {"https://a": (3, [1, 1]), "https://b": (1, [1, 0])})
+        self.assertEqual(matrix.coverage("type")["text/html"], (3, [2, 1]))
+        self.assertEqual(matrix.coverage("status")["404"], (1, [1, 0]))
+
+    def test_coverage_by_origin_and_type(self):
+        coverage = self.matrix().coverage(("origin", "type"))
+        self.assertEqual(coverage, {("https://a", "text/html"): (2, [1, 1]),
+                                    ("https://a", "application/javascript"): (1, [0, 0]),
+                                    ("https://b", "text/html"): (1, [1, 0])})
+
+    def test_export(self):
+        out = io.StringIO()
+        self.matrix().export(out)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ["url", "origin", "type", "status",
+                                   "strict-transport-security", "content-security-policy"])
+        self.assertEqual(rows[1], ["https://a/", "https://a", "text/html", "200",
+                                   "max-age=1", ""])
+        self.assertEqual(len(rows), 5)
+
+    def test_plugin_reports_origin_by_type(self):
+        plugin = lovetz.CoveragePlugin()
+        plugin.check("https://a/", headers(content_type="text/html"), None, "", "",
+                     lovetz.LovetzResponseLine.parse("HTTP/1.1 200 OK"), None)
+        plugin.finish()
+        messages = [(e["url"], e["message"]) for e in plugin.events]
+        self.assertIn(("https://a type text/html",
+                       "content-security-policy present on 0% of responses (0/1)"),
+                      messages)
+        self.assertIn(("status 200",
+                       "content-security-policy present on 0% of responses (0/1)"),
+                      messages)
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_clock(self):
+        self.assertEqual(lovetz.LovetzProgress.clock(3725.9), "1:02:05")
+
+    def test_report(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as fh:
+            fh.writelines(NDJSON_LINES)
+        try:
+            out = io.StringIO()
+            plugin = Recorder()
+            progress = lovetz.LovetzProgress([("ndjson", fh.name)], [plugin],
+                                             stream=out)
+            self.assertEqual(progress.total, os.path.getsize(fh.name))
+
+            readers = progress.readers(lovetz.load_sources([("ndjson", fh.name)]))
+            items = progress.track(item for reader in readers
+                                   for item in reader.iteritem())
+            for item in items:
+                plugin.log(lovetz.LOG_WARN, item.url, "seen")
+            progress.report(final=True)
+
+            line = out.getvalue()
+            self.assertTrue(line.startswith("\r[~] 2 items ("))
+            self.assertTrue(line.endswith("\n"))
+            self.assertIn("2 findings", line)
+            self.assertNotIn("ETA", line)
+            self.assertEqual(progress.position(), progress.total)
+        finally:
+            os.unlink(fh.name)
+
+    def test_eta(self):
+        out = io.StringIO()
+        progress = lovetz.LovetzProgress([], [], stream=out)
+        progress.total = 100
+        progress.finished = 25
+        progress.start -= 10
+        progress.report()
+        self.assertIn("(25%)", out.getvalue())
+        self.assertIn("ETA 0:00:30", out.getvalue())
+
+
+DISCOVERY_HISTORY = [
+    {"url": "http://a/", "status": 200,
+     "response_headers": {"Content-Type": "text/html"},
+     "response_body": '<a href="/user/2"></a><a href="/user/3"></a>'
+                      '<img src="/cached.png"><a href="http://b/api/v1">'
+                      '<script>fetch("/never/seen")</script>'},
+    {"url": "http://a/user/1", "status": 200,
+     "response_headers": {"Content-Type": "text/html"}, "response_body": "<p>"},
+    {"url": "http://a/user/2", "status": 200,
+     "response_headers": {"Content-Type": "text/html"}, "response_body": "<p>"},
+    {"url": "http://a/user/3", "status": 200,
+     "response_headers": {"Content-Type": "text/html"}, "response_body": "<p>"},
+    {"url": "http://a/cached.png", "status": 304}]
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def items(self):
+        return [lovetz.LovetzHistoryItem.from_dict(val) for val in DISCOVERY_HISTORY]
+
+    def expected(self):
+        return {"http://a": ["http://a/never/seen"], "http://b": ["http://b/api/v1"]}
+
+    def test_inventory(self):
+        engine = make_engine("discovery")
+        for item in self.items():
+            engine.process(item)
+        self.assertEqual(engine.plugins[0].inventory(), self.expected())
+
+    def test_skipped_items_still_visited(self):
+        engine = lovetz.LovetzEngine(make_engine("discovery").plugins,
+                                     skip_status=["304"],
+                                     templater=lovetz.LovetzTemplater(),
+                                     exemplars=1)
+        for item in self.items():
+            engine.process(item)
+        self.assertEqual(engine.skipped, 1)
+        self.assertEqual(engine.templated, 2)
+        self.assertEqual(engine.plugins[0].inventory(), self.expected())
+
+    def test_deadline_items_still_visited(self):
+        engine = make_engine("discovery")
+        engine.run_prioritized(iter(self.items()), 60)
+        self.assertEqual(engine.plugins[0].inventory(), self.expected())
+
+    def test_findings(self):
+        plugin = make_engine("discovery").plugins[0]
+        engine = lovetz.LovetzEngine([plugin])
+        for item in self.items():
+            engine.process(item)
+        engine.finish()
+        messages = [(e["url"], e["message"]) for e in plugin.events]
+        self.assertIn(("http://b", "1 discovered endpoints never visited (origin not in history)"),
+                      messages)
+        self.assertIn(("http://a/never/seen", "Discovered endpoint not in history"), messages)
+
+    def test_visited_bounded(self):
+        plugin = lovetz.DiscoveryPlugin()
+        size = len(plugin.visited)
+        for n in range(5000):
+            plugin.visit("http://a/page/%d" % n)
+        self.assertEqual(len(plugin.visited), size)
+        self.assertTrue(plugin.was_visited("http://a/page/42"))
+        self.assertFalse(plugin.was_visited("http://a/never"))
+
+    def test_limit(self):
+        plugin = lovetz.DiscoveryPlugin()
+        plugin.limit = 1
+        plugin.add("http://a/1")
+        plugin.add("http://a/2")
+        plugin.add("http://a/1")
+        self.assertEqual(plugin.found, {"http://a": ["http://a/1"]})
+        self.assertEqual(plugin.overflow, {"http://a": 1})
+
+    def test_normalize(self):
+        plugin = lovetz.DiscoveryPlugin()
+        self.assertEqual(plugin.normalize("../x?y=1#z", "https://A:443/p/q"), "https://a/x")
+        self.assertEqual(plugin.normalize("//cdn:8080/lib.js", "http://a/"),
+                         "http://cdn:8080/lib.js")
+        self.assertIsNone(plugin.normalize("mailto:x@y", "http://a/"))
+        self.assertIsNone(plugin.normalize("ftp://a/", "http://a/"))
+
+    def test_inventory_option(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            history = os.path.join(tmp, "history.ndjson")
+            with open(history, "w") as fh:
+                for val in DISCOVERY_HISTORY:
+                    fh.write(json.dumps(val) + "\n")
+            out = os.path.join(tmp, "inventory.json")
+            subprocess.run([sys.executable, os.path.join(HERE, "..", "lovetz.py"),
+                            "-T", "ndjson", "-F", history, "-S", "304",
+                            "--templates", "--exemplars", "1",
+                            "--inventory", out, "-O", os.path.join(tmp, "out.json")],
+                           check=True, capture_output=True, cwd=tmp)
+            with open(out) as fh:
+                self.assertEqual(json.load(fh), self.expected())
+
+
+if __name__ == '__main__':
+    unittest.main()